@@ -0,0 +1,211 @@
+"""Incremental ingestion of the SGE accounting file into a local SQLite store of completed jobs.
+
+The accounting file is appended to by qmaster each time a job (or array task) finishes.  AccountingStore remembers the
+byte offset it has read up to, so each ingest() only reads records appended since the last call.  Per-queue and
+per-owner totals are updated as records are inserted, so summary queries don't scan the job table.
+"""
+import mmap
+import os
+import sqlite3
+import threading
+
+
+# Read at most this many bytes of the accounting file per transaction.
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Field positions in an accounting record, see accounting(5).
+_QNAME = 0
+_HOSTNAME = 1
+_OWNER = 3
+_JOB_NAME = 4
+_JOB_NUMBER = 5
+_SUBMISSION_TIME = 8
+_START_TIME = 9
+_END_TIME = 10
+_FAILED = 11
+_EXIT_STATUS = 12
+_RU_WALLCLOCK = 13
+_SLOTS = 34
+_TASK_NUMBER = 35
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS jobs (
+        job_number INTEGER, task_number INTEGER, queue TEXT, host TEXT, owner TEXT, job_name TEXT,
+        submission_time INTEGER, start_time INTEGER, end_time INTEGER, failed INTEGER, exit_status INTEGER,
+        wait_seconds INTEGER, runtime_seconds INTEGER, slots INTEGER,
+        PRIMARY KEY (job_number, task_number, start_time))''',
+    'CREATE INDEX IF NOT EXISTS jobs_end_time ON jobs (end_time)',
+    'CREATE INDEX IF NOT EXISTS jobs_queue_end_time ON jobs (queue, end_time)',
+    'CREATE INDEX IF NOT EXISTS jobs_owner_end_time ON jobs (owner, end_time)',
+    '''CREATE TABLE IF NOT EXISTS totals (
+        kind TEXT, name TEXT, jobs INTEGER, failed INTEGER, wait_seconds INTEGER, max_wait_seconds INTEGER,
+        runtime_seconds INTEGER, slot_seconds INTEGER,
+        PRIMARY KEY (kind, name))''',
+    'CREATE TABLE IF NOT EXISTS ingest_state (path TEXT PRIMARY KEY, inode INTEGER, offset INTEGER)',
+]
+
+
+def _parse_record(line):
+    """Parse one line of the accounting file into a tuple of jobs table values, or None if it isn't a job record."""
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split(':')
+    if len(fields) <= _TASK_NUMBER:
+        return None
+    try:
+        submission_time = int(fields[_SUBMISSION_TIME])
+        start_time = int(fields[_START_TIME])
+        end_time = int(fields[_END_TIME])
+        if start_time == 0:
+            wait_seconds = end_time - submission_time  # Job was deleted or failed before it started.
+        else:
+            wait_seconds = start_time - submission_time
+        return (
+            int(fields[_JOB_NUMBER]),
+            int(fields[_TASK_NUMBER]),
+            fields[_QNAME],
+            fields[_HOSTNAME],
+            fields[_OWNER],
+            fields[_JOB_NAME],
+            submission_time,
+            start_time,
+            end_time,
+            int(fields[_FAILED]),
+            int(fields[_EXIT_STATUS]),
+            max(0, wait_seconds),
+            int(float(fields[_RU_WALLCLOCK])),
+            int(fields[_SLOTS]),
+        )
+    except ValueError:
+        return None
+
+
+class AccountingStore:
+    def __init__(self, db_path, accounting_path):
+        """Constructor
+
+        Args:
+            db_path (string) - Path of the SQLite database.  Created if it doesn't exist.
+            accounting_path (string) - Path of the SGE accounting file.
+        """
+        self._accounting_path = accounting_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    def _read_state(self):
+        row = self._db.execute('SELECT inode, offset FROM ingest_state WHERE path = ?', (self._accounting_path,)).fetchone()
+        return (row['inode'], row['offset']) if row else (None, 0)
+
+    def _insert(self, records):
+        """Insert job records and update totals.  Records already in the store are skipped."""
+        for record in records:
+            cursor = self._db.execute('INSERT OR IGNORE INTO jobs VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)', record)
+            if cursor.rowcount == 0:
+                continue
+            queue, owner = record[2], record[4]
+            failed = 1 if record[9] != 0 or record[10] != 0 else 0
+            wait_seconds, runtime_seconds, slots = record[11], record[12], record[13]
+            for kind, name in (('queue', queue), ('owner', owner)):
+                self._db.execute('INSERT OR IGNORE INTO totals VALUES (?, ?, 0, 0, 0, 0, 0, 0)', (kind, name))
+                self._db.execute('''UPDATE totals SET jobs = jobs + 1, failed = failed + ?,
+                                    wait_seconds = wait_seconds + ?, max_wait_seconds = MAX(max_wait_seconds, ?),
+                                    runtime_seconds = runtime_seconds + ?, slot_seconds = slot_seconds + ?
+                                    WHERE kind = ? AND name = ?''',
+                                 (failed, wait_seconds, wait_seconds, runtime_seconds, runtime_seconds * slots, kind, name))
+
+    def ingest(self):
+        """Read records appended to the accounting file since the last call.
+
+        Returns:
+            The number of bytes read.
+        """
+        try:
+            f = open(self._accounting_path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f, self._lock:
+            stat = os.fstat(f.fileno())
+            inode, offset = self._read_state()
+            if inode != stat.st_ino or stat.st_size < offset:
+                offset = 0  # File was rotated or truncated.
+            start_offset = offset
+            if stat.st_size > offset:
+                with mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ) as m:
+                    while offset < stat.st_size:
+                        chunk_end = min(offset + CHUNK_SIZE, stat.st_size)
+                        # Only read up to the end of the last complete line.
+                        line_end = m.rfind(b'\n', offset, chunk_end)
+                        if line_end < 0:
+                            if chunk_end == stat.st_size:
+                                break
+                            line_end = m.find(b'\n', chunk_end)
+                            if line_end < 0:
+                                break
+                        lines = m[offset:line_end].decode('utf-8', errors='replace').split('\n')
+                        with self._db:
+                            self._insert(r for r in (_parse_record(l) for l in lines) if r is not None)
+                            offset = line_end + 1
+                            self._db.execute('INSERT OR REPLACE INTO ingest_state VALUES (?, ?, ?)',
+                                             (self._accounting_path, stat.st_ino, offset))
+            return offset - start_offset
+
+    def totals(self, kind):
+        """Get totals for all time.
+
+        Args:
+            kind (string) - 'queue' or 'owner'.
+
+        Returns:
+            [{}] - One dict per queue or owner with name, jobs, failed, failure_rate, mean_wait_seconds,
+                   max_wait_seconds, mean_runtime_seconds and slot_hours.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM totals WHERE kind = ? ORDER BY name', (kind,)).fetchall()
+        return [{
+            'name': row['name'],
+            'jobs': row['jobs'],
+            'failed': row['failed'],
+            'failure_rate': row['failed'] / row['jobs'],
+            'mean_wait_seconds': row['wait_seconds'] / row['jobs'],
+            'max_wait_seconds': row['max_wait_seconds'],
+            'mean_runtime_seconds': row['runtime_seconds'] / row['jobs'],
+            'slot_hours': row['slot_seconds'] / 3600.0,
+        } for row in rows if row['jobs'] > 0]
+
+    def summary(self, kind, since):
+        """Get per-queue or per-owner statistics of jobs which ended at or after since.
+
+        Args:
+            kind (string) - 'queue' or 'owner'.
+            since (int) - Unix timestamp in seconds.
+        """
+        column = 'queue' if kind == 'queue' else 'owner'
+        with self._lock:
+            rows = self._db.execute('''SELECT %s AS name, COUNT(*) AS jobs,
+                                       SUM(failed != 0 OR exit_status != 0) AS failed,
+                                       AVG(wait_seconds) AS mean_wait_seconds, MAX(wait_seconds) AS max_wait_seconds,
+                                       AVG(runtime_seconds) AS mean_runtime_seconds,
+                                       SUM(runtime_seconds * slots) / 3600.0 AS slot_hours
+                                       FROM jobs WHERE end_time >= ? GROUP BY %s ORDER BY %s''' % (column, column, column),
+                                    (since,)).fetchall()
+        return [dict(row, failure_rate=row['failed'] / row['jobs']) for row in rows]
+
+    def jobs(self, queue=None, owner=None, since=0, limit=100):
+        """Get the most recently completed jobs, newest first, optionally filtered by queue and owner."""
+        conditions = ['end_time >= ?']
+        parameters = [since]
+        if queue is not None:
+            conditions.append('queue = ?')
+            parameters.append(queue)
+        if owner is not None:
+            conditions.append('owner = ?')
+            parameters.append(owner)
+        parameters.append(limit)
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM jobs WHERE %s ORDER BY end_time DESC LIMIT ?' % ' AND '.join(conditions),
+                                    parameters).fetchall()
+        return [dict(row) for row in rows]
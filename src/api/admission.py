@@ -0,0 +1,172 @@
+"""Admission control for the commands the API server runs, so bursts of requests can't overload qmaster or the host.
+
+Commands are grouped into classes, each with a concurrency limit and a bounded wait queue.  A command which can't start
+within max_wait seconds, or arrives when the wait queue is full, is shed: admit() raises Rejected, and the route serves
+its last good result or a 503 with Retry-After.
+
+StarCluster addnode and removenode commands run one at a time in the background, so they reserve a slot when queued
+and hold it until they finish.  A reservation never waits, so the limit of their class bounds the operations queued
+or running.
+"""
+import contextlib
+import threading
+import time
+
+
+# Command classes
+SGE_QUERY = 'sge_query'  # qhost and qstat job lists
+SGE_DETAILS = 'sge_details'  # qstat -j
+LISTING = 'listing'  # starcluster listclusters, listinstances and spothistory, or their EC2 queries
+MUTATION = 'mutation'  # qdel and qmod
+STARCLUSTER = 'starcluster'  # starcluster addnode and removenode, queued or running
+
+# Default number of concurrent commands of each class.
+DEFAULT_LIMITS = {
+    SGE_QUERY: 8,
+    SGE_DETAILS: 4,
+    LISTING: 2,
+    MUTATION: 2,
+    STARCLUSTER: 4,
+}
+DEFAULT_MAX_WAITING = 32
+DEFAULT_MAX_WAIT = 10
+# Weight of the latest command in the moving average of command durations.
+DURATION_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    """A command was shed.  retry_after is a suggested number of seconds to wait before retrying."""
+    def __init__(self, command_class, retry_after):
+        super().__init__('Too many %s commands, retry after %d seconds' % (command_class, retry_after))
+        self.command_class = command_class
+        self.retry_after = retry_after
+
+
+class CommandClass:
+    def __init__(self, name, limit, max_waiting, max_wait):
+        """Constructor
+
+        Args:
+            name (string) - Name of the class.
+            limit (int) - Maximum number of commands running at once.
+            max_waiting (int) - Maximum number of commands waiting to start.  More are shed immediately.
+            max_wait (float) - Seconds a command may wait to start before it is shed.
+        """
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.running = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.mean_seconds = 0.0
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until the commands waiting now are expected to have started."""
+        return max(1, int(self.mean_seconds * (self.waiting + 1) / self.limit + 0.5))
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Wait for a slot to run a command.  Raises Rejected if the command is shed."""
+        release = self._acquire(self.max_wait)
+        try:
+            yield
+        finally:
+            release()
+
+    def reserve(self):
+        """Take a slot without waiting, for a command which runs in the background.  Raises Rejected if none is free.
+
+        Returns:
+            function - Call when the command finishes, to free the slot.  Later calls do nothing.
+        """
+        return self._acquire(0)
+
+    def _acquire(self, max_wait):
+        """Wait up to max_wait seconds for a slot, and return a function which frees it.  Raises Rejected if shed."""
+        with self._condition:
+            if self.running >= self.limit:
+                if self.waiting >= self.max_waiting or max_wait <= 0:
+                    self.shed += 1
+                    raise Rejected(self.name, self.retry_after())
+                self.waiting += 1
+                self.peak_waiting = max(self.peak_waiting, self.waiting)
+                deadline = time.monotonic() + max_wait
+                try:
+                    while self.running >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            raise Rejected(self.name, self.retry_after())
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+            self.admitted += 1
+        start = time.monotonic()
+        released = []
+
+        def release():
+            seconds = time.monotonic() - start
+            with self._condition:
+                if released:
+                    return
+                released.append(True)
+                self.running -= 1
+                if self.mean_seconds == 0:
+                    self.mean_seconds = seconds
+                else:
+                    self.mean_seconds += DURATION_SMOOTHING * (seconds - self.mean_seconds)
+                self._condition.notify()
+        return release
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'running': self.running,
+                'waiting': self.waiting,
+                'peak_waiting': self.peak_waiting,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'mean_ms': self.mean_seconds * 1000,
+            }
+
+
+_classes = {name: CommandClass(name, limit, DEFAULT_MAX_WAITING, DEFAULT_MAX_WAIT)
+            for name, limit in DEFAULT_LIMITS.items()}
+
+
+def configure(limits=None, max_waiting=DEFAULT_MAX_WAITING, max_wait=DEFAULT_MAX_WAIT):
+    """Set the limits of command classes.  Call before any commands run.
+
+    Args:
+        limits ({string: int}) - Concurrency limit by class.  Classes not listed keep their default limit.
+        max_waiting (int) - Maximum number of commands of each class waiting to start.
+        max_wait (float) - Seconds a command may wait to start before it is shed.
+    """
+    global _classes
+    limits = dict(DEFAULT_LIMITS, **(limits or {}))
+    _classes = {name: CommandClass(name, limit, max_waiting, max_wait) for name, limit in limits.items()}
+
+
+def admit(command_class):
+    """Context manager which runs its body once a command of command_class may start.  Raises Rejected if shed."""
+    return _classes[command_class].admit()
+
+
+def reserve(command_class):
+    """Take a slot of command_class for a background command without waiting.  Raises Rejected if none is free.
+
+    Returns:
+        function - Call when the command finishes, to free the slot.
+    """
+    return _classes[command_class].reserve()
+
+
+def metrics():
+    """Running, waiting, admitted and shed commands of each class."""
+    return {name: c.metrics() for name, c in _classes.items()}
@@ -1,34 +1,205 @@
 """A simple server for directing starcluster from another ec2 instance in our subnet."""
 import argparse
+import concurrent.futures
+import functools
+import os
 from flask import Flask
 from flask import jsonify
 from flask import request
+from flask import Response
 import subprocess
+import sys
+import threading
+import time
 
+# Modules shared between services are in src/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common import checkpoint
+from common import profiling
+from common import serialization
+from common import tracing
+
+import accounting
+import admission
 import cache
+import cost
+import history
+import job_store
 import sge
+import snapshot
 import starcluster
 
 
 parser = argparse.ArgumentParser(description='Run a server which exposes the starcluster and qstat APIs.')
 parser.add_argument('--host_ip', default='0.0.0.0', type=str, help='IP address of interface to listen on.')
 parser.add_argument('--port', default=6361, type=int, help='Port to listen on.')
-parser.add_argument('--cluster_name', default='dev', type=str, help='Name of the cluster to manage.')
+parser.add_argument('--cluster_name', default='dev', type=str,
+                    help='Names of the clusters to manage, comma separated.  The first is used by routes without a /clusters/<name> prefix.')
+parser.add_argument('--sge_cells', type=str,
+                    help='SGE cell of each cluster, as comma separated cluster=cell pairs.  Clusters not listed use the default cell.')
 parser.add_argument('--starcluster_config', default='/etc/starcluster/config', type=str, help='Path to starcluster config file.')
+parser.add_argument('--starcluster_path', default='/usr/local/bin/starcluster', type=str, help='Path to the starcluster command.')
+parser.add_argument('--sge_bin_dir', default='/opt/sge6/bin/linux-x64', type=str, help='Directory of the SGE commands qstat, qhost, qdel and qmod.')
+parser.add_argument('--starcluster_backend', default='cli', choices=['cli', 'ec2'],
+                    help='Run the starcluster command for list queries (cli), or query EC2 in-process (ec2, requires boto3).')
+parser.add_argument('--profile_dir', type=str, help='If specified, save cProfile output for sampled requests to this directory.')
+parser.add_argument('--profile_sample_rate', default=0.0, type=float, help='Fraction of requests to profile, if profile_dir is set.')
+parser.add_argument('--trace_file', type=str, help='If specified, append trace spans to this JSON-lines file.')
+parser.add_argument('--snapshot_interval', default=30, type=int,
+                    help='Seconds between snapshots of each cluster\'s qhost and qstat output, which requests and history read.')
+parser.add_argument('--history_interval', default=60, type=int, help='Minimum seconds between utilization history samples, taken from cluster snapshots.  0 to disable.')
+parser.add_argument('--accounting_file', type=str,
+                    help='Path to the SGE accounting file.  Accounting covers the default cluster only.  Defaults to the '
+                         'accounting file of its SGE cell.')
+parser.add_argument('--accounting_db', default='/var/tmp/observatory_accounting.sqlite', type=str, help='Path to the completed job database.')
+parser.add_argument('--accounting_interval', default=60, type=int, help='Seconds between reads of the accounting file, 0 to disable.')
+parser.add_argument('--cost_interval', default=300, type=int, help='Minimum seconds between updates of the cost ledger, taken from cluster snapshots.  0 to disable.')
+parser.add_argument('--checkpoint_file', type=str, help='If specified, save caches and history to this file, and reload them on startup.')
+parser.add_argument('--checkpoint_interval', default=300, type=int, help='Seconds between checkpoints.')
+parser.add_argument('--job_details_max_age', default=job_store.DEFAULT_MAX_AGE, type=int, help='Seconds after which qstat -j details of a queued job are fetched again.')
+parser.add_argument('--checkpoint_max_age', default=3600, type=int, help='Discard checkpointed job details older than this many seconds.')
+parser.add_argument('--concurrency_limits', type=str,
+                    help='Comma separated list of class=limit pairs overriding the number of concurrent commands of each class, '
+                         'i.e. sge_query=8,sge_details=4,listing=2,mutation=2,starcluster=4.  '
+                         'The starcluster limit counts addnode and removenode commands queued or running.')
+parser.add_argument('--max_waiting', default=admission.DEFAULT_MAX_WAITING, type=int,
+                    help='Maximum number of commands of each class waiting to start.  More are shed.')
+parser.add_argument('--max_wait', default=admission.DEFAULT_MAX_WAIT, type=float,
+                    help='Seconds a command may wait to start before it is shed.')
+parser.add_argument('--stale_max_age', default=600, type=int,
+                    help='When a command is shed, serve the last good result of the request if it is newer than this many seconds.')
 
 args = parser.parse_args()
+if args.snapshot_interval <= 0:
+    parser.error('--snapshot_interval must be positive')
+
+starcluster.STARCLUSTER_PATH = args.starcluster_path
+starcluster.CONFIG_PATH = args.starcluster_config
+sge.use_bin_dir(args.sge_bin_dir)
+if args.starcluster_backend == 'ec2':
+    starcluster.use_ec2_backend(args.starcluster_config)
+concurrency_limits = {}
+if args.concurrency_limits:
+    for pair in args.concurrency_limits.split(','):
+        name, limit = pair.split('=')
+        concurrency_limits[name] = int(limit)
+admission.configure(concurrency_limits, max_waiting=args.max_waiting, max_wait=args.max_wait)
+
+cluster_names = args.cluster_name.split(',')
+default_cluster = cluster_names[0]
+# Maps cluster name to the environment for running SGE commands against its qmaster.
+sge_envs = {name: sge.ENV for name in cluster_names}
+if args.sge_cells:
+    for pair in args.sge_cells.split(','):
+        name, cell = pair.split('=')
+        if name not in sge_envs:
+            parser.error('--sge_cells names cluster %s, which is not in --cluster_name' % name)
+        sge_envs[name] = sge.environment(cell)
+if args.accounting_file is None:
+    default_env = sge_envs[default_cluster]
+    args.accounting_file = os.path.join(default_env['SGE_ROOT'], default_env['SGE_CELL'], 'common', 'accounting')
+# Details of queued jobs in each cluster, kept between requests.
+job_stores = {name: job_store.JobStore(args.job_details_max_age) for name in cluster_names}
+# Latest qhost and qstat output of each cluster.  Requests take a snapshot themselves if the worker fell behind.
+snapshot_workers = {name: snapshot.SnapshotWorker(name, sge_envs[name], 2 * args.snapshot_interval)
+                    for name in cluster_names}
 
 
 app = Flask(__name__)
+tracing.configure('api-server', trace_file=args.trace_file)
+tracing.init_app(app)
+profiling.init_app(app, profile_dir=args.profile_dir, sample_rate=args.profile_sample_rate)
+
+
+def respond(obj):
+    """Serialize obj as MessagePack if the client prefers it and msgpack is installed, otherwise as JSON."""
+    with profiling.phase('serialize'):
+        if serialization.available():
+            best = request.accept_mimetypes.best_match([serialization.JSON_MIMETYPE, serialization.MSGPACK_MIMETYPE],
+                                                       default=serialization.JSON_MIMETYPE)
+            if best == serialization.MSGPACK_MIMETYPE:
+                return Response(serialization.pack(obj), mimetype=serialization.MSGPACK_MIMETYPE)
+        return jsonify(obj)
+
+
+# Last good result of each read request, by path and query string.  Served if the request's command is shed.  Bounded,
+# since clients choose the query strings.
+LAST_GOOD_MAX_ENTRIES = 256
+_last_good_cache = cache.Cache(timeout=args.stale_max_age, max_entries=LAST_GOOD_MAX_ENTRIES)
+_shed_stats = {'stale': 0, 'unavailable': 0}
+_shed_stats_lock = threading.Lock()
+
 
+def respond_good(obj):
+    """respond(obj), keeping obj as the last good result of this request."""
+    _last_good_cache.set_value_for_key((time.time(), obj), request.full_path)
+    return respond(obj)
 
-@app.route('/status')
-def cluster_status():
+
+def respond_shed(rejected, stale=True):
+    """Response to a request whose command was shed: its last good result, if stale is true and there is one newer than
+    --stale_max_age, or 503 with Retry-After.
+
+    Args:
+        rejected (admission.Rejected) - The exception raised by the shed command.
+        stale (bool) - Whether the last good result may be served.  False for requests with side effects.
+    """
+    last_good = _last_good_cache.value_for_key(request.full_path) if stale else None
+    with _shed_stats_lock:
+        _shed_stats['stale' if last_good is not None else 'unavailable'] += 1
+    if last_good is not None:
+        saved_at, obj = last_good
+        response = respond(obj)
+        response.headers['Age'] = str(int(time.time() - saved_at))
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        return response
+    response = respond({'status': 'error', 'error': str(rejected)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
+def cluster_route(rule):
+    """Register a view for rule on the default cluster, and for /clusters/<cluster_name>/rule on each managed cluster.
+
+    The view is called with the cluster name as its first argument.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def view(cluster_name=None, **kwargs):
+            if cluster_name is None:
+                cluster_name = default_cluster
+            elif cluster_name not in sge_envs:
+                return respond({
+                    'status': 'error',
+                    'error': 'Unknown cluster %s' % cluster_name
+                })
+            return f(cluster_name, **kwargs)
+        app.route(rule)(view)
+        app.route('/clusters/<cluster_name>' + rule)(view)
+        return view
+    return decorator
+
+
+@app.route('/clusters')
+def list_managed_clusters():
+    """List the names of the clusters managed by this server.  The first is the default cluster."""
+    return respond({
+        'status': 'ok',
+        'clusters': cluster_names
+    })
+
+
+@cluster_route('/status')
+def cluster_status(cluster_name):
     try:
-        uptime, nodes = starcluster.get_status(args.cluster_name)
+        uptime, nodes = starcluster.get_status(cluster_name)
     except subprocess.CalledProcessError as e:
-        return jsonify({'status': 'error', 'error': 'An error occurred while running starcluster listclusters'})
-    return jsonify({
+        return respond({'status': 'error', 'error': 'An error occurred while running starcluster listclusters'})
+    except admission.Rejected as e:
+        return respond_shed(e)
+    return respond_good({
         'status': 'ok',
         'uptime': uptime,
         'nodes': nodes
@@ -37,50 +208,63 @@ def cluster_status():
 
 @app.route('/get_errors')
 def get_errors():
-    """Get any pending errors from starcluster background processes."""
+    """Get any pending errors from starcluster background processes, of all clusters."""
     starcluster.subprocess_q.poll()
     errors = starcluster.subprocess_q.pop_errors()
-    return jsonify({
+    return respond({
         'status': 'ok',
         'errors': errors
     })
 
 
-@app.route('/qhost')
-def qhost():
+@cluster_route('/qhost')
+def qhost(cluster_name):
     """Returns SGE execution hosts."""
     try:
-        result = sge.qhost()
+        result = snapshot_workers[cluster_name].get().hosts
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
             'status': 'error',
             'error': 'An error occurred while running qhost'
         })
-    return jsonify(result)
+    except admission.Rejected as e:
+        return respond_shed(e)
+    return respond_good(result)
 
 
-@app.route('/instances')
-def instances():
-    starcluster.subprocess_q.poll()
-    """List all AWS instances in the current cluster.  Should match up with results of /qhost, but not necessarily."""
-    try:
-        instances = starcluster.list_instances()
-    except subprocess.CalledProcessError as e:
-        return jsonify({
-            'status': 'error',
-            'error': 'An error occurred while running starcluster listinstances'
-        })
+# Cache the instance lists of our clusters briefly, since listinstances and listclusters each take several seconds.
+# One pair of listings is shared by all clusters.  Invalidated whenever an add or remove node operation completes.
+_instances_cache = cache.Cache(timeout=60)
+_instances_lock = threading.Lock()
+# Incremented by each invalidation, so a listing which was running when the cache was invalidated isn't cached.
+_instances_generation = 0
+_instances_generation_lock = threading.Lock()
+_listing_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
 
-    try:
-        clusters = starcluster.list_clusters()
-    except subprocess.CalledProcessError as e:
-        return jsonify({
-            'status': 'error',
-            'error': 'An error occurred while running starcluster listclusters'
-        })
-    instances_by_alias = {i['alias'] : i for i in instances if 'alias' in i}
-    # Find our cluster, and get its instance list.
-    cluster = next((c for c in clusters if c['name'] == args.cluster_name), None)
+
+def _invalidate_instances(operation=None):
+    """Discard cached instance lists, and any listing still running."""
+    global _instances_generation
+    with _instances_generation_lock:
+        _instances_generation += 1
+        _instances_cache.invalidate()
+
+
+starcluster.subprocess_q.add_completion_callback(_invalidate_instances)
+
+
+def _invalidate_snapshot(operation):
+    """Discard the snapshot of the cluster changed by a completed operation."""
+    worker = snapshot_workers.get(operation.cluster_name)
+    if worker is not None:
+        worker.invalidate()
+
+
+starcluster.subprocess_q.add_completion_callback(_invalidate_snapshot)
+
+
+def _join_cluster_instances(instances_by_alias, cluster):
+    """Returns the instances which belong to cluster, with their spot_request field set."""
     node_aliases = [node['alias'] for node in cluster['nodes']]
     # Note which instances are launched by spot requests.
     spot_requests = {}
@@ -89,83 +273,276 @@ def instances():
     cluster_instances = []
     for a in node_aliases:
         if a in instances_by_alias:
-            instance = instances_by_alias[a]
+            # Copy, so the cached lists don't share dicts with the listing.
+            instance = dict(instances_by_alias[a])
             # Copy spot request field over to instance.
             instance['spot_request'] = spot_requests[a]
             cluster_instances.append(instance)
-    return jsonify(cluster_instances)
+    return cluster_instances
+
+
+def _cluster_instances(cluster_name):
+    """Returns instances in cluster from the cache, or runs listinstances and listclusters concurrently."""
+    with _instances_lock:
+        instances_by_cluster = _instances_cache.value_for_key('instances')
+        if instances_by_cluster is not None:
+            return instances_by_cluster.get(cluster_name, [])
+        generation = _instances_generation
+        with profiling.phase('subprocess'):
+            instances_future = _listing_executor.submit(starcluster.list_instances)
+            clusters_future = _listing_executor.submit(starcluster.list_clusters)
+            instances = instances_future.result()
+            clusters = clusters_future.result()
+        with profiling.phase('join'):
+            instances_by_alias = {i['alias'] : i for i in instances if 'alias' in i}
+            instances_by_cluster = {c['name']: _join_cluster_instances(instances_by_alias, c)
+                                    for c in clusters if c['name'] in sge_envs}
+        with _instances_generation_lock:
+            # If invalidated while listing, the listing may predate the change, so only this caller gets it.
+            if generation == _instances_generation:
+                _instances_cache.set_value_for_key(instances_by_cluster, 'instances')
+        return instances_by_cluster.get(cluster_name, [])
 
 
-@app.route('/qstat')
-def qstat():
+@cluster_route('/instances')
+def instances(cluster_name):
+    """List all AWS instances in the cluster.  Should match up with results of /qhost, but not necessarily."""
+    starcluster.subprocess_q.poll()
+    try:
+        cluster_instances = _cluster_instances(cluster_name)
+    except subprocess.CalledProcessError as e:
+        command = 'listinstances' if 'listinstances' in str(e.cmd) else 'listclusters'
+        return respond({
+            'status': 'error',
+            'error': 'An error occurred while running starcluster %s' % command
+        })
+    except admission.Rejected as e:
+        return respond_shed(e)
+    return respond_good(cluster_instances)
+
+
+@cluster_route('/qstat')
+def qstat(cluster_name):
+    """List queued and pending jobs with full details, or the details of one job if job_id is specified.
+
+    If summary is true, returns only the fields needed for scheduling (job_id, owner, qr_name, predecessors,
+    submission_timestamp, state, queue_name, tasks, task_count, task_states), which is much cheaper to compute.
+    Each array job is one record (per queue instance for running tasks), with tasks as compact task id ranges.
+    Job environments are only included if env is true.  Jobs with identical environments have the same env_id.
+    """
     starcluster.subprocess_q.poll()
     job_id = request.args.get('job_id')
+    summary = request.args.get('summary', 'false').lower() in ('1', 'true')
+    include_env = request.args.get('env', 'false').lower() in ('1', 'true')
+    env = sge_envs[cluster_name]
     try:
-        if job_id is None:
-            queued, pending = sge.qstat()
-            all_jobs = queued + pending
-            result = [sge.qstat_job_details(int(job['job_id']), job['state'], job['queue_name']) for job in all_jobs]
+        if job_id is None and summary:
+            result = snapshot_workers[cluster_name].get().summary()
+        elif job_id is None:
+            latest = snapshot_workers[cluster_name].get()
+            result = sge.qstat_details(env, job_stores[cluster_name], include_env, jobs=(latest.queued, latest.pending))
         else:
-            result = sge.qstat_job_details(int(job_id))
+            result = sge.qstat_job_details(int(job_id), env=env)
+            if not include_env:
+                result.pop('env')
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
             'status': 'error',
             'error': 'An error occurred while running qstat'
         })
-    return jsonify(result)
+    except admission.Rejected as e:
+        return respond_shed(e)
+    if job_id is not None:
+        return respond(result)  # Not kept, since there are too many jobs.
+    return respond_good(result)
 
 
-@app.route('/jobs/<jid>/cancel')
-def cancel_job(jid):
+@cluster_route('/jobs/<jid>/cancel')
+def cancel_job(cluster_name, jid):
     try:
-        sge.qdel(int(jid))
+        sge.qdel(int(jid), sge_envs[cluster_name])
+        snapshot_workers[cluster_name].invalidate()
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
         'status': 'error',
         'error': 'An error occurred while running qdel'
     })
-    return jsonify({
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
         'status': 'ok',
     })
 
 
-@app.route('/nodes/add')
-def cluster_add_node():
+@cluster_route('/nodes/add')
+def cluster_add_node(cluster_name):
     instance_type = request.args.get('instance_type')
     spot_bid = request.args.get('spot_bid')
     zone = request.args.get('zone')
     subnet = request.args.get('subnet')
     try:
-         starcluster.add_node(args.cluster_name, instance_type=instance_type,
-                              spot_bid=spot_bid, zone=zone, subnet=subnet)
+         operation = starcluster.add_node(cluster_name, instance_type=instance_type,
+                                          spot_bid=spot_bid, zone=zone, subnet=subnet)
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
             'status': 'error',
             'error': 'An error occurred while running starcluster addnode'
         })
-    return jsonify({
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
         'status': 'ok',
+        'operation_id': operation.operation_id
     })
 
 
-@app.route('/nodes/<node_alias>/remove')
-def cluster_remove_node(node_alias):
+@cluster_route('/nodes/<node_alias>/remove')
+def cluster_remove_node(cluster_name, node_alias):
     try:
-        starcluster.remove_node(args.cluster_name, node_alias)
+        operation = starcluster.remove_node(cluster_name, node_alias)
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
         'status': 'error',
         'error': 'An error occurred while running starcluster removenode'
     })
-    return jsonify({
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
+        'status': 'ok',
+        'operation_id': operation.operation_id
+    })
+
+
+@cluster_route('/nodes/remove')
+def cluster_remove_nodes(cluster_name):
+    """Remove several nodes at once.  Takes a comma separated list of node aliases in the aliases parameter."""
+    node_aliases = [a for a in request.args.get('aliases', '').split(',') if a]
+    if not node_aliases:
+        return respond({
+            'status': 'error',
+            'error': 'No node aliases specified'
+        })
+    try:
+        operation = starcluster.remove_nodes(cluster_name, node_aliases)
+    except subprocess.CalledProcessError as e:
+        return respond({
+            'status': 'error',
+            'error': 'An error occurred while running starcluster removenode'
+        })
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
+        'status': 'ok',
+        'operation_id': operation.operation_id
+    })
+
+
+@cluster_route('/nodes/<node_alias>/disable')
+def cluster_disable_node(cluster_name, node_alias):
+    """Disable the queues on a node, so SGE schedules no new jobs there."""
+    try:
+        sge.qmod_disable(node_alias, sge_envs[cluster_name])
+        snapshot_workers[cluster_name].invalidate()
+    except subprocess.CalledProcessError as e:
+        return respond({
+            'status': 'error',
+            'error': 'An error occurred while running qmod'
+        })
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
         'status': 'ok',
     })
 
 
+@cluster_route('/nodes/<node_alias>/enable')
+def cluster_enable_node(cluster_name, node_alias):
+    """Re-enable the queues on a node disabled by /nodes/<node_alias>/disable."""
+    try:
+        sge.qmod_enable(node_alias, sge_envs[cluster_name])
+        snapshot_workers[cluster_name].invalidate()
+    except subprocess.CalledProcessError as e:
+        return respond({
+            'status': 'error',
+            'error': 'An error occurred while running qmod'
+        })
+    except admission.Rejected as e:
+        return respond_shed(e, stale=False)
+    return respond({
+        'status': 'ok',
+    })
+
+
+def _cluster_operation(cluster_name, operation_id):
+    """The operation with operation_id if it changes cluster_name, otherwise None."""
+    operation = starcluster.subprocess_q.operation(operation_id)
+    if operation is None or operation.cluster_name != cluster_name:
+        return None
+    return operation
+
+
+@cluster_route('/operations')
+def list_operations(cluster_name):
+    """List recent add and remove node operations of the cluster, oldest first.
+
+    Operations of all clusters run one at a time, in the order they were requested.
+    """
+    starcluster.subprocess_q.poll()
+    return respond({
+        'status': 'ok',
+        'operations': [op.to_dict() for op in starcluster.subprocess_q.operations(cluster_name)]
+    })
+
+
+@cluster_route('/operations/<operation_id>')
+def get_operation(cluster_name, operation_id):
+    """Get state, start and end time and exit code of an operation."""
+    operation = _cluster_operation(cluster_name, operation_id)
+    if operation is None:
+        return respond({
+            'status': 'error',
+            'error': 'No operation with id %s' % operation_id
+        })
+    return respond(dict(operation.to_dict(), status='ok'))
+
+
+@cluster_route('/operations/<operation_id>/tail')
+def tail_operation(cluster_name, operation_id):
+    """Get output lines of an operation.
+
+    Query parameters:
+        after - Only return lines with sequence number greater than after.
+        limit - Return at most limit of the most recent lines.
+    """
+    operation = _cluster_operation(cluster_name, operation_id)
+    if operation is None:
+        return respond({
+            'status': 'error',
+            'error': 'No operation with id %s' % operation_id
+        })
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    return respond({
+        'status': 'ok',
+        'state': operation.state,
+        'lines': operation.tail(after=after, limit=limit)
+    })
+
+
 # Cache spot prices for 30 minutes, since fetching spot prices can be slow.
 _spot_cache = cache.Cache(timeout=1800)
 
 
+def _spot_history(instance_type):
+    """Current, average and max spot price of instance_type, from the cache or starcluster spothistory."""
+    cached_value = _spot_cache.value_for_key(instance_type)
+    if cached_value is not None:
+        return cached_value
+    current, average, max = starcluster.spot_history(instance_type)
+    _spot_cache.set_value_for_key((current, average, max), instance_type)
+    return current, average, max
+
+
 @app.route('/spot_history')
 def spot_prices():
     starcluster.subprocess_q.poll()
@@ -177,12 +554,7 @@ def spot_prices():
     prices = []
     try:
         for instance_type in instance_types:
-            cached_value = _spot_cache.value_for_key(instance_type)
-            if cached_value is None:
-                current, average, max = starcluster.spot_history(instance_type)
-                _spot_cache.set_value_for_key((current, average, max), instance_type)
-            else:
-                current, average, max = cached_value
+            current, average, max = _spot_history(instance_type)
             prices.append(dict(
                 instance_type=instance_type,
                 current=current,
@@ -190,15 +562,220 @@ def spot_prices():
                 max=max
             ))
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        return respond({
             'status': 'error',
             'error': 'An error occurred while running starcluster spothistory'
         })
-    return jsonify({
+    except admission.Rejected as e:
+        return respond_shed(e)
+    return respond_good({
         'status': 'ok',
         'prices': prices
     })
 
 
+history_recorders = {name: history.HistoryRecorder() for name in cluster_names}
+
+
+# Time of the last snapshot of each cluster recorded in its history.  Listeners of a cluster only run on its snapshot
+# worker's thread, so they never run concurrently.
+_history_sampled_at = {}
+
+
+def _record_history(cluster_name, latest):
+    """Snapshot listener which samples utilization of a cluster, at most every --history_interval seconds."""
+    if latest.timestamp - _history_sampled_at.get(cluster_name, 0) < args.history_interval:
+        return
+    _history_sampled_at[cluster_name] = latest.timestamp
+    history_recorders[cluster_name].record(int(latest.timestamp * 1000),
+                                           history.sample_values(latest.hosts, latest.queued, latest.pending))
+
+
+@cluster_route('/history')
+def utilization_history(cluster_name):
+    """Get utilization history.
+
+    Query parameters:
+        start - Start of window in milliseconds since the epoch.  Defaults to one hour before end.
+        end - End of window in milliseconds since the epoch.  Defaults to now.
+        series - Comma separated list of series names, i.e. load/dev-node001,slots_used/gpu.q,jobs/pending.
+                 Defaults to all series.
+        resolution - Minimum spacing between points in milliseconds.  Defaults to the finest resolution available for
+                     the window.
+    """
+    end = request.args.get('end', default=int(time.time() * 1000), type=int)
+    start = request.args.get('start', default=end - 3600 * 1000, type=int)
+    series = request.args.get('series')
+    resolution = request.args.get('resolution', type=int)
+    result = history_recorders[cluster_name].query(start, end, series=series.split(',') if series else None, resolution_ms=resolution)
+    result['status'] = 'ok'
+    return respond(result)
+
+
+accounting_store = None
+
+
+def _ingest_accounting():
+    """Run loop for the background thread which reads new records from the SGE accounting file."""
+    while True:
+        try:
+            accounting_store.ingest()
+        except Exception as e:
+            print('Failed to read accounting file: %s' % str(e), flush=True)
+        time.sleep(args.accounting_interval)
+
+
+@app.route('/accounting/summary')
+def accounting_summary():
+    """Get statistics of completed jobs of the default cluster per queue or per owner.
+
+    Query parameters:
+        by - 'queue' (default) or 'owner'.
+        since - Only include jobs which ended after this unix timestamp in seconds.  Defaults to all time.
+    """
+    if accounting_store is None:
+        return respond({'status': 'error', 'error': 'Accounting is disabled'})
+    kind = 'owner' if request.args.get('by') == 'owner' else 'queue'
+    since = request.args.get('since', type=int)
+    if since is None:
+        summary = accounting_store.totals(kind)
+    else:
+        summary = accounting_store.summary(kind, since)
+    return respond({'status': 'ok', 'by': kind, 'summary': summary})
+
+
+@app.route('/accounting/jobs')
+def accounting_jobs():
+    """Get recently completed jobs of the default cluster, newest first.
+
+    Query parameters:
+        queue - Only include jobs run on this queue.
+        owner - Only include jobs submitted by this user.
+        since - Only include jobs which ended after this unix timestamp in seconds.
+        limit - Maximum number of jobs to return, default 100.
+    """
+    if accounting_store is None:
+        return respond({'status': 'error', 'error': 'Accounting is disabled'})
+    jobs = accounting_store.jobs(queue=request.args.get('queue'),
+                                 owner=request.args.get('owner'),
+                                 since=request.args.get('since', default=0, type=int),
+                                 limit=request.args.get('limit', default=100, type=int))
+    return respond({'status': 'ok', 'jobs': jobs})
+
+
+cost_ledgers = {name: cost.CostLedger() for name in cluster_names}
+
+
+# Time of the last snapshot of each cluster recorded in its cost ledger.
+_cost_recorded_at = {}
+
+
+def _record_costs(cluster_name, latest):
+    """Snapshot listener which records the instances, prices and running jobs of a cluster in its cost ledger, at most
+    every --cost_interval seconds."""
+    if latest.timestamp - _cost_recorded_at.get(cluster_name, 0) < args.cost_interval:
+        return
+    instances = _cluster_instances(cluster_name)
+    spot_prices = {}
+    for instance_type in set(i['type'] for i in instances if i.get('spot_request') and 'type' in i):
+        try:
+            spot_prices[instance_type] = float(_spot_history(instance_type)[0])
+        except ValueError:
+            pass  # No price, the instances are reported in unpriced_types.
+    cost_ledgers[cluster_name].snapshot(latest.timestamp, instances, spot_prices, latest.hosts, latest.queued)
+    _cost_recorded_at[cluster_name] = latest.timestamp
+
+
+@cluster_route('/cost')
+def cluster_cost(cluster_name):
+    """Get spend of the cluster's instances to date, by queue, owner and instance type.  Each instance's cost is split
+    between the jobs running on it by slots, and idle slots are charged to owner (idle).
+
+    Query parameters:
+        since - Only include spend since the start of the UTC day containing this unix timestamp in seconds.  Defaults
+                to all spend since the ledger started.
+        period - month to only include spend since the start of the current UTC month.  Overrides since.
+    """
+    since = request.args.get('since', type=int)
+    period = request.args.get('period')
+    if period == 'month':
+        since = cost.month_start(time.time())
+    elif period is not None:
+        return respond({
+            'status': 'error',
+            'error': 'Unknown period %s' % period
+        })
+    result = cost_ledgers[cluster_name].spend(since=since)
+    result['status'] = 'ok'
+    return respond(result)
+
+
+def _shed_counts():
+    with _shed_stats_lock:
+        return dict(_shed_stats)
+
+
+@app.route('/admission')
+def admission_metrics():
+    """Get running, waiting, admitted and shed commands of each command class, and the number of shed requests answered
+    with a stale result or with 503."""
+    return respond({
+        'status': 'ok',
+        'classes': admission.metrics(),
+        'shed_responses': _shed_counts(),
+    })
+
+
+def checkpoint_state():
+    """State saved to the checkpoint file: cached listings, job details, spot prices, utilization history and cost
+    ledgers."""
+    return {
+        'instances': _instances_cache.entries(),
+        'spot_prices': _spot_cache.entries(),
+        'job_stores': {name: store.to_dict() for name, store in job_stores.items()},
+        'history': {name: recorder.to_dict() for name, recorder in history_recorders.items()},
+        'cost': {name: ledger.to_dict() for name, ledger in cost_ledgers.items()},
+    }
+
+
+def restore_checkpoint(path):
+    """Reload state saved by checkpoint_state.
+
+    Cache entries keep their original timestamps, so they expire as if the server hadn't restarted.  Job details are
+    discarded if the checkpoint is older than --checkpoint_max_age, and are pruned on the first /qstat otherwise.
+    History and cost ledgers are always reloaded.
+    """
+    saved_at, state = checkpoint.load(path)
+    if state is None:
+        return
+    _instances_cache.restore(state.get('instances', []))
+    _spot_cache.restore(state.get('spot_prices', []))
+    if time.time() - saved_at <= args.checkpoint_max_age:
+        for name, store_state in state.get('job_stores', {}).items():
+            if name in job_stores:
+                job_stores[name].restore(store_state)
+    for name, history_state in state.get('history', {}).items():
+        if name in history_recorders:
+            history_recorders[name].restore(history_state)
+    for name, ledger_state in state.get('cost', {}).items():
+        if name in cost_ledgers:
+            cost_ledgers[name].restore(ledger_state)
+    print('Restored checkpoint %s saved %d seconds ago' % (path, time.time() - saved_at), flush=True)
+
+
 if __name__ == '__main__':
+    if args.checkpoint_file:
+        restore_checkpoint(args.checkpoint_file)
+        checkpoint.save_periodically(args.checkpoint_file, args.checkpoint_interval, checkpoint_state)
+    if args.accounting_interval > 0:
+        accounting_store = accounting.AccountingStore(args.accounting_db, args.accounting_file)
+        threading.Thread(target=_ingest_accounting, daemon=True).start()
+    if args.history_interval > 0:
+        for name, worker in snapshot_workers.items():
+            worker.add_listener(functools.partial(_record_history, name))
+    if args.cost_interval > 0:
+        for name, worker in snapshot_workers.items():
+            worker.add_listener(functools.partial(_record_costs, name))
+    for worker in snapshot_workers.values():
+        worker.start(args.snapshot_interval)
     app.run(host=args.host_ip, port=args.port)
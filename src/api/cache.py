@@ -1,25 +1,67 @@
 """A simple time-expiring cache."""
 
+import collections
+import threading
 import time
 
 
 class Cache:
-    def __init__(self, timeout):
+    def __init__(self, timeout, max_entries=None):
+        """Constructor
+
+        Args:
+            timeout (float) - Seconds for which a value is returned after it is set.
+            max_entries (int) - If set, the least recently used entries are evicted to keep at most this many.
+        """
         self._timeout = timeout
-        # Contains key : (timeout, value)
-        self._spot_cache = {}
+        self._max_entries = max_entries
+        # Contains key : (timeout, value), least recently used first.
+        self._spot_cache = collections.OrderedDict()
+        self._lock = threading.Lock()
 
     def value_for_key(self, key):
         """Return value for key from cache, if present and newer than timeout."""
-        if key in self._spot_cache:
-            cache_time, value = self._spot_cache[key]
-            age = time.time() - cache_time
-            if age < self._timeout:
-                return value
+        with self._lock:
+            if key in self._spot_cache:
+                cache_time, value = self._spot_cache[key]
+                age = time.time() - cache_time
+                if age < self._timeout:
+                    self._spot_cache.move_to_end(key)
+                    return value
+                else:
+                    del self._spot_cache[key]
+                    return None
             else:
                 return None
-        else:
-            return None
 
     def set_value_for_key(self, value, key):
-        self._spot_cache[key] = (time.time(), value)
+        with self._lock:
+            self._spot_cache[key] = (time.time(), value)
+            self._spot_cache.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries beyond max_entries.  Called with the lock held."""
+        if self._max_entries is not None:
+            while len(self._spot_cache) > self._max_entries:
+                self._spot_cache.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Remove key from cache.  If key is None, remove all keys."""
+        with self._lock:
+            if key is None:
+                self._spot_cache = collections.OrderedDict()
+            else:
+                self._spot_cache.pop(key, None)
+
+    def entries(self):
+        """List of (key, cache time, value), for saving the cache."""
+        with self._lock:
+            return [(key, cache_time, value) for key, (cache_time, value) in self._spot_cache.items()]
+
+    def restore(self, entries):
+        """Add entries returned by entries().  Entries keep their original cache time, so expired ones are ignored."""
+        with self._lock:
+            for key, cache_time, value in entries:
+                self._spot_cache[key] = (cache_time, value)
+            self._evict()
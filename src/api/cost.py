@@ -0,0 +1,224 @@
+"""Accumulated spend of a cluster's instances, attributed to queues and owners.
+
+On each snapshot, the ledger charges every instance of the previous snapshot its hourly price times the time since,
+so spend is integrated incrementally and never recomputed.  An instance's charge is split between the jobs running on
+it by the slots they use, and the rest is charged to the host's queues as idle capacity (owner IDLE_OWNER).  Instances
+without SGE slots, i.e. the master and nodes which are still booting, are charged to queue UNASSIGNED.
+
+Running totals are kept since the ledger started, with a copy at the start of each UTC day, so spend to date and spend
+since any day are answered by subtracting two totals, without recomputing from history.
+"""
+import datetime
+import threading
+
+from common import aws_static
+
+
+# Owner charged for idle slots.
+IDLE_OWNER = '(idle)'
+# Queue charged for instances without SGE slots.
+UNASSIGNED = '(unassigned)'
+# Number of daily totals kept.
+MAX_DAYS = 400
+SECONDS_PER_DAY = 24 * 3600
+
+
+def _new_totals():
+    return {'total': 0.0, 'by_queue': {}, 'by_owner': {}, 'by_instance_type': {}}
+
+
+def _copy_totals(totals):
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in totals.items()}
+
+
+def _add(table, key, amount):
+    table[key] = table.get(key, 0.0) + amount
+
+
+def _difference(totals, base):
+    """totals - base, for totals which only grow."""
+    result = {'total': totals['total'] - base['total']}
+    for key in ('by_queue', 'by_owner', 'by_instance_type'):
+        result[key] = {name: value - base[key].get(name, 0.0) for name, value in totals[key].items()
+                       if value - base[key].get(name, 0.0) > 0}
+    return result
+
+
+def month_start(timestamp):
+    """Start of the UTC month containing timestamp, in unix seconds."""
+    start = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+    return int(start.timestamp())
+
+
+def instance_rate(instance, spot_prices):
+    """Hourly price of an instance, or None if unknown.
+
+    Args:
+        instance ({}) - Instance from /instances, with type and spot_request.
+        spot_prices ({string: float}) - Current spot price by instance type.
+    """
+    if instance.get('spot_request'):
+        return spot_prices.get(instance['type'])
+    return aws_static.ondemand_instance_cost.get(instance.get('type'))
+
+
+def shares(alias, hosts_by_name, running_jobs_by_host):
+    """Split of an instance's cost between (queue, owner) pairs.
+
+    Args:
+        alias (string) - The instance's node alias.
+        hosts_by_name ({string: {}}) - qhost hosts by name.
+        running_jobs_by_host ({string: [{}]}) - Running jobs from qstat, by host name.
+
+    Returns:
+        {(string, string): float} - Fraction of the instance's cost charged to each (queue, owner).
+    """
+    host = hosts_by_name.get(alias)
+    slots = {}
+    if host is not None:
+        for queue_name, queue in host['queues'].items():
+            slots[queue_name] = int(queue.get('slots') or 0)
+    total_slots = sum(slots.values())
+    if total_slots == 0:
+        return {(UNASSIGNED, IDLE_OWNER): 1.0}
+    result = {}
+    used = dict.fromkeys(slots, 0)
+    for job in running_jobs_by_host.get(alias, []):
+        queue_name = job['queue_name'].split('@')[0]
+        job_slots = job.get('task_count', 1)
+        used[queue_name] = used.get(queue_name, 0) + job_slots
+        _add(result, (queue_name, job['owner']), job_slots / float(total_slots))
+    for queue_name, queue_slots in slots.items():
+        idle = queue_slots - used[queue_name]
+        if idle > 0:
+            _add(result, (queue_name, IDLE_OWNER), idle / float(total_slots))
+    # Oversubscribed hosts: scale so the instance is charged exactly once.
+    total_share = sum(result.values())
+    if total_share > 1.0:
+        result = {key: share / total_share for key, share in result.items()}
+    return result
+
+
+class CostLedger:
+    def __init__(self, max_gap=3600):
+        """Constructor
+
+        Args:
+            max_gap (float) - Longest interval in seconds charged at the previous snapshot's prices, i.e. while the
+                              server was down.  Longer gaps are charged for max_gap only.
+        """
+        self.max_gap = max_gap
+        self._totals = _new_totals()
+        # Maps UTC day start (unix seconds) to a copy of _totals at that time, for days on which anything was charged.
+        self._days = {}
+        # (timestamp, [(rate, instance_type, {(queue, owner): share})]) of the last snapshot.
+        self._last = None
+        self._unpriced_types = set()
+        self._lock = threading.Lock()
+
+    def snapshot(self, timestamp, instances, spot_prices, hosts, running_jobs):
+        """Charge the instances of the previous snapshot up to timestamp, and start charging these ones.
+
+        Args:
+            timestamp (float) - Unix time of the snapshot.
+            instances ([{}]) - The cluster's instances, from /instances.
+            spot_prices ({string: float}) - Current spot price by instance type.
+            hosts ([{}]) - Output of sge.qhost().
+            running_jobs ([{}]) - Running jobs from sge.qstat().
+        """
+        hosts_by_name = {h['name']: h for h in hosts}
+        running_jobs_by_host = {}
+        for job in running_jobs:
+            if job.get('queue_name'):
+                running_jobs_by_host.setdefault(job['queue_name'].split('@')[-1], []).append(job)
+        charges = []
+        unpriced = set()
+        for instance in instances:
+            if instance.get('state') not in ('pending', 'running'):
+                continue
+            rate = instance_rate(instance, spot_prices)
+            if rate is None:
+                unpriced.add(instance.get('type'))
+                continue
+            charges.append((rate, instance['type'], shares(instance.get('alias'), hosts_by_name, running_jobs_by_host)))
+        with self._lock:
+            if self._last is not None and timestamp > self._last[0]:
+                self._charge(self._last[0], timestamp, self._last[1])
+            self._last = (timestamp, charges)
+            self._unpriced_types = unpriced
+
+    def _charge(self, start, end, charges):
+        """Charge charges from start to end, keeping a copy of the totals at the start of each day charged."""
+        end = min(end, start + self.max_gap)
+        while start < end:
+            day = start - start % SECONDS_PER_DAY
+            if day not in self._days:
+                # Nothing was charged since day started, so these are the totals at its start.
+                self._days[day] = _copy_totals(self._totals)
+                if len(self._days) > MAX_DAYS:
+                    del self._days[min(self._days)]
+            interval_end = min(end, day + SECONDS_PER_DAY)
+            hours = (interval_end - start) / 3600.0
+            for rate, instance_type, instance_shares in charges:
+                amount = rate * hours
+                self._totals['total'] += amount
+                _add(self._totals['by_instance_type'], instance_type, amount)
+                for (queue_name, owner), share in instance_shares.items():
+                    _add(self._totals['by_queue'], queue_name, amount * share)
+                    _add(self._totals['by_owner'], owner, amount * share)
+            start = interval_end
+
+    def _totals_at(self, day):
+        """Totals at the start of day, or None if that is before the oldest day kept."""
+        if day in self._days:
+            return self._days[day]
+        if not self._days or day < min(self._days):
+            return None
+        # Nothing was charged on day, so the totals didn't change until the next day charged, if any.
+        later = [d for d in self._days if d > day]
+        return self._days[min(later)] if later else self._totals
+
+    def spend(self, since=None):
+        """Spend to date, or since the start of the UTC day containing since.
+
+        Args:
+            since (float) - Unix time.  Rounded down to UTC midnight.  If None, or before the oldest day kept, spend
+                            since the ledger started.
+
+        Returns:
+            {} - Dict with since (start of the period, or None), as_of (time of the last snapshot), total, by_queue,
+                 by_owner, by_instance_type, hourly_rate (cost per hour of current instances) and unpriced_types.
+        """
+        with self._lock:
+            day = None if since is None else since - since % SECONDS_PER_DAY
+            base = None if day is None else self._totals_at(day)
+            result = _difference(self._totals, base) if base is not None else _copy_totals(self._totals)
+            result['since'] = day if base is not None else None
+            result['as_of'] = self._last[0] if self._last is not None else None
+            result['hourly_rate'] = sum(rate for rate, _, _ in self._last[1]) if self._last is not None else 0.0
+            result['unpriced_types'] = sorted(t for t in self._unpriced_types if t)
+        return result
+
+    def to_dict(self):
+        """Totals and the last snapshot, for saving."""
+        with self._lock:
+            return {
+                'totals': _copy_totals(self._totals),
+                'days': [[day, totals] for day, totals in self._days.items()],
+                'last': None if self._last is None else [
+                    self._last[0],
+                    [[rate, instance_type, [[q, o, s] for (q, o), s in instance_shares.items()]]
+                     for rate, instance_type, instance_shares in self._last[1]]],
+            }
+
+    def restore(self, state):
+        """Replace totals with ones saved by to_dict.  The next snapshot charges the time since the saved one, up to
+        max_gap."""
+        with self._lock:
+            self._totals = _copy_totals(state['totals'])
+            self._days = {day: totals for day, totals in state.get('days', [])}
+            last = state.get('last')
+            if last is not None:
+                self._last = (last[0], [(rate, instance_type, {(q, o): s for q, o, s in instance_shares})
+                                        for rate, instance_type, instance_shares in last[1]])
@@ -0,0 +1,164 @@
+"""Records cluster utilization over time, with automatic downsampling."""
+import collections
+import threading
+
+
+# (resolution in seconds, number of points to keep).  Resolution 0 keeps every raw sample.
+DEFAULT_LEVELS = [
+    (0, 1440),
+    (60, 1440),      # 1 day
+    (900, 2880),     # 30 days
+    (3600, 8760),    # 1 year
+]
+
+
+def sample_values(hosts, queued_jobs, pending_jobs):
+    """Compute utilization values from qhost and qstat results.
+
+    Args:
+        hosts ([{}]) - Output of sge.qhost()
+        queued_jobs ([{}]) - Running jobs from sge.qstat()
+        pending_jobs ([{}]) - Pending jobs from sge.qstat()
+
+    Returns:
+        {string: float} - Map of series name to value.  Series are load/<host>, slots/<queue>, slots_used/<queue>,
+                          jobs/running and jobs/pending.  Array job tasks are counted individually.
+    """
+    values = {
+        'jobs/running': sum(job.get('task_count', 1) for job in queued_jobs),
+        'jobs/pending': sum(job.get('task_count', 1) for job in pending_jobs),
+    }
+    for host in hosts:
+        try:
+            values['load/%s' % host['name']] = float(host.get('load_avg'))
+        except (TypeError, ValueError):
+            pass  # load_avg is '-' for hosts which are down.
+        for queue_name, queue in host['queues'].items():
+            for key in ('slots', 'slots_used'):
+                series = '%s/%s' % (key, queue_name)
+                values[series] = values.get(series, 0) + int(queue.get(key) or 0)
+    return values
+
+
+class _Level:
+    """A ring buffer of points at one resolution.  Each point is (timestamp_ms, {series: value})."""
+    def __init__(self, resolution, max_points):
+        self.resolution_ms = resolution * 1000
+        self.points = collections.deque(maxlen=max_points)
+        # Bucket being accumulated: (bucket start ms, {series: (sum, count)})
+        self._bucket_start = None
+        self._bucket = {}
+
+    def add(self, timestamp_ms, values):
+        if self.resolution_ms == 0:
+            self.points.append((timestamp_ms, values))
+            return
+        bucket_start = timestamp_ms - timestamp_ms % self.resolution_ms
+        if bucket_start != self._bucket_start:
+            self._close_bucket()
+            self._bucket_start = bucket_start
+        for series, value in values.items():
+            total, count = self._bucket.get(series, (0.0, 0))
+            self._bucket[series] = (total + value, count + 1)
+
+    def _close_bucket(self):
+        if self._bucket_start is not None and self._bucket:
+            self.points.append((self._bucket_start, {s: total / count for s, (total, count) in self._bucket.items()}))
+        self._bucket = {}
+
+    def oldest_timestamp(self):
+        return self.points[0][0] if self.points else None
+
+    def to_dict(self):
+        return {
+            'resolution_ms': self.resolution_ms,
+            'points': list(self.points),
+            'bucket_start': self._bucket_start,
+            'bucket': dict(self._bucket),
+        }
+
+    def restore(self, state):
+        self.points.extend((timestamp, values) for timestamp, values in state['points'])
+        self._bucket_start = state['bucket_start']
+        self._bucket = {series: tuple(value) for series, value in state['bucket'].items()}
+
+
+class HistoryRecorder:
+    def __init__(self, levels=DEFAULT_LEVELS):
+        """Constructor
+
+        Args:
+            levels ([(int, int)]) - List of (resolution seconds, max points), finest first.
+        """
+        self._levels = [_Level(resolution, max_points) for resolution, max_points in levels]
+        self._lock = threading.Lock()
+
+    def record(self, timestamp_ms, values):
+        """Add a sample.
+
+        Args:
+            timestamp_ms (int) - Time of the sample in milliseconds since the epoch.
+            values ({string: float}) - Map of series name to value.
+        """
+        with self._lock:
+            for level in self._levels:
+                level.add(timestamp_ms, values)
+
+    def _level_for_window(self, start_ms, end_ms, resolution_ms):
+        """Finest level with resolution of at least resolution_ms which holds data back to start_ms.
+
+        If no level reaches back to start_ms, i.e. the recorder is younger than the window, returns the finest one with
+        any points in the window, since coarser levels have fewer points or none at all yet.
+        """
+        candidates = [l for l in self._levels if resolution_ms is None or l.resolution_ms >= resolution_ms]
+        if not candidates:
+            candidates = self._levels[-1:]
+        for level in candidates:
+            oldest = level.oldest_timestamp()
+            if oldest is not None and oldest <= start_ms:
+                return level
+        for level in candidates:
+            if any(start_ms <= timestamp <= end_ms for timestamp, _ in level.points):
+                return level
+        return candidates[0]
+
+    def query(self, start_ms, end_ms, series=None, resolution_ms=None):
+        """Get samples between start_ms and end_ms.
+
+        Args:
+            start_ms (int) - Start of window, milliseconds since the epoch.
+            end_ms (int) - End of window, milliseconds since the epoch.
+            series ([string]) - Names of series to return, or None for all.
+            resolution_ms (int) - Minimum spacing between points.  If None, use the finest resolution which covers the
+                                  window.
+
+        Returns:
+            {} - Dict with resolution_ms, timestamps ([int]) and series ({string: [float or None]}) with one value
+                 per timestamp.
+        """
+        with self._lock:
+            level = self._level_for_window(start_ms, end_ms, resolution_ms)
+            points = [p for p in level.points if start_ms <= p[0] <= end_ms]
+        if series is None:
+            names = set()
+            for _, values in points:
+                names.update(values.keys())
+            series = sorted(names)
+        return {
+            'resolution_ms': level.resolution_ms,
+            'timestamps': [t for t, _ in points],
+            'series': {name: [values.get(name) for _, values in points] for name in series},
+        }
+
+    def to_dict(self):
+        """Recorded points of all levels, for saving."""
+        with self._lock:
+            return {'levels': [level.to_dict() for level in self._levels]}
+
+    def restore(self, state):
+        """Restore points saved by to_dict into levels of the same resolution."""
+        saved_levels = {level['resolution_ms']: level for level in state.get('levels', [])}
+        with self._lock:
+            for level in self._levels:
+                if level.resolution_ms in saved_levels and not level.points:
+                    level.restore(saved_levels[level.resolution_ms])
@@ -0,0 +1,158 @@
+"""Memory-efficient store of job details, shared between requests.
+
+qstat -j details of a job are fetched once and kept until the job leaves the queue or they are older than max_age, when
+they are fetched again.  State and task counts come from the qstat job list on every call, but priority, holds on
+predecessor jobs and other fields qalter can change are only as fresh as max_age.  Jobs submitted by the same user usually have identical environments of hundreds of variables, so
+environments are stored once per distinct content and referenced from job details by env_id.  Owner, queue and host
+names are interned.
+"""
+import hashlib
+import sys
+import threading
+import time
+
+
+# Fields of job details holding names repeated across many jobs.
+INTERNED_FIELDS = ('owner', 'qr_name', 'queue_name', 'state')
+# Seconds after which stored job details are fetched again.
+DEFAULT_MAX_AGE = 60
+
+
+def intern_fields(record, fields=INTERNED_FIELDS):
+    """Replace string values of fields in record with interned copies.  Returns record."""
+    for field in fields:
+        value = record.get(field)
+        if isinstance(value, str):
+            record[field] = sys.intern(value)
+    return record
+
+
+def environment_id(env):
+    """Content hash of an environment dict."""
+    h = hashlib.sha1()
+    for name in sorted(env):
+        h.update(name.encode('utf-8', errors='replace'))
+        h.update(b'\0')
+        h.update((env[name] or '').encode('utf-8', errors='replace'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+class EnvironmentTable:
+    """Reference counted environments, keyed by content hash."""
+    def __init__(self):
+        # Maps env_id to [env, reference count]
+        self._environments = {}
+
+    def add(self, env):
+        """Add a reference to env, returns its env_id."""
+        env_id = environment_id(env)
+        entry = self._environments.get(env_id)
+        if entry is None:
+            entry = self._environments[env_id] = [{sys.intern(k): v for k, v in env.items()}, 0]
+        entry[1] += 1
+        return env_id
+
+    def release(self, env_id):
+        """Remove a reference to env_id, and the environment if it was the last one."""
+        entry = self._environments.get(env_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._environments[env_id]
+
+    def get(self, env_id):
+        entry = self._environments.get(env_id)
+        return None if entry is None else entry[0]
+
+    def __len__(self):
+        return len(self._environments)
+
+    def to_dict(self):
+        """Map of env_id to environment, for saving."""
+        return {env_id: env for env_id, (env, _) in self._environments.items()}
+
+
+class JobStore:
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        """Constructor
+
+        Args:
+            max_age (float) - Seconds after which get no longer returns a job's details, so they are fetched again.
+        """
+        self.max_age = max_age
+        self.environments = EnvironmentTable()
+        # Maps job id to job details, with env replaced by env_id.
+        self._details = {}
+        # Maps job id to the unix timestamp its details were fetched.
+        self._fetch_times = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        """Stored details of job_id without env, or None if there are none or they are older than max_age."""
+        with self._lock:
+            if time.time() - self._fetch_times.get(job_id, 0) > self.max_age:
+                return None
+            return self._details.get(job_id)
+
+    def put(self, job_id, details, fetch_time=None):
+        """Store job details from sge.qstat_job_details.  Returns the stored details, without env.
+
+        Args:
+            job_id (int) - The job's id.
+            details ({}) - The job's details, with env.
+            fetch_time (float) - Unix timestamp the details were fetched, or None for now.
+        """
+        details = intern_fields(dict(details))
+        env = details.pop('env', None)
+        with self._lock:
+            details['env_id'] = self.environments.add(env) if env is not None else None
+            previous = self._details.get(job_id)
+            if previous is not None and previous['env_id'] is not None:
+                self.environments.release(previous['env_id'])
+            self._details[job_id] = details
+            self._fetch_times[job_id] = time.time() if fetch_time is None else fetch_time
+        return details
+
+    def retain(self, job_ids):
+        """Forget jobs not in job_ids, i.e. jobs which have finished."""
+        job_ids = set(job_ids)
+        with self._lock:
+            for job_id in [j for j in self._details if j not in job_ids]:
+                details = self._details.pop(job_id)
+                self._fetch_times.pop(job_id, None)
+                if details['env_id'] is not None:
+                    self.environments.release(details['env_id'])
+
+    def environment(self, env_id):
+        """The environment with env_id, or None."""
+        with self._lock:
+            return self.environments.get(env_id)
+
+    def stats(self):
+        """Number of jobs and distinct environments stored."""
+        with self._lock:
+            return {'jobs': len(self._details), 'environments': len(self.environments)}
+
+    def to_dict(self):
+        """Stored jobs and environments, for saving."""
+        with self._lock:
+            return {
+                'jobs': {str(job_id): details for job_id, details in self._details.items()},
+                'fetch_times': {str(job_id): t for job_id, t in self._fetch_times.items()},
+                'environments': self.environments.to_dict(),
+            }
+
+    def restore(self, state):
+        """Add jobs and environments saved by to_dict."""
+        environments = state.get('environments', {})
+        fetch_times = state.get('fetch_times', {})
+        for job_id, details in state.get('jobs', {}).items():
+            details = dict(details)
+            env_id = details.get('env_id')
+            if env_id is not None:
+                if env_id not in environments:
+                    continue
+                details['env'] = environments[env_id]
+            self.put(int(job_id), details, fetch_times.get(job_id, 0))
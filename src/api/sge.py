@@ -1,20 +1,56 @@
 """Wrapper for SGE commands to queue state."""
+import collections
 import os
+import shlex
 import subprocess
 import xml.etree.ElementTree
 
+from common import profiling
+
+import admission
+import job_store
+
 QSTAT_PATH = '/opt/sge6/bin/linux-x64/qstat'
 QHOST_PATH = '/opt/sge6/bin/linux-x64/qhost'
 QDEL_PATH = '/opt/sge6/bin/linux-x64/qdel'
+QMOD_PATH = '/opt/sge6/bin/linux-x64/qmod'
+
+
+def use_bin_dir(bin_dir):
+    """Run SGE commands from bin_dir instead of the default SGE installation, i.e. emulated commands for load tests."""
+    global QSTAT_PATH, QHOST_PATH, QDEL_PATH, QMOD_PATH
+    QSTAT_PATH = os.path.join(bin_dir, 'qstat')
+    QHOST_PATH = os.path.join(bin_dir, 'qhost')
+    QDEL_PATH = os.path.join(bin_dir, 'qdel')
+    QMOD_PATH = os.path.join(bin_dir, 'qmod')
+
+
+def environment(cell='default'):
+    """Environment for running SGE commands against the qmaster of the specified SGE cell."""
+    env = dict(os.environ)
+    env['HOME'] = '/home/sgeadmin'
+    env['SGE_CELL'] = cell
+    env['SGE_EXECD_PORT'] = '63232'
+    env['SGE_QMASTER_PORT'] = '63231'
+    env['SGE_ROOT'] = '/opt/sge6'
+    env['SGE_CLUSTER_NAME'] = 'starcluster'
+    return env
+
+
+ENV = environment()
+
 
+def _check_output(command, env, command_class):
+    """Run command once admitted under command_class.  Raises admission.Rejected if shed."""
+    with admission.admit(command_class), profiling.phase('subprocess', command=command):
+        return subprocess.check_output([command], env=env, shell=True)
 
-ENV = dict(os.environ)
-ENV['HOME'] = '/home/sgeadmin'
-ENV['SGE_CELL'] = 'default'
-ENV['SGE_EXECD_PORT'] = '63232'
-ENV['SGE_QMASTER_PORT'] = '63231'
-ENV['SGE_ROOT'] = '/opt/sge6'
-ENV['SGE_CLUSTER_NAME'] = 'starcluster'
+
+def _check_output_xml(command, env, command_class=admission.SGE_QUERY):
+    """Run command and parse its output as XML."""
+    result_xml = _check_output(command, env, command_class)
+    with profiling.phase('parse'):
+        return xml.etree.ElementTree.fromstring(result_xml)
 
 
 def _text_or_none(root, tag):
@@ -28,7 +64,7 @@ def _parse_job_list(job_list_element):
     def text_or_none(tag):
         elem = job_list_element.find(tag)
         return None if elem is None else elem.text
-    return {
+    return job_store.intern_fields({
         'job_id': int(job_list_element.find('JB_job_number').text),
         'state': job_list_element.get('state'),
         'name': job_list_element.find('JB_name').text,
@@ -36,42 +72,115 @@ def _parse_job_list(job_list_element):
         'state_code': job_list_element.find('state').text,
         'start_time': _text_or_none(job_list_element, 'JAT_start_time'),
         'submission_time': _text_or_none(job_list_element, 'JB_submission_time'),
-        'queue_name': job_list_element.find('queue_name').text
-    }
+        'queue_name': job_list_element.find('queue_name').text,
+        'tasks': _text_or_none(job_list_element, 'tasks'),
+    })
+
+
+def _parse_task_ranges(tasks):
+    """Parses an SGE task id list, i.e. '1-10:2,15', into a list of (first, last, step)."""
+    ranges = []
+    for part in tasks.split(','):
+        step = 1
+        if ':' in part:
+            part, step = part.split(':')
+            step = int(step)
+        if '-' in part:
+            first, last = part.split('-')
+        else:
+            first = last = part
+        ranges.append((int(first), int(last), step))
+    return ranges
+
 
+def _range_count(first, last, step):
+    return (last - first) // step + 1
+
+
+def _format_task_ranges(ranges):
+    """Formats task ranges compactly, joining adjacent and overlapping ranges of step 1."""
+    merged = []
+    for first, last, step in sorted(ranges):
+        if step == 1 and merged and merged[-1][2] == 1 and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]), 1)
+        else:
+            merged.append((first, last, step))
+    parts = []
+    for first, last, step in merged:
+        if first == last:
+            parts.append(str(first))
+        elif step == 1:
+            parts.append('%d-%d' % (first, last))
+        else:
+            parts.append('%d-%d:%d' % (first, last, step))
+    return ','.join(parts)
 
-def qstat():
+
+def _aggregate_tasks(jobs):
+    """Merge entries of the same array job into one record, with compact task ranges and per-state task counts.
+
+    Running tasks are only merged if they run on the same queue instance, so each record still has one queue_name.
+
+    Args:
+        jobs ([{}]) - Entries parsed by _parse_job_list.
+
+    Returns:
+        [{}] - One record per job (and queue instance), in order of first appearance, with tasks (string or None),
+               task_count and task_states ({state_code: count}).
+    """
+    records = collections.OrderedDict()
+    ranges = {}
+    for job in jobs:
+        key = (job['job_id'], job['queue_name'])
+        job_ranges = _parse_task_ranges(job['tasks']) if job['tasks'] else []
+        count = sum(_range_count(*r) for r in job_ranges) if job_ranges else 1
+        record = records.get(key)
+        if record is None:
+            record = records[key] = dict(job, task_count=0, task_states={})
+            ranges[key] = []
+        record['task_count'] += count
+        record['task_states'][job['state_code']] = record['task_states'].get(job['state_code'], 0) + count
+        ranges[key].extend(job_ranges)
+    for key, record in records.items():
+        record['tasks'] = _format_task_ranges(ranges[key]) if ranges[key] else None
+    return list(records.values())
+
+
+def qstat(env=ENV):
+    """Get running and pending jobs.  Array jobs are summarized by _aggregate_tasks.
+
+    Returns:
+        ([{}], [{}]) - Running jobs and pending jobs.
+    """
     command = '%s -u "*" -xml' % QSTAT_PATH
-    result_xml = subprocess.check_output([command], env=ENV, shell=True)
-    root_element = xml.etree.ElementTree.fromstring(result_xml)
+    root_element = _check_output_xml(command, env)
     queue_info_element = root_element.find('queue_info')  # Queued Jobs
     job_info_element = root_element.find('job_info')  # Pending Jobs
-    queued_jobs = [_parse_job_list(job_list) for job_list in queue_info_element]
-    pending_jobs = [_parse_job_list(job_list) for job_list in job_info_element]
+    queued_jobs = _aggregate_tasks([_parse_job_list(job_list) for job_list in queue_info_element])
+    pending_jobs = _aggregate_tasks([_parse_job_list(job_list) for job_list in job_info_element])
     return queued_jobs, pending_jobs
 
 
-def qdel(jid):
+def qdel(jid, env=ENV):
     """Cancel a running job."""
     command = '%s -j %d' % (QDEL_PATH, jid)
-    subprocess.check_output([command], env=ENV, shell=True)
+    _check_output(command, env, admission.MUTATION)
 
 
-def qstat_job_details(jid, state=None, queue_name=None):
-    """Get detailed state of a running job."""
-    command = '%s -j %d -xml' % (QSTAT_PATH, jid)
-    result_xml = subprocess.check_output([command], env=ENV, shell=True)
-    root_element = xml.etree.ElementTree.fromstring(result_xml)
-    job_info_element = root_element[0][0]
-    job_mail_list = job_info_element.find('JB_mail_list')[0]
-    stdout_path_list = job_info_element.find('JB_stdout_path_list')
-    stderr_path_list = job_info_element.find('JB_stderr_path_list')
-    hard_queue_list = job_info_element.find('JB_hard_queue_list')
-    if hard_queue_list is not None:
-        destination_ident_list = hard_queue_list.find('destin_ident_list')
-        qr_name = destination_ident_list[0]
-    else:
-        qr_name = None
+def qmod_disable(host, env=ENV):
+    """Disable all queue instances on host, so no new jobs are scheduled there.  Running jobs are not affected."""
+    command = '%s -d %s' % (QMOD_PATH, shlex.quote('*@%s' % host))
+    _check_output(command, env, admission.MUTATION)
+
+
+def qmod_enable(host, env=ENV):
+    """Enable all queue instances on host."""
+    command = '%s -e %s' % (QMOD_PATH, shlex.quote('*@%s' % host))
+    _check_output(command, env, admission.MUTATION)
+
+
+def _parse_predecessors(job_info_element):
+    """Parses the list of job ids a job depends on."""
     predecessors = []
     predecessor_list = job_info_element.find('JB_jid_predecessor_list')
     if predecessor_list is not None:
@@ -79,18 +188,86 @@ def qstat_job_details(jid, state=None, queue_name=None):
         if job_predecessors is not None:
             for predecessor in job_predecessors:
                 predecessors.append(int(predecessor.text))
-    job_details = {
+    return predecessors
+
+
+def _parse_qr_name(job_info_element):
+    """Parses the name of the queue requested by a job, or returns ''."""
+    hard_queue_list = job_info_element.find('JB_hard_queue_list')
+    if hard_queue_list is not None:
+        destination_ident_list = hard_queue_list.find('destin_ident_list')
+        return destination_ident_list[0].text
+    return ''
+
+
+def _parse_job_summary(job_info_element):
+    """Parses the fields of a job needed for scheduling decisions from a qstat -j element."""
+    return job_store.intern_fields({
         'job_id': int(job_info_element.find('JB_job_number').text),
         'owner': job_info_element.find('JB_owner').text,
+        'qr_name': _parse_qr_name(job_info_element),
+        'predecessors': _parse_predecessors(job_info_element),
+        'submission_timestamp': job_info_element.find('JB_submission_time').text
+    })
+
+
+# Lists in qstat -j output which job summaries don't use, and which can be much larger than the rest of a job.
+_SUMMARY_SKIPPED_LISTS = frozenset(['JB_env_list', 'JB_job_args'])
+# Bytes of qstat -j output parsed at a time by _parse_job_summaries.
+_PARSE_CHUNK_SIZE = 64 * 1024
+
+
+def _parse_job_summaries(result_xml):
+    """Parses the summary of each job in qstat -j "*" -xml output, one job at a time.
+
+    Entries of the lists in _SUMMARY_SKIPPED_LISTS are dropped as soon as they are parsed, and each job's element once
+    it is summarized, so neither job environments nor the whole document are ever held as a tree.
+
+    Args:
+        result_xml (bytes) - Output of qstat -j "*" -xml.
+
+    Returns:
+        [{}] - One dict per job, as returned by _parse_job_summary.
+    """
+    parser = xml.etree.ElementTree.XMLPullParser(events=('start', 'end'))
+    # Open elements, from detailed_job_info down.  Jobs are the children of djob_info, at depth 3.
+    open_elements = []
+    summaries = []
+    view = memoryview(result_xml)
+    for offset in range(0, len(view), _PARSE_CHUNK_SIZE):
+        parser.feed(view[offset:offset + _PARSE_CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                open_elements.append(elem)
+                continue
+            open_elements.pop()
+            if len(open_elements) < 2:
+                continue
+            parent = open_elements[-1]
+            if len(open_elements) == 2:
+                summaries.append(_parse_job_summary(elem))
+                parent.remove(elem)
+            elif parent.tag in _SUMMARY_SKIPPED_LISTS:
+                parent.remove(elem)
+    parser.close()
+    return summaries
+
+
+def qstat_job_details(jid, state=None, queue_name=None, env=ENV):
+    """Get detailed state of a running job."""
+    command = '%s -j %d -xml' % (QSTAT_PATH, jid)
+    root_element = _check_output_xml(command, env, admission.SGE_DETAILS)
+    job_info_element = root_element[0][0]
+    stdout_path_list = job_info_element.find('JB_stdout_path_list')
+    stderr_path_list = job_info_element.find('JB_stderr_path_list')
+    job_details = _parse_job_summary(job_info_element)
+    job_details.update({
         'name': job_info_element.find('JB_job_name').text,
         'executable': job_info_element.find('JB_script_file').text,
-        'qr_name': qr_name.text if qr_name is not None else '',
-        'predecessors': predecessors,
         'stdout_path': _text_or_none(stdout_path_list[0], 'PN_path') if stdout_path_list else '',
         'stderr_path': _text_or_none(stderr_path_list[0], 'PN_path') if stderr_path_list else '',
         'priority': job_info_element.find('JB_priority').text,
-        'submission_timestamp': job_info_element.find('JB_submission_time').text
-    }
+    })
     if state:
         job_details['state'] = state
     if queue_name:
@@ -103,7 +280,7 @@ def qstat_job_details(jid, state=None, queue_name=None):
             job_args.append(e[0].text)
     job_details['job_args'] = job_args
     # Get environment
-    env = {}
+    job_env = {}
     job_env_list = job_info_element.find('JB_env_list')
     for e in job_env_list:
         variable_name = e[0].text
@@ -111,16 +288,83 @@ def qstat_job_details(jid, state=None, queue_name=None):
             variable_value = e[1].text
         else:
             variable_value = ''
-        env[variable_name] = variable_value
-    job_details['env'] = env
+        job_env[variable_name] = variable_value
+    job_details['env'] = job_env
     return job_details
 
 
-def qhost():
+def qstat_summary(env=ENV, jobs=None):
+    """Get a summary of all queued and pending jobs, without job arguments or environment.
+
+    Uses one qstat call for the job list and one qstat -j call for all jobs, instead of one call per job.
+
+    Args:
+        env ({}) - Environment for SGE commands.
+        jobs (([{}], [{}])) - Running and pending jobs from qstat(), if already known.
+
+    Returns:
+        [{}] - A list of dicts with job_id, owner, qr_name, predecessors, submission_timestamp, state, tasks,
+               task_count, task_states and, for running jobs, queue_name.
+    """
+    queued, pending = jobs if jobs is not None else qstat(env)
+    all_jobs = queued + pending
+    if len(all_jobs) == 0:
+        return []
+    command = '%s -j "*" -xml' % QSTAT_PATH
+    result_xml = _check_output(command, env, admission.SGE_DETAILS)
+    with profiling.phase('parse'):
+        summaries_by_id = {summary['job_id']: summary for summary in _parse_job_summaries(result_xml)}
+    result = []
+    for job in all_jobs:
+        summary = summaries_by_id.get(job['job_id'])
+        if summary is None:
+            continue  # Job finished between the two qstat calls.
+        summary = dict(summary, state=job['state'], tasks=job['tasks'], task_count=job['task_count'],
+                       task_states=job['task_states'])
+        if job['queue_name']:
+            summary['queue_name'] = job['queue_name']
+        result.append(summary)
+    return result
+
+
+def qstat_details(env=ENV, store=None, include_env=False, jobs=None):
+    """Get details of all running and pending jobs.  Details of each job are kept in store until the job leaves the
+    queue, and fetched again once older than the store's max_age.
+
+    Args:
+        env ({}) - Environment for SGE commands.
+        store (job_store.JobStore) - Details of jobs fetched by previous calls.  If None, details are fetched for this
+                                     call only.
+        include_env (bool) - Include each job's environment variables as env.
+        jobs (([{}], [{}])) - Running and pending jobs from qstat(), if already known.
+
+    Returns:
+        [{}] - A list of qstat_job_details dicts, with state, queue_name, tasks, task_count, task_states and env_id.
+    """
+    if store is None:
+        store = job_store.JobStore()
+    queued, pending = jobs if jobs is not None else qstat(env)
+    all_jobs = queued + pending
+    result = []
+    for job in all_jobs:
+        details = store.get(job['job_id'])
+        if details is None:
+            details = store.put(job['job_id'], qstat_job_details(job['job_id'], env=env))
+        details = dict(details, state=job['state'], tasks=job['tasks'],
+                       task_count=job['task_count'], task_states=job['task_states'])
+        if job['queue_name']:
+            details['queue_name'] = job['queue_name']
+        if include_env:
+            details['env'] = store.environment(details['env_id'])
+        result.append(details)
+    store.retain(job['job_id'] for job in all_jobs)
+    return result
+
+
+def qhost(env=ENV):
     """Get list of hosts in grid and status."""
     command = '%s -xml -q' % QHOST_PATH
-    result_xml = subprocess.check_output([command], env=ENV, shell=True)
-    hosts_element = xml.etree.ElementTree.fromstring(result_xml)
+    hosts_element = _check_output_xml(command, env)
     hosts = []
     for host_element in hosts_element:
         if host_element.get('name') == 'global':
@@ -0,0 +1,138 @@
+"""Snapshots of each cluster's SGE state, shared by routes and background recorders.
+
+A SnapshotWorker per cluster runs qhost and qstat every interval seconds on a background thread, and passes each of
+those snapshots to its listeners, i.e. the utilization history and the cost ledger.  Routes read the latest snapshot
+with get(), which only runs the commands itself when the snapshot is older than max_age, i.e. before the first
+snapshot, after an invalidation or if the worker fell behind.  Concurrent callers then share one refresh, so a burst of
+requests costs one qhost and one qstat.  Listeners only run on the background thread, so they never delay a request.
+Commands which change SGE state invalidate the snapshot.
+
+Snapshots are shared between threads, so their hosts and jobs must be treated as read-only.
+"""
+import threading
+import time
+
+import sge
+
+
+class Snapshot:
+    """qhost and qstat output of a cluster at one time."""
+    def __init__(self, timestamp, hosts, queued, pending, env):
+        """Constructor
+
+        Args:
+            timestamp (float) - Unix time the commands were started.
+            hosts ([{}]) - Output of sge.qhost().
+            queued ([{}]) - Running jobs from sge.qstat().
+            pending ([{}]) - Pending jobs from sge.qstat().
+            env ({}) - Environment for SGE commands against the cluster's qmaster.
+        """
+        self.timestamp = timestamp
+        self.hosts = hosts
+        self.queued = queued
+        self.pending = pending
+        self._env = env
+        self._summary = None
+        self._summary_lock = threading.Lock()
+
+    def summary(self):
+        """sge.qstat_summary() of this snapshot's jobs.  Computed by the first caller, and shared with later ones."""
+        with self._summary_lock:
+            if self._summary is None:
+                self._summary = sge.qstat_summary(self._env, jobs=(self.queued, self.pending))
+            return self._summary
+
+
+class SnapshotWorker:
+    def __init__(self, cluster_name, env, max_age):
+        """Constructor
+
+        Args:
+            cluster_name (string) - Name of the cluster, for log messages.
+            env ({}) - Environment for SGE commands against the cluster's qmaster.
+            max_age (float) - Seconds after which get() takes a new snapshot instead of returning the latest one.
+        """
+        self.cluster_name = cluster_name
+        self.env = env
+        self.max_age = max_age
+        self._snapshot = None
+        # Incremented by each invalidation, so a snapshot which was being taken when it happened isn't kept.
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Held while taking a snapshot, so only one is taken at a time.
+        self._refresh_lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call listener(snapshot) with each snapshot taken by poll().  Exceptions are logged."""
+        self._listeners.append(listener)
+
+    def _current(self):
+        """The latest snapshot, or None if there is none younger than max_age."""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is not None and time.time() - snapshot.timestamp < self.max_age:
+            return snapshot
+        return None
+
+    def get(self):
+        """The latest snapshot, taking a new one if it is older than max_age.
+
+        Raises:
+            subprocess.CalledProcessError if qhost or qstat failed, or admission.Rejected if one was shed.
+        """
+        snapshot = self._current()
+        if snapshot is not None:
+            return snapshot
+        with self._refresh_lock:
+            # Another caller may have taken a snapshot while we waited for it.
+            snapshot = self._current()
+            if snapshot is not None:
+                return snapshot
+            return self._take()
+
+    def refresh(self):
+        """Take a new snapshot, and return it.  Raises like get()."""
+        with self._refresh_lock:
+            return self._take()
+
+    def invalidate(self):
+        """Discard the latest snapshot, and any snapshot being taken, so the next get() sees changes made since."""
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+    def _take(self):
+        """Run qhost and qstat, and keep the snapshot unless invalidated meanwhile."""
+        with self._lock:
+            generation = self._generation
+        timestamp = time.time()
+        hosts = sge.qhost(self.env)
+        queued, pending = sge.qstat(self.env)
+        snapshot = Snapshot(timestamp, hosts, queued, pending, self.env)
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def poll(self):
+        """Take a new snapshot, and pass it to the listeners.  Raises like get()."""
+        snapshot = self.refresh()
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print('Failed to record snapshot of %s: %s' % (self.cluster_name, str(e)), flush=True)
+
+    def start(self, interval):
+        """Take a snapshot every interval seconds on a background thread."""
+        threading.Thread(target=self._run, args=(interval,), daemon=True).start()
+
+    def _run(self, interval):
+        """Run loop for the background thread."""
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print('Failed to take snapshot of %s: %s' % (self.cluster_name, str(e)), flush=True)
+            time.sleep(interval)
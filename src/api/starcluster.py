@@ -1,6 +1,11 @@
 """Wrapper for the starcluster command."""
+import functools
 import re
 import subprocess
+
+from common import profiling
+
+import admission
 import subprocess_queue
 
 
@@ -10,11 +15,53 @@ CONFIG_PATH = '/etc/starcluster/config'
 
 subprocess_q = subprocess_queue.SubprocessQueue()
 
+# If set, list and status queries are answered in-process by this starcluster_ec2.EC2Backend instead of by running
+# the starcluster command.
+_ec2_backend = None
+
+
+def use_ec2_backend(config_path):
+    """Answer list and status queries with a long-lived EC2 client instead of the starcluster command.
+
+    Args:
+        config_path (string) - Path to the starcluster config file.
+    """
+    global _ec2_backend
+    import starcluster_ec2
+    _ec2_backend = starcluster_ec2.EC2Backend(config_path)
+
+
+def _listing(f):
+    """Admit calls of f as admission.LISTING commands, whether answered by the starcluster command or the EC2 backend.
+    Raises admission.Rejected if shed."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        with admission.admit(admission.LISTING):
+            return f(*args, **kwargs)
+    return wrapper
+
+
+def _run_mutation(command_args, identifier, cluster_name):
+    """Queue a starcluster command which changes cluster_name, holding an admission.STARCLUSTER slot until it
+    finishes.  Raises admission.Rejected if too many are queued or running."""
+    release = admission.reserve(admission.STARCLUSTER)
+    try:
+        return subprocess_q.run_command(command_args, identifier, cluster_name=cluster_name, on_finish=release)
+    except Exception:
+        release()
+        raise
+
 
 def _starcluster_command():
     return '%s -c %s' % (STARCLUSTER_PATH, CONFIG_PATH)
 
 
+def _check_output(command):
+    """Run a starcluster command, return its output as a string."""
+    with profiling.phase('subprocess', command=command):
+        return subprocess.check_output([command], shell=True).decode('utf8')
+
+
 def _is_indented(text):
     return text.startswith(' ') or text.startswith('\t')
 
@@ -76,11 +123,14 @@ def _parse_instance(instance_output):
     return instance_attributes
 
 
+@_listing
 def get_status(cluster_name):
     """Get uptime and node list from cluster."""
+    if _ec2_backend is not None:
+        return _ec2_backend.get_status(cluster_name)
     command = _starcluster_command() + ' listclusters ' + _filter_cluster_name(cluster_name)
-    result = subprocess.check_output([command], shell=True)
-    lines = result.decode('utf8').split('\n')
+    result = _check_output(command)
+    lines = result.split('\n')
     uptime_line = next((l for l in lines if 'Uptime' in l), None)
     node_lines = [l for l in lines if 'compute.amazonaws.com' in l]
     uptime = uptime_line.split(',')[1].strip()
@@ -88,12 +138,15 @@ def get_status(cluster_name):
     return uptime, nodes
 
 
+@_listing
 def list_clusters():
     """List all clusters, including their instance lists."""
+    if _ec2_backend is not None:
+        return _ec2_backend.list_clusters()
     command = _starcluster_command() + ' listclusters'
-    result = subprocess.check_output([command], shell=True)
+    result = _check_output(command)
     # listclusters output adds ----------------------------- as a header to the description of each cluster.
-    sections = re.compile('---*').split(result.decode('utf8'))
+    sections = re.compile('---*').split(result)
     clusters = []
     for i in range(1, len(sections), 2):
         cluster_name = sections[i].split(' ')[0].strip()
@@ -102,21 +155,25 @@ def list_clusters():
     return clusters
 
 
+@_listing
 def list_instances():
     """List all running instances.
 
     Returns:
         [{}] - The list of running instances.
     """
+    if _ec2_backend is not None:
+        return _ec2_backend.list_instances()
     command = _starcluster_command() + ' listinstances'
-    result = subprocess.check_output([command], shell=True)
-    sections = result.decode('utf8').strip().split('\n\n')
+    result = _check_output(command)
+    sections = result.strip().split('\n\n')
     instances = []
     for section in sections:
         instances.append(_parse_instance(section))
     return instances
 
 
+@_listing
 def spot_history(instance_type):
     """Get spot bid history for the specified instance type.
 
@@ -126,9 +183,11 @@ def spot_history(instance_type):
     Returns:
         current, average, max (string, string, string) prices in USD.
     """
+    if _ec2_backend is not None:
+        return _ec2_backend.spot_history(instance_type)
     command = _starcluster_command() + ' spothistory ' + instance_type
-    result = subprocess.check_output([command], shell=True)
-    lines = result.decode('utf8').strip().split('\n')
+    result = _check_output(command)
+    lines = result.strip().split('\n')
     current = ''
     average = ''
     max = ''
@@ -154,6 +213,12 @@ def add_node(cluster_name, instance_type=None, ami=None, spot_bid=None, zone=Non
         spot_bid (string) - If specified, launch a spot instance at the this bid price.  Otherwise, launch an on-demand instance.
         zone (string) - The availability zone to add the node to, i.e. us-west-2a
         subnet (string) - For use with --zone in a VPC - the VPC subnet for the specified availability zone.
+
+    Returns:
+        The subprocess_queue.Operation tracking the addnode command.
+
+    Raises:
+        admission.Rejected if too many addnode and removenode commands are queued or running.
     """
     command_args = [STARCLUSTER_PATH, '-c', CONFIG_PATH, 'addnode']
     if not instance_type is None:
@@ -173,7 +238,7 @@ def add_node(cluster_name, instance_type=None, ami=None, spot_bid=None, zone=Non
         command_args.append(subnet)
     command_args.append(_filter_cluster_name(cluster_name))
     # print('Detaching: ' + str(command_args))
-    subprocess_q.run_command(command_args, 'add %s' % instance_type)
+    return _run_mutation(command_args, 'add %s' % instance_type, cluster_name)
 
 
 def remove_node(cluster_name, node_alias):
@@ -184,7 +249,32 @@ def remove_node(cluster_name, node_alias):
     Args:
         cluster_name (string) - The name of the cluster
         node_alias (string) - The alias of the node to remove
+
+    Returns:
+        The subprocess_queue.Operation tracking the removenode command.
+
+    Raises:
+        admission.Rejected if too many addnode and removenode commands are queued or running.
     """
-    command_args = [STARCLUSTER_PATH, '-c', CONFIG_PATH, 'removenode', '--confirm', '-f', '-a', node_alias, _filter_cluster_name(cluster_name)]
+    return remove_nodes(cluster_name, [node_alias])
+
+
+def remove_nodes(cluster_name, node_aliases):
+    """Removes several nodes from cluster with one removenode command, which terminates them together.
+
+    Args:
+        cluster_name (string) - The name of the cluster
+        node_aliases ([string]) - The aliases of the nodes to remove
+
+    Returns:
+        The subprocess_queue.Operation tracking the removenode command.
+
+    Raises:
+        admission.Rejected if too many addnode and removenode commands are queued or running.
+    """
+    command_args = [STARCLUSTER_PATH, '-c', CONFIG_PATH, 'removenode', '--confirm', '-f']
+    for node_alias in node_aliases:
+        command_args.extend(['-a', node_alias])
+    command_args.append(_filter_cluster_name(cluster_name))
     # print('Detaching: ' + str(command_args))
-    subprocess_q.run_command(command_args, 'remove node %s' % node_alias)
+    return _run_mutation(command_args, 'remove node %s' % ', '.join(node_aliases), cluster_name)
@@ -0,0 +1,168 @@
+"""In-process replacement for the read-only starcluster commands, using a long-lived boto3 EC2 client.
+
+Each starcluster command starts a new interpreter, parses the config and connects to EC2, which takes seconds.
+EC2Backend reads the StarCluster config once and keeps one EC2 client (and its connection pool) for the lifetime of
+the server.  Its methods return the same shapes as the functions in starcluster.py which parse command output.
+
+Errors are raised as subprocess.CalledProcessError, so callers handle both backends the same way.
+"""
+import configparser
+import datetime
+import functools
+import subprocess
+
+import boto3
+import botocore.config
+import botocore.exceptions
+
+
+# StarCluster puts each cluster's nodes in a security group named with this prefix followed by the cluster name.
+CLUSTER_GROUP_PREFIX = '@sc-'
+# Number of days of spot price history to summarize, as in starcluster spothistory.
+SPOT_HISTORY_DAYS = 30
+# States of instances returned by list_instances.
+LISTED_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+
+
+def _raises_called_process_error(f):
+    """Decorator converting EC2 errors to subprocess.CalledProcessError."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            raise subprocess.CalledProcessError(1, f.__name__, output=str(e))
+    return wrapper
+
+
+def _format_elapsed(since, now):
+    """Format time since a datetime like starcluster does, i.e. 2 days, 03:04:05"""
+    elapsed = now - since
+    seconds = elapsed.seconds
+    return '%d days, %02d:%02d:%02d' % (elapsed.days, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _tags(instance):
+    return {t['Key']: t['Value'] for t in instance.get('Tags', [])}
+
+
+def _instance_dict(instance, now):
+    """Convert an EC2 instance description to the fields printed by starcluster listinstances."""
+    result = {
+        'id': instance['InstanceId'],
+        'dns_name': instance.get('PublicDnsName', ''),
+        'private_dns_name': instance.get('PrivateDnsName', ''),
+        'state': instance['State']['Name'],
+        'public_ip': instance.get('PublicIpAddress', 'N/A'),
+        'private_ip': instance.get('PrivateIpAddress', 'N/A'),
+        'vpc': instance.get('VpcId', 'N/A'),
+        'subnet': instance.get('SubnetId', 'N/A'),
+        'zone': instance['Placement']['AvailabilityZone'],
+        'ami': instance['ImageId'],
+        'virtualization': instance.get('VirtualizationType', ''),
+        'type': instance['InstanceType'],
+        'groups': ', '.join(g['GroupName'] for g in instance.get('SecurityGroups', [])),
+        'keypair': instance.get('KeyName', ''),
+        'uptime': _format_elapsed(instance['LaunchTime'], now),
+    }
+    for key, value in _tags(instance).items():
+        result[key.lower()] = value
+    return result
+
+
+class EC2Backend:
+    def __init__(self, config_path):
+        """Constructor
+
+        Args:
+            config_path (string) - Path to the starcluster config file, which contains AWS credentials and region.
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(config_path)
+        aws = config['aws info'] if config.has_section('aws info') else {}
+        self._ec2 = boto3.client(
+            'ec2',
+            aws_access_key_id=aws.get('aws_access_key_id'),
+            aws_secret_access_key=aws.get('aws_secret_access_key'),
+            region_name=aws.get('aws_region_name', 'us-east-1'),
+            config=botocore.config.Config(max_pool_connections=10, retries={'max_attempts': 3}))
+
+    def _describe_instances(self, filters):
+        instances = []
+        for page in self._ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                instances.extend(reservation['Instances'])
+        return instances
+
+    @_raises_called_process_error
+    def list_instances(self):
+        """List all running instances.  Same as starcluster.list_instances()"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        instances = self._describe_instances([{'Name': 'instance-state-name', 'Values': LISTED_STATES}])
+        return [_instance_dict(i, now) for i in instances]
+
+    def _cluster_instances(self, cluster_name=None):
+        """Map cluster name to the EC2 descriptions of its instances, for all clusters or only cluster_name."""
+        filters = [{'Name': 'instance-state-name', 'Values': LISTED_STATES}]
+        if cluster_name is not None:
+            filters.append({'Name': 'instance.group-name', 'Values': [CLUSTER_GROUP_PREFIX + cluster_name]})
+        instances = self._describe_instances(filters)
+        clusters = {}
+        for instance in instances:
+            for group in instance.get('SecurityGroups', []):
+                if group['GroupName'].startswith(CLUSTER_GROUP_PREFIX):
+                    clusters.setdefault(group['GroupName'][len(CLUSTER_GROUP_PREFIX):], []).append(instance)
+        return clusters
+
+    @_raises_called_process_error
+    def list_clusters(self):
+        """List all clusters, including their instance lists.  Same as starcluster.list_clusters()"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        clusters = []
+        for name, instances in sorted(self._cluster_instances().items()):
+            launch_time = min(i['LaunchTime'] for i in instances)
+            nodes = [{
+                'alias': _tags(i).get('alias', i['InstanceId']),
+                'state': i['State']['Name'],
+                'instance_id': i['InstanceId'],
+                'hostname': i.get('PublicDnsName', ''),
+                'spot_request': i.get('SpotInstanceRequestId'),
+            } for i in instances]
+            clusters.append({
+                'name': name,
+                'Launch time': launch_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'Uptime': _format_elapsed(launch_time, now),
+                'Zone': instances[0]['Placement']['AvailabilityZone'],
+                'Keypair': instances[0].get('KeyName', ''),
+                'Total nodes': str(len(nodes)),
+                'nodes': sorted(nodes, key=lambda n: n['alias']),
+            })
+        return clusters
+
+    @_raises_called_process_error
+    def get_status(self, cluster_name):
+        """Get uptime and node list from cluster.  Same as starcluster.get_status()"""
+        instances = self._cluster_instances(cluster_name).get(cluster_name)
+        if not instances:
+            raise subprocess.CalledProcessError(1, 'get_status', output='Cluster %s does not exist' % cluster_name)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # starcluster prints uptime as '0 days, 02:03:04', get_status returns the time part.
+        uptime = _format_elapsed(min(i['LaunchTime'] for i in instances), now).split(',')[1].strip()
+        nodes = sorted(_tags(i).get('alias', i['InstanceId']) for i in instances)
+        return uptime, nodes
+
+    @_raises_called_process_error
+    def spot_history(self, instance_type):
+        """Get spot price history for the specified instance type.  Same as starcluster.spot_history()"""
+        start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=SPOT_HISTORY_DAYS)
+        prices = []
+        paginator = self._ec2.get_paginator('describe_spot_price_history')
+        for page in paginator.paginate(InstanceTypes=[instance_type],
+                                       ProductDescriptions=['Linux/UNIX', 'Linux/UNIX (Amazon VPC)'],
+                                       StartTime=start_time):
+            prices.extend((p['Timestamp'], float(p['SpotPrice'])) for p in page['SpotPriceHistory'])
+        if not prices:
+            return '', '', ''
+        values = [price for _, price in prices]
+        current = max(prices)[1]
+        return '%f' % current, '%f' % (sum(values) / len(values)), '%f' % max(values)
@@ -1,84 +1,225 @@
 """Manages a serial queue of asynchronous tasks as subprocesses."""
+import collections
 import queue
 import subprocess
+import threading
+import time
+import uuid
 
 
-class Subprocess:
-    def __init__(self, identifier, p):
+# Number of output lines kept for each operation.
+DEFAULT_MAX_LINES = 200
+# Number of finished operations kept for inspection.
+DEFAULT_MAX_FINISHED = 50
+
+
+class Operation:
+    """A tracked subprocess, with a bounded buffer of its most recent output lines."""
+    # Operation state constants
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, operation_id, identifier, command_args, max_lines=DEFAULT_MAX_LINES, cluster_name=None,
+                 on_finish=None):
         """Constructor
 
         Args:
-            identifier (string) - An identifier for this process
-            p (subprocess.Popen) - A popen object representing the running process.
+            operation_id (string) - Unique id of this operation.
+            identifier (string) - A human-readable string to identify this process.
+            command_args ([string]) - Array of command arguments to run.
+            max_lines (int) - The number of output lines to keep.
+            cluster_name (string) - The cluster the operation changes, if any.
+            on_finish (function) - Called with no arguments when the operation finishes, if specified.
         """
+        self.operation_id = operation_id
         self.identifier = identifier
-        self.p = p
+        self.cluster_name = cluster_name
+        self.command_args = command_args
+        self.state = Operation.QUEUED
+        self.start_time = None
+        self.end_time = None
+        self.exit_code = None
+        self.p = None
+        self.on_finish = on_finish
+        # Contains (sequence number, stream name, line text)
+        self._lines = collections.deque(maxlen=max_lines)
+        self._line_count = 0
+        self._lock = threading.Lock()
+
+    def finished(self):
+        """Has the operation succeeded or failed."""
+        return self.state in (Operation.SUCCEEDED, Operation.FAILED)
+
+    def append_line(self, stream, text):
+        """Add a line of output from stream ('stdout' or 'stderr')."""
+        with self._lock:
+            self._lines.append((self._line_count, stream, text))
+            self._line_count += 1
+
+    def output(self, stream):
+        """Returns the buffered lines of stream joined into a string."""
+        with self._lock:
+            return '\n'.join(text for _, s, text in self._lines if s == stream)
+
+    def tail(self, after=None, limit=None):
+        """Returns buffered lines with sequence number greater than after.
+
+        Args:
+            after (int) - Only return lines after this sequence number.  If None, return all buffered lines.
+            limit (int) - Return at most this many of the most recent matching lines.
+
+        Returns:
+            [{}] - List of dicts with seq, stream and text.
+        """
+        with self._lock:
+            lines = [l for l in self._lines if after is None or l[0] > after]
+        if limit is not None:
+            lines = lines[-limit:] if limit > 0 else []
+        return [{'seq': seq, 'stream': stream, 'text': text} for seq, stream, text in lines]
+
+    def to_dict(self):
+        """JSON-compatible description of the operation, without output."""
+        with self._lock:
+            last_line = self._lines[-1][2] if self._lines else ''
+            line_count = self._line_count
+        return {
+            'operation_id': self.operation_id,
+            'identifier': self.identifier,
+            'cluster_name': self.cluster_name,
+            'state': self.state,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'exit_code': self.exit_code,
+            'line_count': line_count,
+            'last_line': last_line,
+        }
 
 
 class SubprocessQueue:
-    def __init__(self):
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, max_finished=DEFAULT_MAX_FINISHED):
+        """Constructor
+
+        Args:
+            max_lines (int) - The number of output lines to keep for each operation.
+            max_finished (int) - The number of finished operations to keep.
+        """
+        self._max_lines = max_lines
+        self._max_finished = max_finished
         self._command_queue = queue.Queue()
-        self._subprocesses = []
+        self._running = None
+        # Maps operation_id to Operation, in creation order.
+        self._operations = collections.OrderedDict()
         self._error_list = []
+        self._completion_callbacks = []
+        self._lock = threading.RLock()
 
-    def run_command(self, command_args, identifier=None):
+    def add_completion_callback(self, callback):
+        """Register a function to call with each Operation when it finishes."""
+        self._completion_callbacks.append(callback)
+
+    def run_command(self, command_args, identifier=None, cluster_name=None, on_finish=None):
         """Run a command in the background.
 
         Args:
             command_args ([string]) - Array of command arguments to run.
             identifier (string) - A human-readable string to identify this process.
+            cluster_name (string) - The cluster the command changes, if any.
+            on_finish (function) - Called with no arguments when the command finishes, if specified.
+
+        Returns:
+            The queued Operation.
         """
         if identifier is None:
             identifier = command_args[0]
-        self._command_queue.put((command_args, identifier))
+        operation = Operation(uuid.uuid4().hex, identifier, command_args, max_lines=self._max_lines,
+                              cluster_name=cluster_name, on_finish=on_finish)
+        with self._lock:
+            self._operations[operation.operation_id] = operation
+        self._command_queue.put(operation)
         self.poll()
+        return operation
+
+    def operation(self, operation_id):
+        """Returns the Operation with the specified id, or None."""
+        with self._lock:
+            return self._operations.get(operation_id)
+
+    def operations(self, cluster_name=None):
+        """Returns list of all known operations, or only those changing cluster_name if specified, oldest first."""
+        with self._lock:
+            return [op for op in self._operations.values() if cluster_name is None or op.cluster_name == cluster_name]
 
     def pop_errors(self):
         """Poll for errors, return all from queue."""
         self.poll()
-        errors = []
-        for failed_sp in self._error_list:
-            exit_code = failed_sp.p.poll()
-            stdout = ''
-            if failed_sp.p.stdout:
-                stdout = failed_sp.p.stdout.read().decode('utf-8')
-            stderr = ''
-            if failed_sp.p.stderr:
-                stderr = failed_sp.p.stderr.read().decode('utf-8')
-            errors.append({
-                'code': str(exit_code),
-                'error': stderr,
-                'output': stdout,
-            })
-        self._error_list = []
-        return errors
+        with self._lock:
+            failed_operations = self._error_list
+            self._error_list = []
+        return [{
+            'code': str(op.exit_code),
+            'error': op.output('stderr'),
+            'output': op.output('stdout'),
+        } for op in failed_operations]
 
     def poll(self):
-        """Check subprocesses, add failed processes to error queue."""
-        completed_indices = []
-        for i, sub in enumerate(self._subprocesses):
-            state = sub.p.poll()
-            if state is None:
-                print('%s still running' % sub.identifier)
-            elif state == 0:
-                # Examine stderr to see if we have an error
-                stderr = ''
-                if sub.p.stderr:
-                    stderr = sub.p.stderr.read().decode('utf-8')
-                if 'ERROR' in stderr:
-                    self._error_list.append(sub)
-                else:
-                    print('%s completed' % sub.identifier)
-                completed_indices.append(i)
-            else:
-                self._error_list.append(sub)
-                completed_indices.append(i)
-        for i in reversed(completed_indices):
-            del self._subprocesses[i]
-        # Start new subprocesses if needed.
-        if len(self._subprocesses) == 0:
-            if not self._command_queue.empty():
-                command_args, identifier = self._command_queue.get()
-                print(' '.join(command_args))
-                p = subprocess.Popen(command_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                self._subprocesses.append(Subprocess(identifier, p))
+        """Start the next queued command if no command is running."""
+        with self._lock:
+            if self._running is not None or self._command_queue.empty():
+                return
+            operation = self._command_queue.get()
+            print(' '.join(operation.command_args))
+            operation.start_time = time.time()
+            try:
+                operation.p = subprocess.Popen(operation.command_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:
+                operation.append_line('stderr', 'ERROR: %s' % str(e))
+                self._finish(operation, None)
+                self.poll()
+                return
+            operation.state = Operation.RUNNING
+            self._running = operation
+        threading.Thread(target=self._watch, args=(operation,), daemon=True).start()
+
+    def _watch(self, operation):
+        """Stream output of a running operation into its buffer, and record its result when it exits."""
+        readers = [threading.Thread(target=self._read_stream, args=(operation, pipe, name), daemon=True)
+                   for pipe, name in ((operation.p.stdout, 'stdout'), (operation.p.stderr, 'stderr'))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        exit_code = operation.p.wait()
+        with self._lock:
+            self._running = None
+            self._finish(operation, exit_code)
+        self.poll()
+
+    def _read_stream(self, operation, pipe, name):
+        for line in iter(pipe.readline, b''):
+            operation.append_line(name, line.decode('utf-8', errors='replace').rstrip('\n'))
+        pipe.close()
+
+    def _finish(self, operation, exit_code):
+        """Record the result of a completed operation."""
+        operation.exit_code = exit_code
+        operation.end_time = time.time()
+        # starcluster sometimes exits with status 0 after printing an error.
+        if exit_code == 0 and 'ERROR' not in operation.output('stderr'):
+            operation.state = Operation.SUCCEEDED
+            print('%s completed' % operation.identifier)
+        else:
+            operation.state = Operation.FAILED
+            self._error_list.append(operation)
+        self._prune()
+        if operation.on_finish is not None:
+            operation.on_finish()
+        for callback in self._completion_callbacks:
+            callback(operation)
+
+    def _prune(self):
+        """Drop the oldest finished operations beyond max_finished."""
+        finished_ids = [op_id for op_id, op in self._operations.items() if op.finished()]
+        for op_id in finished_ids[:max(0, len(finished_ids) - self._max_finished)]:
+            del self._operations[op_id]
@@ -0,0 +1,11 @@
+"""The API server's modules are imported by name from src/api, and shared modules from src/common, as api-server.py
+does.
+
+Run with python -m pytest from src/api.  The EC2 backend tests also need boto3 and moto.
+"""
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(API_DIR))
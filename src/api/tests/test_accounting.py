@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+import accounting
+
+
+def _record(job_number, owner='alice', queue='all.q', submitted=1000, started=1010, ended=1070, task_number=0):
+    """A line of the accounting file, see accounting(5)."""
+    fields = ['0'] * 45
+    fields[accounting._QNAME] = queue
+    fields[accounting._HOSTNAME] = 'node001'
+    fields[accounting._OWNER] = owner
+    fields[accounting._JOB_NAME] = 'job%d' % job_number
+    fields[accounting._JOB_NUMBER] = str(job_number)
+    fields[accounting._SUBMISSION_TIME] = str(submitted)
+    fields[accounting._START_TIME] = str(started)
+    fields[accounting._END_TIME] = str(ended)
+    fields[accounting._RU_WALLCLOCK] = str(ended - started)
+    fields[accounting._SLOTS] = '1'
+    fields[accounting._TASK_NUMBER] = str(task_number)
+    return ':'.join(fields) + '\n'
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'accounting.sqlite'), str(tmp_path / 'accounting')
+
+
+def _append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def _job_numbers(store):
+    return sorted(job['job_number'] for job in store.jobs())
+
+
+def test_ingest_reads_only_appended_records(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    assert store.ingest() == 0  # No accounting file yet.
+    header = '# Version: 2011.11\n'
+    records = _record(1) + _record(2)
+    _append(accounting_path, header + records)
+    assert store.ingest() == len(header + records)
+    assert store.ingest() == 0
+    _append(accounting_path, _record(3))
+    assert store.ingest() == len(_record(3))
+    assert _job_numbers(store) == [1, 2, 3]
+    assert store.totals('owner')[0]['jobs'] == 3
+
+
+def test_ingest_resumes_from_the_saved_offset(paths):
+    db_path, accounting_path = paths
+    _append(accounting_path, _record(1))
+    accounting.AccountingStore(db_path, accounting_path).ingest()
+    _append(accounting_path, _record(2))
+    store = accounting.AccountingStore(db_path, accounting_path)
+    assert store.ingest() == len(_record(2))
+    assert store.totals('queue')[0]['jobs'] == 2
+
+
+def test_partial_trailing_line_is_read_once_complete(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    line = _record(2)
+    _append(accounting_path, _record(1) + line[:40])
+    assert store.ingest() == len(_record(1))
+    assert _job_numbers(store) == [1]
+    _append(accounting_path, line[40:])
+    assert store.ingest() == len(line)
+    assert _job_numbers(store) == [1, 2]
+
+
+def test_rotated_file_is_read_from_the_start(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    _append(accounting_path, _record(1) + _record(2) + _record(3))
+    store.ingest()
+    # A new file with a new inode, shorter than the saved offset would allow for.
+    rotated = accounting_path + '.new'
+    _append(rotated, _record(4))
+    os.replace(rotated, accounting_path)
+    assert store.ingest() == len(_record(4))
+    assert _job_numbers(store) == [1, 2, 3, 4]
+
+
+def test_rotated_file_with_old_records_does_not_count_them_twice(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    _append(accounting_path, _record(1))
+    store.ingest()
+    rotated = accounting_path + '.new'
+    _append(rotated, _record(1) + _record(2) + _record(3))
+    os.replace(rotated, accounting_path)
+    store.ingest()
+    assert _job_numbers(store) == [1, 2, 3]
+    assert store.totals('owner')[0]['jobs'] == 3
+
+
+def test_truncated_file_is_read_from_the_start(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    _append(accounting_path, _record(1) + _record(2))
+    store.ingest()
+    with open(accounting_path, 'w') as f:
+        f.write(_record(3))
+    assert store.ingest() == len(_record(3))
+    assert _job_numbers(store) == [1, 2, 3]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 250, 10000])
+def test_large_files_are_read_in_chunks_of_whole_lines(paths, monkeypatch, chunk_size):
+    db_path, accounting_path = paths
+    monkeypatch.setattr(accounting, 'CHUNK_SIZE', chunk_size)
+    store = accounting.AccountingStore(db_path, accounting_path)
+    text = ''.join(_record(n, owner='user%d' % (n % 3)) for n in range(1, 21))
+    _append(accounting_path, text + _record(21)[:30])
+    assert store.ingest() == len(text)
+    assert _job_numbers(store) == list(range(1, 21))
+    assert sum(t['jobs'] for t in store.totals('owner')) == 20
+
+
+def test_totals_and_summary(paths):
+    db_path, accounting_path = paths
+    store = accounting.AccountingStore(db_path, accounting_path)
+    _append(accounting_path, _record(1, ended=1070) + _record(2, owner='bob', submitted=1000, started=1100, ended=1400)
+            + _record(3, started=0, ended=1500) + 'not a record\n')
+    store.ingest()
+    [alice, bob] = store.totals('owner')
+    assert (alice['name'], alice['jobs'], alice['max_wait_seconds']) == ('alice', 2, 500)
+    assert bob['mean_runtime_seconds'] == 300
+    assert [row['name'] for row in store.summary('owner', since=1450)] == ['alice']
@@ -0,0 +1,167 @@
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import admission
+import snapshot
+import starcluster
+import subprocess_queue
+
+
+def _run_in_thread(f):
+    """Start f on a thread, and return a list which holds its result or exception once the thread is joined."""
+    result = []
+
+    def run():
+        try:
+            result.append(f())
+        except Exception as e:
+            result.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_commands_beyond_the_limit_wait_for_a_slot():
+    command_class = admission.CommandClass('test', limit=1, max_waiting=1, max_wait=5)
+    started = threading.Event()
+
+    def second():
+        with command_class.admit():
+            started.set()
+    with command_class.admit():
+        thread, result = _run_in_thread(second)
+        time.sleep(0.1)
+        assert not started.is_set()
+        assert command_class.metrics()['waiting'] == 1
+    thread.join()
+    assert started.is_set()
+    assert command_class.metrics()['admitted'] == 2
+    assert command_class.metrics()['running'] == 0
+
+
+def test_waiting_is_bounded_by_max_wait():
+    command_class = admission.CommandClass('test', limit=1, max_waiting=1, max_wait=0.1)
+    with command_class.admit():
+        start = time.monotonic()
+        with pytest.raises(admission.Rejected):
+            with command_class.admit():
+                pass
+        assert 0.1 <= time.monotonic() - start < 1
+    assert command_class.metrics()['shed'] == 1
+    assert command_class.metrics()['waiting'] == 0
+
+
+def test_commands_beyond_max_waiting_are_shed_immediately():
+    command_class = admission.CommandClass('test', limit=1, max_waiting=1, max_wait=5)
+
+    def waiter():
+        with command_class.admit():
+            pass
+    with command_class.admit():
+        thread, result = _run_in_thread(waiter)
+        time.sleep(0.1)
+        start = time.monotonic()
+        with pytest.raises(admission.Rejected) as rejected:
+            with command_class.admit():
+                pass
+        assert time.monotonic() - start < 0.1
+        assert rejected.value.command_class == 'test'
+    thread.join()
+    assert result == [None]
+    assert command_class.metrics()['peak_waiting'] == 1
+
+
+def test_retry_after_grows_with_command_duration_and_queue():
+    command_class = admission.CommandClass('test', limit=2, max_waiting=4, max_wait=5)
+    assert command_class.retry_after() == 1
+    command_class.mean_seconds = 10
+    assert command_class.retry_after() == 5
+    command_class.waiting = 3
+    assert command_class.retry_after() == 20
+
+
+def test_reservations_never_wait_and_free_their_slot_once():
+    command_class = admission.CommandClass('test', limit=1, max_waiting=4, max_wait=5)
+    release = command_class.reserve()
+    start = time.monotonic()
+    with pytest.raises(admission.Rejected):
+        command_class.reserve()
+    assert time.monotonic() - start < 0.1
+    release()
+    release()
+    assert command_class.metrics()['running'] == 0
+    command_class.reserve()
+    assert command_class.metrics()['running'] == 1
+
+
+def test_starcluster_operations_hold_a_slot_until_they_finish(monkeypatch):
+    monkeypatch.setattr(admission, '_classes', {admission.STARCLUSTER: admission.CommandClass(
+        admission.STARCLUSTER, limit=2, max_waiting=0, max_wait=0)})
+    monkeypatch.setattr(starcluster, 'subprocess_q', subprocess_queue.SubprocessQueue())
+    monkeypatch.setattr(starcluster, 'STARCLUSTER_PATH', os.path.join(os.path.dirname(__file__), 'no-such-starcluster'))
+    # The command fails to start, so its operation finishes at once and frees its slot.
+    assert starcluster.add_node('dev', instance_type='c4.large').finished()
+    assert admission.metrics()[admission.STARCLUSTER]['running'] == 0
+
+    monkeypatch.setattr(starcluster.subprocess_q, 'poll', lambda: None)  # Queued, but never started.
+    starcluster.add_node('dev', instance_type='c4.large')
+    starcluster.remove_node('dev', 'node001')
+    with pytest.raises(admission.Rejected):
+        starcluster.remove_nodes('dev', ['node002', 'node003'])
+    assert len(starcluster.subprocess_q.operations()) == 3
+
+
+@pytest.fixture(scope='module')
+def api_server():
+    """The api-server.py module, loaded with default arguments."""
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api-server.py')
+    spec = importlib.util.spec_from_file_location('api_server', path)
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = [path]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+def _shed(*args, **kwargs):
+    raise admission.Rejected(admission.SGE_QUERY, 7)
+
+
+def test_shed_reads_serve_the_last_good_result(api_server, monkeypatch):
+    worker = api_server.snapshot_workers[api_server.default_cluster]
+    hosts = [{'name': 'node001', 'queues': {}}]
+    monkeypatch.setattr(worker, 'get', lambda: snapshot.Snapshot(time.time(), hosts, [], [], {}))
+    client = api_server.app.test_client()
+    assert client.get('/qhost').get_json() == hosts
+    monkeypatch.setattr(worker, 'get', _shed)
+    response = client.get('/qhost')
+    assert response.status_code == 200
+    assert response.get_json() == hosts
+    assert response.headers['Warning'] == '110 - "Response is Stale"'
+    assert int(response.headers['Age']) >= 0
+    # No last good result of this request.
+    response = client.get('/qhost?fresh=1')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+
+
+@pytest.mark.parametrize('path, function', [
+    ('/nodes/add?instance_type=c4.large', 'add_node'),
+    ('/nodes/node001/remove', 'remove_node'),
+    ('/nodes/remove?aliases=node001,node002', 'remove_nodes'),
+])
+def test_shed_node_changes_return_503_with_retry_after(api_server, monkeypatch, path, function):
+    monkeypatch.setattr(starcluster, function, _shed)
+    client = api_server.app.test_client()
+    response = client.get(path)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json()['status'] == 'error'
@@ -0,0 +1,114 @@
+import calendar
+import time
+
+import pytest
+
+import cost
+
+DAY = cost.SECONDS_PER_DAY
+# Midnight UTC, 2024-03-10.
+T0 = calendar.timegm((2024, 3, 10, 0, 0, 0))
+MASTER = {'alias': 'master', 'type': 'c4.large', 'state': 'running'}
+NODE = {'alias': 'node001', 'type': 'c4.large', 'state': 'running'}
+SPOT_NODE = {'alias': 'node002', 'type': 'c4.large', 'state': 'running', 'spot_request': 'sir-1'}
+HOSTS = [{'name': 'node001', 'queues': {'all.q': {'slots': '4'}}}]
+RUNNING = [{'job_id': 1, 'owner': 'alice', 'queue_name': 'all.q@node001', 'task_count': 1}]
+
+
+def test_instance_cost_is_split_between_jobs_idle_slots_and_unassigned():
+    ledger = cost.CostLedger()
+    ledger.snapshot(T0, [MASTER, NODE], {}, HOSTS, RUNNING)
+    ledger.snapshot(T0 + 3600, [MASTER, NODE], {}, HOSTS, RUNNING)
+    spend = ledger.spend()
+    assert spend['total'] == pytest.approx(0.2)
+    assert spend['by_instance_type'] == {'c4.large': pytest.approx(0.2)}
+    assert spend['by_queue'] == {'all.q': pytest.approx(0.1), cost.UNASSIGNED: pytest.approx(0.1)}
+    assert spend['by_owner'] == {'alice': pytest.approx(0.025), cost.IDLE_OWNER: pytest.approx(0.175)}
+    assert spend['hourly_rate'] == pytest.approx(0.2)
+    assert spend['as_of'] == T0 + 3600
+
+
+def test_spot_instances_are_charged_the_spot_price_or_reported_unpriced():
+    ledger = cost.CostLedger()
+    ledger.snapshot(T0, [SPOT_NODE], {}, [], [])
+    ledger.snapshot(T0 + 3600, [SPOT_NODE], {'c4.large': 0.03}, [], [])
+    assert ledger.spend()['total'] == 0.0
+    assert ledger.spend()['unpriced_types'] == []
+    ledger.snapshot(T0 + 7200, [SPOT_NODE], {'c4.large': 0.03}, [], [])
+    assert ledger.spend()['total'] == pytest.approx(0.03)
+    ledger.snapshot(T0 + 7300, [SPOT_NODE], {}, [], [])
+    assert ledger.spend()['unpriced_types'] == ['c4.large']
+
+
+def test_stopped_instances_are_not_charged():
+    ledger = cost.CostLedger()
+    stopped = dict(NODE, state='stopped')
+    ledger.snapshot(T0, [stopped], {}, HOSTS, [])
+    ledger.snapshot(T0 + 3600, [stopped], {}, HOSTS, [])
+    assert ledger.spend()['total'] == 0.0
+
+
+def test_gaps_are_charged_for_max_gap_only():
+    ledger = cost.CostLedger(max_gap=3600)
+    ledger.snapshot(T0, [NODE], {}, HOSTS, [])
+    ledger.snapshot(T0 + 5 * 3600, [NODE], {}, HOSTS, [])
+    assert ledger.spend()['total'] == pytest.approx(0.1)
+
+
+def test_spend_since_is_split_at_utc_midnight():
+    ledger = cost.CostLedger()
+    ledger.snapshot(T0 - 1800, [NODE], {}, HOSTS, [])
+    ledger.snapshot(T0 + 1800, [NODE], {}, HOSTS, [])
+    # The second day starts part way through the interval charged.
+    assert ledger.spend(since=T0 + 600)['total'] == pytest.approx(0.05)
+    assert ledger.spend(since=T0 + 600)['since'] == T0
+    assert ledger.spend()['total'] == pytest.approx(0.1)
+    # Before the oldest day kept, so spend since the ledger started.
+    assert ledger.spend(since=T0 - 10 * DAY)['since'] is None
+    assert ledger.spend(since=T0 - 10 * DAY)['total'] == pytest.approx(0.1)
+
+
+def test_spend_since_a_day_without_charges():
+    ledger = cost.CostLedger(max_gap=DAY)
+    ledger.snapshot(T0 - 3600, [NODE], {}, HOSTS, [])
+    ledger.snapshot(T0, [], {}, HOSTS, [])
+    ledger.snapshot(T0 + 2 * DAY, [NODE], {}, HOSTS, [])
+    ledger.snapshot(T0 + 2 * DAY + 3600, [NODE], {}, HOSTS, [])
+    assert ledger.spend(since=T0 + DAY)['total'] == pytest.approx(0.1)
+    assert ledger.spend()['total'] == pytest.approx(0.2)
+
+
+def test_restore_continues_charging_from_the_saved_snapshot():
+    ledger = cost.CostLedger()
+    ledger.snapshot(T0, [NODE], {}, HOSTS, RUNNING)
+    ledger.snapshot(T0 + 3600, [NODE], {}, HOSTS, RUNNING)
+    restored = cost.CostLedger()
+    restored.restore(ledger.to_dict())
+    assert restored.spend() == ledger.spend()
+    restored.snapshot(T0 + 7200, [NODE], {}, HOSTS, RUNNING)
+    assert restored.spend()['total'] == pytest.approx(0.2)
+    assert restored.spend(since=T0)['by_owner']['alice'] == pytest.approx(0.05)
+
+
+@pytest.mark.parametrize('timestamp, expected', [
+    (calendar.timegm((2024, 3, 10, 12, 30, 0)), calendar.timegm((2024, 3, 1, 0, 0, 0))),
+    (calendar.timegm((2024, 3, 1, 0, 0, 0)), calendar.timegm((2024, 3, 1, 0, 0, 0))),
+    (calendar.timegm((2024, 2, 29, 23, 59, 59)), calendar.timegm((2024, 2, 1, 0, 0, 0))),
+    (calendar.timegm((2025, 1, 1, 0, 0, 1)), calendar.timegm((2025, 1, 1, 0, 0, 0))),
+])
+def test_month_start_is_utc_midnight_on_the_first(timestamp, expected):
+    assert cost.month_start(timestamp) == expected
+
+
+def test_month_start_ignores_the_local_timezone(monkeypatch):
+    # 23:30 UTC on March 31 is already April in UTC+2, and 00:30 UTC on April 1 is still March in UTC-5.
+    monkeypatch.setenv('TZ', 'Etc/GMT-2')
+    time.tzset()
+    try:
+        assert cost.month_start(calendar.timegm((2024, 3, 31, 23, 30, 0))) == calendar.timegm((2024, 3, 1, 0, 0, 0))
+        monkeypatch.setenv('TZ', 'Etc/GMT+5')
+        time.tzset()
+        assert cost.month_start(calendar.timegm((2024, 4, 1, 0, 30, 0))) == calendar.timegm((2024, 4, 1, 0, 0, 0))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,48 @@
+import history
+
+
+HOUR_MS = 3600 * 1000
+
+
+def _record_minutes(recorder, start_ms, minutes):
+    for i in range(minutes):
+        recorder.record(start_ms + i * 60 * 1000, {'jobs/running': float(i)})
+
+
+def test_recorder_younger_than_window_returns_finest_points():
+    recorder = history.HistoryRecorder()
+    start_ms = 1000 * HOUR_MS
+    _record_minutes(recorder, start_ms, 20)
+    end_ms = start_ms + 19 * 60 * 1000
+    result = recorder.query(end_ms - HOUR_MS, end_ms)
+    assert result['resolution_ms'] == 0
+    assert len(result['timestamps']) == 20
+    assert result['series']['jobs/running'][-1] == 19.0
+
+
+def test_recorder_younger_than_window_respects_resolution():
+    recorder = history.HistoryRecorder()
+    start_ms = 1000 * HOUR_MS
+    _record_minutes(recorder, start_ms, 20)
+    end_ms = start_ms + 19 * 60 * 1000
+    result = recorder.query(end_ms - HOUR_MS, end_ms, resolution_ms=60 * 1000)
+    assert result['resolution_ms'] == 60 * 1000
+    # The bucket being accumulated isn't a point yet.
+    assert len(result['timestamps']) == 19
+
+
+def test_window_covered_by_a_level_uses_it():
+    recorder = history.HistoryRecorder(levels=[(0, 10), (60, 100)])
+    start_ms = 1000 * HOUR_MS
+    _record_minutes(recorder, start_ms, 30)
+    end_ms = start_ms + 29 * 60 * 1000
+    # The raw level only keeps the last 10 samples, so a 20 minute window needs the one minute level.
+    result = recorder.query(end_ms - 20 * 60 * 1000, end_ms)
+    assert result['resolution_ms'] == 60 * 1000
+    assert len(result['timestamps']) == 20
+
+
+def test_empty_recorder_returns_no_points():
+    result = history.HistoryRecorder().query(0, HOUR_MS)
+    assert result['timestamps'] == []
+    assert result['series'] == {}
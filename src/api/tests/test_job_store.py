@@ -0,0 +1,29 @@
+import time
+
+import job_store
+
+
+def test_details_expire_after_max_age():
+    store = job_store.JobStore(max_age=60)
+    store.put(1, {'owner': 'alice', 'priority': '0', 'env': {'HOME': '/home/alice'}})
+    store.put(2, {'owner': 'alice', 'priority': '0', 'env': {'HOME': '/home/alice'}}, time.time() - 61)
+    assert store.get(1)['priority'] == '0'
+    assert store.get(2) is None
+
+
+def test_refetched_details_replace_stored_details():
+    store = job_store.JobStore(max_age=60)
+    store.put(1, {'owner': 'alice', 'priority': '0', 'env': {'HOME': '/home/alice'}}, time.time() - 61)
+    store.put(1, {'owner': 'alice', 'priority': '-100', 'env': {'HOME': '/home/alice'}})
+    assert store.get(1)['priority'] == '-100'
+    assert store.stats() == {'jobs': 1, 'environments': 1}
+
+
+def test_restore_keeps_fetch_times():
+    store = job_store.JobStore(max_age=60)
+    store.put(1, {'owner': 'alice', 'env': {'HOME': '/home/alice'}})
+    store.put(2, {'owner': 'bob', 'env': {'HOME': '/home/bob'}}, time.time() - 61)
+    restored = job_store.JobStore(max_age=60)
+    restored.restore(store.to_dict())
+    assert restored.get(1) is not None
+    assert restored.get(2) is None
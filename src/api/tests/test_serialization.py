@@ -0,0 +1,56 @@
+import msgpack
+import pytest
+import requests
+
+from common import serialization
+
+
+def _response(body, content_type):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    return response
+
+
+def test_repeated_strings_are_replaced_by_string_table_references():
+    jobs = [{'owner': 'alice', 'queue_name': 'all.q@node001'}, {'owner': 'alice', 'queue_name': 'all.q@node002'}]
+    outer = msgpack.unpackb(serialization.pack(jobs), raw=False)
+    assert sorted(outer['strings']) == ['alice', 'owner', 'queue_name']
+    refs = []
+    msgpack.unpackb(outer['data'], raw=False, strict_map_key=False,
+                    ext_hook=lambda code, data: refs.append(code) or msgpack.ExtType(code, data))
+    assert refs and set(refs) == {serialization.STRING_REF_EXT_TYPE}
+
+
+@pytest.mark.parametrize('obj', [
+    [],
+    {'status': 'ok'},
+    [{'job_id': 1, 'owner': 'alice', 'tasks': None, 'task_states': {'r': 2, 'qw': 1}},
+     {'job_id': 2, 'owner': 'alice', 'tasks': '1-10:2', 'task_states': {'r': 1}}],
+    {'hosts': {'node001': {'queues': {'all.q': {'slots': 2}}}, 'node002': {'queues': {'all.q': {'slots': 2}}}},
+     'load': [0.5, 1.25], 'master': True},
+    {1: 'alice', 'alice': 1, 'é': ['é', 'é']},
+])
+def test_round_trip(obj):
+    assert serialization.unpack(serialization.pack(obj)) == obj
+
+
+def test_tuples_decode_as_lists():
+    assert serialization.unpack(serialization.pack({'range': (1, 10, 2)})) == {'range': [1, 10, 2]}
+
+
+def test_unknown_ext_types_are_left_alone():
+    data = msgpack.packb([msgpack.ExtType(5, b'x')], use_bin_type=True)
+    body = msgpack.packb({'strings': [], 'data': data}, use_bin_type=True)
+    assert serialization.unpack(body) == [msgpack.ExtType(5, b'x')]
+
+
+def test_decode_response_accepts_msgpack_and_json():
+    obj = [{'owner': 'alice'}, {'owner': 'alice'}]
+    assert serialization.decode_response(_response(serialization.pack(obj), serialization.MSGPACK_MIMETYPE)) == obj
+    assert serialization.decode_response(_response(b'[{"owner": "alice"}]', serialization.JSON_MIMETYPE)) == obj[:1]
+
+
+def test_request_headers_prefer_msgpack():
+    assert serialization.request_headers()['Accept'].startswith(serialization.MSGPACK_MIMETYPE)
@@ -0,0 +1,56 @@
+import pytest
+
+import sge
+
+
+def _job_xml(job_id, owner, env_size):
+    env = ''.join('<job_sublist><VA_variable>VAR_%03d</VA_variable><VA_value>/home/%s/%03d</VA_value></job_sublist>'
+                  % (i, owner, i) for i in range(env_size))
+    return ('<element>'
+            '<JB_job_number>%d</JB_job_number>'
+            '<JB_owner>%s</JB_owner>'
+            '<JB_submission_time>1000</JB_submission_time>'
+            '<JB_hard_queue_list><destin_ident_list><QR_name>cpu.q</QR_name></destin_ident_list></JB_hard_queue_list>'
+            '<JB_job_args><element><ST_name>--input=%d</ST_name></element></JB_job_args>'
+            '<JB_env_list>%s</JB_env_list>'
+            '</element>') % (job_id, owner, job_id, env)
+
+
+def _details_xml(jobs):
+    """qstat -j "*" -xml output for (job_id, owner) pairs."""
+    return ('<?xml version=\'1.0\'?><detailed_job_info><djob_info>%s</djob_info></detailed_job_info>'
+            % ''.join(_job_xml(job_id, owner, 50) for job_id, owner in jobs)).encode()
+
+
+def _queued(job_id):
+    return {'job_id': job_id, 'state': 'pending', 'tasks': None, 'task_count': 1, 'task_states': {'qw': 1},
+            'queue_name': None}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 64 * 1024])
+def test_job_summaries_are_parsed_across_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(sge, '_PARSE_CHUNK_SIZE', chunk_size)
+    summaries = sge._parse_job_summaries(_details_xml([(1, 'alice'), (2, 'bob')]))
+    assert [(s['job_id'], s['owner'], s['qr_name']) for s in summaries] == [(1, 'alice', 'cpu.q'), (2, 'bob', 'cpu.q')]
+
+
+def test_job_environments_are_dropped_while_parsing(monkeypatch):
+    parsed = []
+    parse_job_summary = sge._parse_job_summary
+
+    def record_element(job_info_element):
+        parsed.append(job_info_element)
+        return parse_job_summary(job_info_element)
+    monkeypatch.setattr(sge, '_parse_job_summary', record_element)
+    sge._parse_job_summaries(_details_xml([(1, 'alice'), (2, 'bob')]))
+    for job_info_element in parsed:
+        assert len(job_info_element.find('JB_env_list')) == 0
+        assert len(job_info_element.find('JB_job_args')) == 0
+
+
+def test_qstat_summary_has_no_environment(monkeypatch):
+    monkeypatch.setattr(sge, '_check_output', lambda command, env, command_class: _details_xml([(1, 'alice')]))
+    [summary] = sge.qstat_summary(jobs=([], [_queued(1), _queued(2)]))
+    assert summary['job_id'] == 1
+    assert summary['state'] == 'pending'
+    assert 'env' not in summary and 'job_args' not in summary
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+import sge
+import snapshot
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Counts of qhost and qstat runs, with both commands replaced by fakes."""
+    counts = {'qhost': 0, 'qstat': 0}
+
+    def qhost(env):
+        counts['qhost'] += 1
+        time.sleep(0.05)
+        return [{'name': 'node001', 'queues': {}}]
+
+    def qstat(env):
+        counts['qstat'] += 1
+        return [{'job_id': counts['qstat']}], []
+
+    monkeypatch.setattr(sge, 'qhost', qhost)
+    monkeypatch.setattr(sge, 'qstat', qstat)
+    return counts
+
+
+def test_concurrent_gets_share_one_snapshot(calls):
+    worker = snapshot.SnapshotWorker('dev', {}, max_age=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(worker.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == {'qhost': 1, 'qstat': 1}
+    assert all(result is results[0] for result in results)
+
+
+def test_get_takes_a_new_snapshot_once_older_than_max_age(calls):
+    worker = snapshot.SnapshotWorker('dev', {}, max_age=60)
+    first = worker.get()
+    assert worker.get() is first
+    first.timestamp -= 61
+    assert worker.get() is not first
+    assert calls['qstat'] == 2
+
+
+def test_invalidate_discards_the_snapshot(calls):
+    worker = snapshot.SnapshotWorker('dev', {}, max_age=60)
+    first = worker.get()
+    worker.invalidate()
+    assert worker.get().queued == [{'job_id': 2}]
+    assert worker.get() is not first
+
+
+def test_snapshot_taken_during_invalidation_is_not_kept(calls, monkeypatch):
+    worker = snapshot.SnapshotWorker('dev', {}, max_age=60)
+    qstat = sge.qstat
+
+    def invalidating_qstat(env):
+        worker.invalidate()
+        return qstat(env)
+
+    monkeypatch.setattr(sge, 'qstat', invalidating_qstat)
+    worker.refresh()
+    monkeypatch.setattr(sge, 'qstat', qstat)
+    assert worker.get().queued == [{'job_id': 2}]
+
+
+def test_listeners_see_each_polled_snapshot_and_their_errors_are_contained(calls):
+    worker = snapshot.SnapshotWorker('dev', {}, max_age=60)
+    seen = []
+
+    def failing_listener(latest):
+        raise ValueError('ledger is broken')
+
+    worker.add_listener(failing_listener)
+    worker.add_listener(seen.append)
+    worker.poll()
+    first = worker.get()
+    worker.poll()
+    second = worker.get()
+    worker.invalidate()
+    worker.get()  # Taken for a request, so not passed to listeners.
+    assert seen == [first, second]
+    assert first is not second
+
+
+def test_summary_reuses_the_snapshot_jobs(calls, monkeypatch):
+    summaries = []
+
+    def qstat_summary(env, jobs=None):
+        summaries.append(jobs)
+        return [{'job_id': job['job_id']} for job in jobs[0]]
+
+    monkeypatch.setattr(sge, 'qstat_summary', qstat_summary)
+    latest = snapshot.SnapshotWorker('dev', {}, max_age=60).get()
+    assert latest.summary() == [{'job_id': 1}]
+    assert latest.summary() == [{'job_id': 1}]
+    assert summaries == [([{'job_id': 1}], [])]
+    assert calls['qstat'] == 1
@@ -0,0 +1,200 @@
+"""EC2Backend against moto, checked for parity with the starcluster command output parsers, which run against a stub
+of the starcluster command."""
+import datetime
+import subprocess
+
+import boto3
+import botocore.stub
+import moto
+import pytest
+
+import starcluster
+import starcluster_ec2
+
+
+LISTINSTANCES_OUTPUT = """id: i-0123456789abcdef0
+dns_name: ec2-54-1-2-3.us-east-1.compute.amazonaws.com
+private_dns_name: ip-10-0-0-10.ec2.internal
+state: running
+public_ip: 54.1.2.3
+private_ip: 10.0.0.10
+vpc: vpc-12345678
+subnet: subnet-12345678
+zone: us-east-1a
+ami: ami-12345678
+virtualization: hvm
+type: c4.large
+groups: @sc-dev
+keypair: observatory
+uptime: 0 days, 02:03:04
+tags: alias=master, Name=master
+
+id: i-0123456789abcdef1
+dns_name: ec2-54-1-2-4.us-east-1.compute.amazonaws.com
+private_dns_name: ip-10-0-0-11.ec2.internal
+state: running
+public_ip: 54.1.2.4
+private_ip: 10.0.0.11
+vpc: vpc-12345678
+subnet: subnet-12345678
+zone: us-east-1a
+ami: ami-12345678
+virtualization: hvm
+type: p2.xlarge
+groups: @sc-dev
+keypair: observatory
+uptime: 0 days, 01:00:00
+tags: alias=node001, Name=node001
+"""
+
+LISTCLUSTERS_OUTPUT = """-----------------------------------------
+dev (security group: @sc-dev)
+-----------------------------------------
+Launch time: 2020-01-01 10:00:00
+Uptime: 0 days, 02:03:04
+Zone: us-east-1a
+Keypair: observatory
+Cluster nodes:
+     master running i-0123456789abcdef0 ec2-54-1-2-3.us-east-1.compute.amazonaws.com
+    node001 running i-0123456789abcdef1 ec2-54-1-2-4.us-east-1.compute.amazonaws.com (spot sir-12345678)
+Total nodes: 2
+"""
+
+SPOTHISTORY_OUTPUT = """>>> Fetching spot history for p2.xlarge (VPC)
+Current price: $0.2700
+Max price: $0.9000
+Average price: $0.3000
+"""
+
+
+@pytest.fixture
+def stub_starcluster_command(monkeypatch):
+    """Answer starcluster commands with canned output instead of running them."""
+    outputs = {'listinstances': LISTINSTANCES_OUTPUT, 'listclusters': LISTCLUSTERS_OUTPUT,
+               'spothistory': SPOTHISTORY_OUTPUT}
+
+    def check_output(command):
+        for subcommand, output in outputs.items():
+            if ' %s' % subcommand in command:
+                return output
+        raise subprocess.CalledProcessError(1, command)
+    monkeypatch.setattr(starcluster, '_check_output', check_output)
+
+
+@pytest.fixture
+def ec2_backend(tmp_path):
+    """EC2Backend reading a starcluster config, against moto, with cluster dev of a master and one node."""
+    config_path = tmp_path / 'config'
+    config_path.write_text('[aws info]\naws_access_key_id = testing\naws_secret_access_key = testing\n'
+                           'aws_region_name = us-east-1\n')
+    with moto.mock_aws():
+        ec2 = boto3.client('ec2', region_name='us-east-1', aws_access_key_id='testing',
+                           aws_secret_access_key='testing')
+        ec2.create_security_group(GroupName='@sc-dev', Description='StarCluster dev')
+        ec2.create_security_group(GroupName='other', Description='Not a cluster')
+        ami = ec2.describe_images()['Images'][0]['ImageId']
+        for alias, instance_type, group in [('master', 'c4.large', '@sc-dev'), ('node001', 'p2.xlarge', '@sc-dev'),
+                                            ('unrelated', 'c4.large', 'other')]:
+            ec2.run_instances(ImageId=ami, MinCount=1, MaxCount=1, InstanceType=instance_type, KeyName='observatory',
+                              SecurityGroups=[group],
+                              TagSpecifications=[{'ResourceType': 'instance',
+                                                  'Tags': [{'Key': 'alias', 'Value': alias},
+                                                           {'Key': 'Name', 'Value': alias}]}])
+        yield starcluster_ec2.EC2Backend(str(config_path))
+
+
+@pytest.fixture
+def starcluster_ec2_backend(ec2_backend, monkeypatch):
+    """Answer the starcluster module's list queries with ec2_backend, as --starcluster_backend ec2 does."""
+    monkeypatch.setattr(starcluster, '_ec2_backend', ec2_backend)
+    return ec2_backend
+
+
+def test_list_instances(starcluster_ec2_backend):
+    instances = starcluster.list_instances()
+    assert sorted(i['alias'] for i in instances) == ['master', 'node001', 'unrelated']
+    node = next(i for i in instances if i['alias'] == 'node001')
+    assert node['type'] == 'p2.xlarge'
+    assert node['state'] == 'running'
+    assert node['groups'] == '@sc-dev'
+    assert node['uptime'].startswith('0 days, ')
+
+
+def test_list_clusters(starcluster_ec2_backend):
+    clusters = starcluster.list_clusters()
+    assert [c['name'] for c in clusters] == ['dev']
+    cluster = clusters[0]
+    assert cluster['Total nodes'] == '2'
+    assert cluster['Keypair'] == 'observatory'
+    assert [n['alias'] for n in cluster['nodes']] == ['master', 'node001']
+    assert all(n['spot_request'] is None for n in cluster['nodes'])
+
+
+def test_get_status(starcluster_ec2_backend):
+    uptime, nodes = starcluster.get_status('dev')
+    assert nodes == ['master', 'node001']
+    assert len(uptime) == 8 and uptime.count(':') == 2
+
+
+def test_get_status_of_unknown_cluster_raises_called_process_error(starcluster_ec2_backend):
+    with pytest.raises(subprocess.CalledProcessError):
+        starcluster.get_status('missing')
+
+
+def test_spot_history(starcluster_ec2_backend):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with botocore.stub.Stubber(starcluster_ec2_backend._ec2) as stubber:
+        stubber.add_response('describe_spot_price_history', {'SpotPriceHistory': [
+            {'InstanceType': 'p2.xlarge', 'SpotPrice': '0.30', 'Timestamp': now - datetime.timedelta(hours=2)},
+            {'InstanceType': 'p2.xlarge', 'SpotPrice': '0.90', 'Timestamp': now - datetime.timedelta(hours=1)},
+            {'InstanceType': 'p2.xlarge', 'SpotPrice': '0.27', 'Timestamp': now},
+        ]})
+        current, average, max_price = starcluster.spot_history('p2.xlarge')
+    assert float(current) == pytest.approx(0.27)
+    assert float(average) == pytest.approx(0.49)
+    assert float(max_price) == pytest.approx(0.90)
+
+
+def test_spot_history_without_prices(starcluster_ec2_backend):
+    assert starcluster.spot_history('p2.xlarge') == ('', '', '')
+
+
+def test_spot_request_ids(starcluster_ec2_backend):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    instance = {'InstanceId': 'i-1', 'State': {'Name': 'running'}, 'LaunchTime': now, 'PublicDnsName': 'ec2-1',
+                'Placement': {'AvailabilityZone': 'us-east-1a'}, 'SpotInstanceRequestId': 'sir-1',
+                'SecurityGroups': [{'GroupName': '@sc-dev', 'GroupId': 'sg-1'}],
+                'Tags': [{'Key': 'alias', 'Value': 'node001'}]}
+    with botocore.stub.Stubber(starcluster_ec2_backend._ec2) as stubber:
+        stubber.add_response('describe_instances', {'Reservations': [{'Instances': [instance]}]})
+        clusters = starcluster.list_clusters()
+    assert clusters[0]['nodes'][0]['spot_request'] == 'sir-1'
+
+
+def test_instance_keys_match_cli(stub_starcluster_command, ec2_backend):
+    cli_instances = starcluster._parse_instance(LISTINSTANCES_OUTPUT.split('\n\n')[0])
+    ec2_instance = ec2_backend.list_instances()[0]
+    assert set(cli_instances) <= set(ec2_instance)
+    assert all(isinstance(value, str) for value in ec2_instance.values())
+
+
+def test_cluster_keys_match_cli(stub_starcluster_command, ec2_backend):
+    cli_cluster = starcluster.list_clusters()[0]
+    ec2_cluster = ec2_backend.list_clusters()[0]
+    assert set(cli_cluster) == set(ec2_cluster)
+    assert set(cli_cluster['nodes'][0]) == set(ec2_cluster['nodes'][0])
+    assert cli_cluster['nodes'][1]['spot_request'] == 'sir-12345678'
+
+
+def test_status_matches_cli(stub_starcluster_command, ec2_backend):
+    cli_uptime, cli_nodes = starcluster.get_status('dev')
+    ec2_uptime, ec2_nodes = ec2_backend.get_status('dev')
+    assert cli_uptime == '02:03:04'
+    assert len(ec2_uptime) == len(cli_uptime)
+    assert cli_nodes == ec2_nodes == ['master', 'node001']
+
+
+def test_spot_history_matches_cli(stub_starcluster_command, ec2_backend):
+    cli_prices = starcluster.spot_history('p2.xlarge')
+    assert [float(p) for p in cli_prices] == [0.27, 0.3, 0.9]
+    assert len(ec2_backend.spot_history('p2.xlarge')) == len(cli_prices)
@@ -0,0 +1,410 @@
+#!/usr/bin/python3
+"""Emulated SGE and StarCluster commands, for load testing the services without a cluster.
+
+The cluster is a JSON state file of nodes and jobs.  create() writes a state file and wrapper scripts named qstat,
+qhost, qdel, qmod and starcluster, which run this script with the state file.  Point the API server at them with
+--sge_bin_dir and --starcluster_path.  Each emulated command sleeps for its configured latency, appends its name to
+spawns.log next to the state file, and prints output in the format the real command does.
+
+addnode and removenode change the state after boot_seconds, as a node joining or leaving the cluster would.
+
+Usage: emulator.py --state <state.json> <command> [args...]
+"""
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+
+
+COMMANDS = ('qstat', 'qhost', 'qdel', 'qmod', 'starcluster')
+# Seconds each emulated command takes, by command or starcluster subcommand.
+DEFAULT_LATENCY = {
+    'qstat': 0.05,
+    'qhost': 0.05,
+    'qdel': 0.05,
+    'qmod': 0.05,
+    'listclusters': 1.0,
+    'listinstances': 1.0,
+    'spothistory': 0.5,
+    'addnode': 0.0,
+    'removenode': 0.0,
+}
+
+
+def create(directory, cluster_name, queue_types, node_count, job_count, users=20, env_size=100, utilization=0.8,
+           latency=None, boot_seconds=5):
+    """Write a cluster state file and emulated command wrappers to directory.
+
+    Args:
+        directory (string) - Directory to write to.  The wrappers are written to directory/bin.
+        cluster_name (string) - Name of the cluster.
+        queue_types ({string: (string, int)}) - Maps instance type to the queue its nodes serve and slots per node.
+                                                Nodes are spread evenly over the types.
+        node_count (int) - Number of nodes, not counting the master.
+        job_count (int) - Number of jobs.  Jobs fill utilization of the slots, the rest are pending.
+        users (int) - Number of users submitting jobs.
+        env_size (int) - Number of environment variables of each job.
+        utilization (float) - Fraction of slots running jobs.
+        latency ({string: float}) - Overrides of DEFAULT_LATENCY.
+        boot_seconds (float) - Time for addnode and removenode to take effect.
+
+    Returns:
+        (string, string) - Paths of the state file and of the bin directory.
+    """
+    rng = random.Random(0)
+    now = time.time()
+    types = sorted(queue_types)
+    nodes = [{'alias': '%s-master' % cluster_name, 'type': types[0], 'queue': None, 'slots': 0, 'disabled': False,
+              'launch_time': now - 30 * 24 * 3600, 'spot': False}]
+    for i in range(1, node_count + 1):
+        node_type = types[i % len(types)]
+        queue, slots = queue_types[node_type]
+        nodes.append({'alias': '%s-node%03d' % (cluster_name, i), 'type': node_type, 'queue': queue, 'slots': slots,
+                      'disabled': False, 'launch_time': now - rng.randint(600, 7 * 24 * 3600), 'spot': i % 3 == 0})
+    free_slots = [(n['alias'], n['queue']) for n in nodes for _ in range(int(n['slots'] * utilization))]
+    queues = sorted(set(q for q, _ in queue_types.values()))
+    jobs = []
+    for job_id in range(1, job_count + 1):
+        if free_slots:
+            host, queue = free_slots.pop()
+        else:
+            host, queue = None, queues[job_id % len(queues)]
+        jobs.append({'job_id': job_id, 'owner': 'user%d' % (job_id % users), 'queue': queue, 'host': host,
+                     'submission_time': int(now - rng.randint(0, 24 * 3600)),
+                     'predecessors': [job_id - 1] if host is None and job_id % 10 == 0 else [],
+                     'tasks': '1-%d' % rng.randint(2, 100) if host is None and job_id % 25 == 0 else None})
+    state = {
+        'cluster_name': cluster_name,
+        'queue_types': {t: list(v) for t, v in queue_types.items()},
+        'nodes': nodes,
+        'jobs': jobs,
+        'env_size': env_size,
+        'latency': dict(DEFAULT_LATENCY, **(latency or {})),
+        'boot_seconds': boot_seconds,
+    }
+    state_path = os.path.join(directory, 'state.json')
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+    bin_dir = os.path.join(directory, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for command in COMMANDS:
+        path = os.path.join(bin_dir, command)
+        with open(path, 'w') as f:
+            # -S skips site packages, which the emulator doesn't need, to start as fast as possible.
+            f.write('#!/bin/sh\nexec "%s" -S "%s" --state "%s" %s "$@"\n' % (
+                sys.executable, os.path.abspath(__file__), state_path, command))
+        os.chmod(path, 0o755)
+    return state_path, bin_dir
+
+
+def spawn_counts(state_path):
+    """Number of times each emulated command was run, from spawns.log."""
+    counts = {}
+    try:
+        with open(os.path.join(os.path.dirname(state_path), 'spawns.log')) as f:
+            for line in f:
+                name = line.strip()
+                counts[name] = counts.get(name, 0) + 1
+    except FileNotFoundError:
+        pass
+    return counts
+
+
+class State:
+    """The state file, locked for the lifetime of the object."""
+    def __init__(self, path, exclusive=False):
+        self.path = path
+        self._lock_file = open(path + '.lock', 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        with open(path) as f:
+            self.data = json.load(f)
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _log_spawn(state_path, name):
+    with open(os.path.join(os.path.dirname(state_path), 'spawns.log'), 'a') as f:
+        f.write(name + '\n')
+
+
+def _uptime(launch_time):
+    seconds = int(time.time() - launch_time)
+    days, seconds = divmod(seconds, 24 * 3600)
+    return '%d days, %02d:%02d:%02d' % (days, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _job_state(job):
+    return 'running' if job['host'] else 'pending'
+
+
+def _qstat_list(state):
+    out = ['<?xml version=\'1.0\'?>', '<job_info>', '  <queue_info>']
+    pending = []
+    for job in state['jobs']:
+        if job['host'] is None:
+            pending.append(job)
+            continue
+        out.append(_job_list_xml(job, 'r', '%s@%s' % (job['queue'], job['host'])))
+    out.append('  </queue_info>')
+    out.append('  <job_info>')
+    for job in pending:
+        out.append(_job_list_xml(job, 'hqw' if job['predecessors'] else 'qw', None))
+    out.append('  </job_info>')
+    out.append('</job_info>')
+    return '\n'.join(out)
+
+
+def _job_list_xml(job, state_code, queue_name):
+    time_tag = 'JAT_start_time' if queue_name else 'JB_submission_time'
+    lines = [
+        '    <job_list state="%s">' % _job_state(job),
+        '      <JB_job_number>%d</JB_job_number>' % job['job_id'],
+        '      <JAT_prio>0.55500</JAT_prio>',
+        '      <JB_name>job%d</JB_name>' % job['job_id'],
+        '      <JB_owner>%s</JB_owner>' % job['owner'],
+        '      <state>%s</state>' % state_code,
+        '      <%s>%s</%s>' % (time_tag, time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(job['submission_time'])),
+                               time_tag),
+        '      <queue_name>%s</queue_name>' % (queue_name or ''),
+        '      <slots>1</slots>',
+    ]
+    if job['tasks']:
+        lines.append('      <tasks>%s</tasks>' % job['tasks'])
+    lines.append('    </job_list>')
+    return '\n'.join(lines)
+
+
+def _job_details_xml(state, job, full):
+    lines = [
+        '    <element>',
+        '      <JB_job_number>%d</JB_job_number>' % job['job_id'],
+        '      <JB_owner>%s</JB_owner>' % job['owner'],
+        '      <JB_submission_time>%d</JB_submission_time>' % job['submission_time'],
+        '      <JB_hard_queue_list><destin_ident_list><QR_name>%s</QR_name></destin_ident_list></JB_hard_queue_list>'
+        % job['queue'],
+    ]
+    if job['predecessors']:
+        lines.append('      <JB_jid_predecessor_list><job_predecessors>%s</job_predecessors></JB_jid_predecessor_list>'
+                     % ''.join('<JRE_job_number>%d</JRE_job_number>' % p for p in job['predecessors']))
+    if full:
+        home = '/home/%s' % job['owner']
+        lines.extend([
+            '      <JB_job_name>job%d</JB_job_name>' % job['job_id'],
+            '      <JB_script_file>%s/run.sh</JB_script_file>' % home,
+            '      <JB_stdout_path_list><path_list><PN_path>%s/logs</PN_path></path_list></JB_stdout_path_list>' % home,
+            '      <JB_stderr_path_list><path_list><PN_path>%s/logs</PN_path></path_list></JB_stderr_path_list>' % home,
+            '      <JB_priority>1024</JB_priority>',
+            '      <JB_job_args><element><ST_name>--input=%d</ST_name></element></JB_job_args>' % job['job_id'],
+            '      <JB_env_list>',
+        ])
+        # Jobs of a user share an environment, except for a few variables.
+        env = {'VAR_%03d' % i: '%s/value/%03d' % (home, i) for i in range(state['env_size'])}
+        env.update({'HOME': home, 'USER': job['owner'], 'VARIANT': str(job['job_id'] % 5)})
+        for name, value in sorted(env.items()):
+            lines.append('        <job_sublist><VA_variable>%s</VA_variable><VA_value>%s</VA_value></job_sublist>' % (
+                name, escape(value)))
+        lines.append('      </JB_env_list>')
+    lines.append('    </element>')
+    return '\n'.join(lines)
+
+
+def _qstat_details(state, job_ids):
+    jobs = [j for j in state['jobs'] if job_ids is None or j['job_id'] in job_ids]
+    if job_ids is not None and len(jobs) == 0:
+        sys.stderr.write('Following jobs do not exist:\n%s\n' % ','.join(str(j) for j in job_ids))
+        return None
+    return '\n'.join(['<?xml version=\'1.0\'?>', '<detailed_job_info>', '  <djob_info>'] +
+                     [_job_details_xml(state, job, job_ids is not None) for job in jobs] +
+                     ['  </djob_info>', '</detailed_job_info>'])
+
+
+def _qhost(state):
+    used = {}
+    for job in state['jobs']:
+        if job['host']:
+            used[job['host']] = used.get(job['host'], 0) + 1
+    out = ['<?xml version=\'1.0\'?>', '<qhost>', '  <host name=\'global\'>',
+           '    <hostvalue name=\'arch_string\'>-</hostvalue>', '  </host>']
+    for node in state['nodes']:
+        if node['slots'] == 0 and not node['alias'].endswith('master'):
+            continue  # Booting
+        load = min(1.0, used.get(node['alias'], 0) / float(max(node['slots'], 1)))
+        out.append('  <host name=\'%s\'>' % node['alias'])
+        for name, value in (('arch_string', 'lx-amd64'), ('num_proc', str(max(node['slots'], 1))),
+                            ('load_avg', '%.2f' % load), ('mem_total', '30.0G'), ('mem_used', '2.0G')):
+            out.append('    <hostvalue name=\'%s\'>%s</hostvalue>' % (name, value))
+        if node['queue']:
+            queue = node['queue']
+            out.append('    <queue name=\'%s\'>' % queue)
+            for name, value in (('qtype_string', 'BIP'), ('slots_used', used.get(node['alias'], 0)),
+                                ('slots', node['slots']), ('slots_resv', 0),
+                                ('state_string', 'd' if node['disabled'] else '')):
+                out.append('      <queuevalue qname=\'%s\' name=\'%s\'>%s</queuevalue>' % (queue, name, value))
+            out.append('    </queue>')
+        out.append('  </host>')
+    out.append('</qhost>')
+    return '\n'.join(out)
+
+
+def _listclusters(state):
+    name = state['cluster_name']
+    master = state['nodes'][0]
+    lines = [
+        '-' * 50,
+        '%s (security group: @sc-%s)' % (name, name),
+        '-' * 50,
+        'Launch time: %s' % time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(master['launch_time'])),
+        'Uptime: %s' % _uptime(master['launch_time']),
+        'Zone: us-west-2a',
+        'Keypair: observatory',
+        'Cluster nodes:',
+    ]
+    for i, node in enumerate(state['nodes']):
+        line = '    %s running i-%08x ec2-10-0-%d-%d.us-west-2.compute.amazonaws.com' % (
+            node['alias'], i, i // 256, i % 256)
+        if node['spot']:
+            line += ' (spot sir-%08x)' % i
+        lines.append(line)
+    lines.append('Total nodes: %d' % len(state['nodes']))
+    return '\n'.join(lines)
+
+
+def _listinstances(state):
+    sections = []
+    for i, node in enumerate(state['nodes']):
+        sections.append('\n'.join([
+            'id: i-%08x' % i,
+            'dns_name: ec2-10-0-%d-%d.us-west-2.compute.amazonaws.com' % (i // 256, i % 256),
+            'state: running',
+            'public_ip: 10.0.%d.%d' % (i // 256, i % 256),
+            'zone: us-west-2a',
+            'type: %s' % node['type'],
+            'uptime: %s' % _uptime(node['launch_time']),
+            'tags: alias=%s, Name=%s' % (node['alias'], node['alias']),
+        ]))
+    return '\n\n'.join(sections)
+
+
+def _spothistory(instance_type):
+    price = 0.1 + (sum(ord(c) for c in instance_type) % 50) / 10.0
+    return '\n'.join(['Current price: $%.4f' % price, 'Max price: $%.4f' % (price * 2),
+                      'Average price: $%.4f' % (price * 1.1)])
+
+
+def _option_values(argv, option):
+    return [argv[i + 1] for i, a in enumerate(argv[:-1]) if a == option]
+
+
+def _addnode(state_path, argv):
+    """Add a booting node, which joins SGE after boot_seconds."""
+    with State(state_path, exclusive=True) as state:
+        types = _option_values(argv, '-I')
+        node_type = types[0] if types else sorted(state.data['queue_types'])[0]
+        if node_type not in state.data['queue_types']:
+            sys.stderr.write('ERROR: unknown instance type %s\n' % node_type)
+            return 1
+        index = max([int(n['alias'].split('node')[1]) for n in state.data['nodes'] if 'node' in n['alias']] + [0]) + 1
+        alias = '%s-node%03d' % (state.data['cluster_name'], index)
+        state.data['nodes'].append({'alias': alias, 'type': node_type, 'queue': None, 'slots': 0, 'disabled': False,
+                                    'launch_time': time.time(), 'spot': '-b' in argv})
+        state.save()
+        boot_seconds = state.data['boot_seconds']
+    print('>>> Launching node %s (%s)' % (alias, node_type), flush=True)
+    time.sleep(boot_seconds)
+    with State(state_path, exclusive=True) as state:
+        queue, slots = state.data['queue_types'][node_type]
+        for node in state.data['nodes']:
+            if node['alias'] == alias:
+                node['queue'], node['slots'] = queue, slots
+        state.save()
+    print('>>> Node %s added to SGE' % alias, flush=True)
+    return 0
+
+
+def _removenode(state_path, argv):
+    aliases = set(_option_values(argv, '-a'))
+    with State(state_path) as state:
+        boot_seconds = state.data['boot_seconds']
+    print('>>> Removing nodes %s' % ', '.join(sorted(aliases)), flush=True)
+    time.sleep(boot_seconds)
+    with State(state_path, exclusive=True) as state:
+        state.data['nodes'] = [n for n in state.data['nodes'] if n['alias'] not in aliases]
+        state.data['jobs'] = [j for j in state.data['jobs'] if j['host'] not in aliases]
+        state.save()
+    return 0
+
+
+def main(argv):
+    if len(argv) < 3 or argv[0] != '--state' or argv[2] not in COMMANDS:
+        sys.stderr.write(__doc__)
+        return 2
+    state_path, command, argv = argv[1], argv[2], argv[3:]
+    if command == 'starcluster':
+        argv = [a for a in argv if a != '-c'][1:]  # Drop -c <config>
+        command, argv = argv[0], argv[1:]
+    _log_spawn(state_path, command)
+    with State(state_path) as state:
+        latency = state.data['latency'].get(command, 0)
+    time.sleep(latency)
+
+    if command in ('addnode', 'removenode'):
+        return _addnode(state_path, argv) if command == 'addnode' else _removenode(state_path, argv)
+    if command in ('qdel', 'qmod'):
+        with State(state_path, exclusive=True) as state:
+            if command == 'qdel':
+                job_ids = set(int(j) for j in argv[-1].split(','))
+                state.data['jobs'] = [j for j in state.data['jobs'] if j['job_id'] not in job_ids]
+            else:
+                host = argv[-1].split('@')[-1]
+                for node in state.data['nodes']:
+                    if node['alias'] == host:
+                        node['disabled'] = argv[0] == '-d'
+            state.save()
+        return 0
+
+    with State(state_path) as state:
+        data = state.data
+    if command == 'qstat':
+        if '-j' in argv:
+            job_id = _option_values(argv, '-j')[0]
+            output = _qstat_details(data, None if job_id == '*' else set([int(job_id)]))
+            if output is None:
+                return 1
+        else:
+            output = _qstat_list(data)
+    elif command == 'qhost':
+        output = _qhost(data)
+    elif command == 'listclusters':
+        output = _listclusters(data)
+    elif command == 'listinstances':
+        output = _listinstances(data)
+    elif command == 'spothistory':
+        output = _spothistory(argv[0])
+    else:
+        sys.stderr.write('ERROR: emulator does not support %s\n' % command)
+        return 1
+    sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""Evaluate the load balancer's demand forecaster offline against utilization history recorded by the API server.
+
+Fits a DemandForecaster to all but the last week of history, then reports how much capacity launching for its forecasts
+would have used, and how much demand it would have missed, over the last week.
+
+Usage: python3 benchmarks/forecast_replay.py --api_server_host 10.0.0.5 --weeks 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loadbalancer'))
+
+import config
+import forecast
+
+
+parser = argparse.ArgumentParser(description='Replay recorded utilization against the demand forecaster.')
+parser.add_argument('--api_server_host', default='127.0.0.1', type=str, help='IP address of the API server.')
+parser.add_argument('--api_server_port', default=6361, type=int, help='Port of the API server.')
+parser.add_argument('--cluster_name', type=str, help='Cluster to replay, if the API server manages several.')
+parser.add_argument('--weeks', default=5, type=int, help='Weeks of history to fetch.  The last week is held out.')
+parser.add_argument('--bin_minutes', default=15, type=int, help='Width of forecast time of week bins.')
+parser.add_argument('--stddevs', default=1.0, type=float, help='Standard deviations above mean demand to forecast.')
+
+
+def main():
+    args = parser.parse_args()
+    end = int(time.time() * 1000)
+    start = end - args.weeks * forecast.SECONDS_PER_WEEK * 1000
+    path = '/history' if args.cluster_name is None else '/clusters/%s/history' % args.cluster_name
+    response = requests.get('http://%s:%d%s' % (args.api_server_host, args.api_server_port, path),
+                            params={'start': start, 'end': end, 'resolution': args.bin_minutes * 60 * 1000,
+                                    'series': ','.join('slots_used/%s' % q.name for q in config.queues)})
+    history = response.json()
+    timestamps = np.array(history['timestamps'], dtype=np.float64) / 1000.0
+    if len(timestamps) < 2:
+        print('Not enough history')
+        return
+    sample_seconds = np.median(np.diff(timestamps))
+    holdout = timestamps >= timestamps[-1] - forecast.SECONDS_PER_WEEK
+    print('%d points, %d held out' % (len(timestamps), holdout.sum()))
+    print('%-8s %10s %10s %10s %9s' % ('queue', 'launched', 'unmet', 'idle', 'coverage'))
+    for queue in config.queues:
+        values = history['series'].get('slots_used/%s' % queue.name)
+        if not values:
+            continue
+        demand = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        forecaster = forecast.DemandForecaster(bin_minutes=args.bin_minutes, stddevs=args.stddevs)
+        forecaster.fit(queue.name, timestamps[~holdout], demand[~holdout], sample_seconds)
+        result = forecaster.evaluate(queue.name, timestamps[holdout], demand[holdout], queue.slots_per_node())
+        print('%-8s %10.1f %10.1f %10.1f %8.0f%%' % (queue.name, result['forecast_slot_hours'],
+                                                     result['unmet_slot_hours'], result['idle_slot_hours'],
+                                                     result['coverage'] * 100))
+    print('(slot hours)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""Compare memory used by job details held as plain dicts, and in a JobStore.
+
+Generates synthetic qstat_job_details results for jobs from a few users, whose environments differ in a few variables
+per job, as array job submissions and job scripts do.
+
+Usage: python3 benchmarks/job_store_memory.py --jobs 10000 --users 20 --env_size 300
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import job_store
+
+
+parser = argparse.ArgumentParser(description='Measure memory used by job details.')
+parser.add_argument('--jobs', default=10000, type=int, help='Number of jobs.')
+parser.add_argument('--users', default=20, type=int, help='Number of users submitting jobs.')
+parser.add_argument('--env_size', default=300, type=int, help='Number of environment variables per job.')
+parser.add_argument('--env_variants', default=5, type=int, help='Number of distinct environments per user.')
+
+
+def user_environment(user, variant, env_size):
+    env = {'VAR_%03d' % i: '/home/%s/value/%03d/%s' % (user, i, 'x' * 40) for i in range(env_size)}
+    env['HOME'] = '/home/%s' % user
+    env['USER'] = user
+    env['SGE_VARIANT'] = str(variant)
+    return env
+
+
+def job_details(job_id, args, rng):
+    # Build each job's strings separately, as parsing qstat XML does.
+    user_index = rng.randrange(args.users)
+    user = ''.join(['user', str(user_index)])
+    env = user_environment(user, rng.randrange(args.env_variants), args.env_size)
+    return {
+        'job_id': job_id,
+        'owner': user,
+        'qr_name': ''.join(['cpu', '.q']),
+        'queue_name': ''.join(['cpu.q@dev-node', '%03d' % rng.randrange(50)]),
+        'predecessors': [],
+        'submission_timestamp': '1600000000',
+        'name': 'job%d' % job_id,
+        'executable': '/home/%s/run.sh' % user,
+        'stdout_path': '/home/%s/logs' % user,
+        'stderr_path': '/home/%s/logs' % user,
+        'priority': '0',
+        'job_args': ['--input', 'file%d' % job_id],
+        'env': env,
+    }
+
+
+def measure(label, build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%-10s %8.1f MB' % (label, (after - before) / 1e6))
+    return held
+
+
+def main():
+    args = parser.parse_args()
+
+    def plain():
+        rng = random.Random(0)
+        return [job_details(job_id, args, rng) for job_id in range(args.jobs)]
+
+    def stored():
+        rng = random.Random(0)
+        store = job_store.JobStore()
+        for job_id in range(args.jobs):
+            store.put(job_id, job_details(job_id, args, rng))
+        return store
+
+    print('%d jobs, %d users, %d environment variables' % (args.jobs, args.users, args.env_size))
+    measure('dicts', plain)
+    store = measure('JobStore', stored)
+    print('Distinct environments: %d' % store.stats()['environments'])
+
+
+if __name__ == '__main__':
+    main()
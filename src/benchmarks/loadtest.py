@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+"""End to end load test of the API server, dashboard and load balancer against an emulated cluster.
+
+Starts api-server.py with emulated SGE and StarCluster commands (see emulator.py), dashboard-server.py and any number of
+lb-service.py instances, then drives concurrent dashboard page views and API requests for a fixed duration.  Reports
+throughput and latency percentiles per request, the number of emulated commands the API server spawned, and the
+memory of each service.  Results can be saved as JSON with --output, and compared to a previous run with --baseline.
+
+Usage: python3 benchmarks/loadtest.py --nodes 50 --jobs 2000 --viewers 10 --api_clients 10 --duration 60
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, 'loadbalancer'))
+
+import config
+import emulator
+
+
+CLUSTER_NAME = 'loadtest'
+# Pages loaded by dashboard viewers.
+DASHBOARD_PAGES = ['/', '/nodes_content.html', '/jobs_tab.html', '/jobs_content.html']
+# API requests made by API clients, with relative weights.
+API_REQUESTS = [
+    ('/qhost', 4),
+    ('/qstat?summary=true', 4),
+    ('/qstat', 2),
+    ('/instances', 2),
+    ('/history', 1),
+    ('/spot_history', 1),
+    ('/operations', 1),
+]
+
+
+parser = argparse.ArgumentParser(description='Load test the services against an emulated cluster.')
+parser.add_argument('--nodes', default=50, type=int, help='Number of nodes in the emulated cluster.')
+parser.add_argument('--jobs', default=2000, type=int, help='Number of jobs in the emulated cluster.')
+parser.add_argument('--env_size', default=100, type=int, help='Number of environment variables of each job.')
+parser.add_argument('--viewers', default=5, type=int, help='Number of concurrent dashboard viewers.')
+parser.add_argument('--api_clients', default=5, type=int, help='Number of concurrent API clients.')
+parser.add_argument('--load_balancers', default=1, type=int, help='Number of load balancer instances polling the API server.')
+parser.add_argument('--lb_polling_interval', default=0.1, type=float, help='Load balancer polling interval (minutes).')
+parser.add_argument('--lb_execute', action='store_true', help='Let load balancers launch and remove emulated nodes, instead of running with --dry-run.')
+parser.add_argument('--think_time', default=0.0, type=float, help='Seconds each viewer or client waits between requests.')
+parser.add_argument('--duration', default=60, type=float, help='Seconds to measure for.')
+parser.add_argument('--warmup', default=10, type=float, help='Seconds to run before measuring.')
+parser.add_argument('--sge_latency', default=0.05, type=float, help='Seconds each emulated SGE command takes.')
+parser.add_argument('--starcluster_latency', default=1.0, type=float, help='Seconds each emulated starcluster listing takes.')
+parser.add_argument('--api_server_args', default='', type=str, help='Extra arguments for api-server.py, i.e. "--starcluster_backend cli".')
+parser.add_argument('--work_dir', type=str, help='Directory for the emulated cluster and service logs.  Defaults to a temporary directory, deleted afterwards.')
+parser.add_argument('--output', type=str, help='If specified, save results as JSON to this file.')
+parser.add_argument('--baseline', type=str, help='If specified, compare results with a previous --output file.')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, process, timeout=60):
+    """Wait until url responds, or raise if process exits or timeout passes."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('%s exited with %d' % (' '.join(process.args[:2]), process.returncode))
+        try:
+            requests.get(url, timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('Timed out waiting for %s' % url)
+
+
+def rss_bytes(pid):
+    """Resident memory of process pid, or None if unavailable."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+class Services:
+    """The API server, dashboard and load balancers, running as subprocesses."""
+    def __init__(self, args, work_dir, state_path, bin_dir):
+        self.processes = {}
+        self._logs = []
+        self.api_port = free_port()
+        self.dashboard_port = free_port()
+        self.lb_status_ports = []
+        try:
+            self._start_all(args, work_dir, state_path, bin_dir)
+        except BaseException:
+            self.stop()
+            raise
+
+    def _start_all(self, args, work_dir, state_path, bin_dir):
+        self._start('api-server', ['api/api-server.py', '--host_ip', '127.0.0.1', '--port', str(self.api_port),
+                                   '--cluster_name', CLUSTER_NAME, '--sge_bin_dir', bin_dir,
+                                   '--starcluster_path', os.path.join(bin_dir, 'starcluster'),
+                                   '--starcluster_config', state_path, '--history_interval', '10',
+                                   '--accounting_interval', '0'] + args.api_server_args.split(), work_dir)
+        wait_for('http://127.0.0.1:%d/clusters' % self.api_port, self.processes['api-server'])
+        self._start('dashboard', ['dashboard/dashboard-server.py', '--host_ip', '127.0.0.1',
+                                  '--port', str(self.dashboard_port), '--api_server_port', str(self.api_port)], work_dir)
+        wait_for('http://127.0.0.1:%d/static/dashboard.css' % self.dashboard_port, self.processes['dashboard'])
+        for i in range(args.load_balancers):
+            port = free_port()
+            self.lb_status_ports.append(port)
+            self._start('lb-%d' % i, ['loadbalancer/lb-service.py', '--api_server_port', str(self.api_port),
+                                      '--polling_interval', str(args.lb_polling_interval),
+                                      '--status_port', str(port)] + ([] if args.lb_execute else ['--dry-run']),
+                        work_dir)
+            wait_for('http://127.0.0.1:%d/metrics' % port, self.processes['lb-%d' % i])
+
+    def _start(self, name, command, work_dir):
+        log = open(os.path.join(work_dir, '%s.log' % name), 'w')
+        self._logs.append(log)
+        self.processes[name] = subprocess.Popen([sys.executable] + [os.path.join(SRC_DIR, command[0])] + command[1:],
+                                                stdout=log, stderr=subprocess.STDOUT)
+
+    def memory(self):
+        """Resident memory of each service, in bytes."""
+        return {name: rss_bytes(p.pid) for name, p in self.processes.items()}
+
+    def load_balancer_metrics(self):
+        results = []
+        for port in self.lb_status_ports:
+            try:
+                results.append(requests.get('http://127.0.0.1:%d/metrics' % port, timeout=10).json())
+            except (requests.RequestException, ValueError):
+                results.append(None)
+        return results
+
+    def stop(self):
+        for p in self.processes.values():
+            p.terminate()
+        for p in self.processes.values():
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        for log in self._logs:
+            log.close()
+
+
+class Driver:
+    """Threads making requests in a closed loop, recording (label, start, seconds, ok) for each."""
+    def __init__(self, think_time):
+        self.think_time = think_time
+        self.running = True
+        self.samples = []
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def add(self, base_url, choose):
+        thread = threading.Thread(target=self._run, args=(base_url, choose), daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _run(self, base_url, choose):
+        session = requests.Session()
+        samples = []
+        while self.running:
+            label, path = choose()
+            start = time.time()
+            try:
+                ok = session.get(base_url + path, timeout=120).ok
+            except requests.RequestException:
+                ok = False
+            samples.append((label, start, time.time() - start, ok))
+            if self.think_time > 0:
+                time.sleep(self.think_time)
+        with self._lock:
+            self.samples.extend(samples)
+
+    def stop(self):
+        self.running = False
+        for thread in self._threads:
+            thread.join()
+
+
+def summarize(samples, start, end):
+    """Throughput and latency percentiles per label, for samples which started in [start, end)."""
+    by_label = {}
+    for label, t, seconds, ok in samples:
+        if start <= t < end:
+            by_label.setdefault(label, []).append((seconds, ok))
+    by_label['total'] = [s for label in list(by_label) for s in by_label[label]]
+    results = {}
+    for label, values in by_label.items():
+        latencies = sorted(seconds * 1000 for seconds, _ in values)
+        results[label] = {
+            'requests': len(values),
+            'errors': len([1 for _, ok in values if not ok]),
+            'rps': len(values) / (end - start),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else None,
+        }
+    return results
+
+
+def print_results(results, baseline=None):
+    print('%-32s %8s %7s %8s %8s %8s %8s %8s' % ('request', 'count', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms',
+                                                  'max ms'))
+    for label, r in sorted(results['requests'].items(), key=lambda item: (item[0] == 'total', item[0])):
+        if r['requests'] == 0:
+            continue
+        print('%-32s %8d %7d %8.1f %8.1f %8.1f %8.1f %8.1f' % (label, r['requests'], r['errors'], r['rps'], r['p50_ms'],
+                                                              r['p90_ms'], r['p99_ms'], r['max_ms']))
+        if baseline is not None and label in baseline['requests']:
+            b = baseline['requests'][label]
+            print('%-32s %8s %7s %+7.0f%% %+7.0f%% %+7.0f%% %+7.0f%%' % (
+                '  vs baseline', '', '', _change(r['rps'], b['rps']), _change(r['p50_ms'], b['p50_ms']),
+                _change(r['p90_ms'], b['p90_ms']), _change(r['p99_ms'], b['p99_ms'])))
+    print()
+    print('Emulated commands spawned: %s' % ', '.join('%s %d (%.1f/s)' % (name, count, count / results['seconds'])
+                                                       for name, count in sorted(results['spawns'].items())))
+    print('Peak memory: %s' % ', '.join('%s %.1f MB' % (name, (rss or 0) / 1e6)
+                                        for name, rss in sorted(results['peak_memory'].items())))
+    for i, metrics in enumerate(results['load_balancers']):
+        if metrics is not None:
+            endpoints = metrics['api_requests'].values()
+            print('lb-%d: %d API requests, %d errors, %d retries, last plan %.1f ms' % (
+                i, sum(e['requests'] for e in endpoints), sum(e['errors'] for e in endpoints),
+                sum(e['retries'] for e in endpoints), metrics.get('last_plan_ms') or 0))
+
+
+def _change(value, baseline):
+    if not baseline or value is None:
+        return 0.0
+    return (value - baseline) * 100.0 / baseline
+
+
+def main():
+    args = parser.parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='observatory-loadtest-')
+    os.makedirs(work_dir, exist_ok=True)
+    queue_types = {}
+    for queue in config.queues:
+        queue_types[queue.default_node_type] = (queue.name, queue.slots_per_node())
+    latency = {name: args.sge_latency for name in ('qstat', 'qhost', 'qdel', 'qmod')}
+    latency.update({name: args.starcluster_latency for name in ('listclusters', 'listinstances', 'spothistory')})
+    state_path, bin_dir = emulator.create(work_dir, CLUSTER_NAME, queue_types, args.nodes, args.jobs,
+                                          env_size=args.env_size, latency=latency)
+    print('Starting services, logs in %s' % work_dir, flush=True)
+    services = Services(args, work_dir, state_path, bin_dir)
+    try:
+        driver = Driver(args.think_time)
+        dashboard_url = 'http://127.0.0.1:%d' % services.dashboard_port
+        api_url = 'http://127.0.0.1:%d' % services.api_port
+        api_paths = [path for path, weight in API_REQUESTS for _ in range(weight)]
+        for _ in range(args.viewers):
+            driver.add(dashboard_url, lambda: (lambda p: ('dashboard %s' % p, p))(random.choice(DASHBOARD_PAGES)))
+        for _ in range(args.api_clients):
+            driver.add(api_url, lambda: (lambda p: ('api %s' % p, p))(random.choice(api_paths)))
+        print('Warming up for %d seconds' % args.warmup, flush=True)
+        time.sleep(args.warmup)
+        spawns_before = emulator.spawn_counts(state_path)
+        start = time.time()
+        peak_memory = {}
+        print('Measuring for %d seconds' % args.duration, flush=True)
+        while time.time() < start + args.duration:
+            for name, rss in services.memory().items():
+                if rss is not None:
+                    peak_memory[name] = max(rss, peak_memory.get(name, 0))
+            time.sleep(0.5)
+        end = time.time()
+        spawns_after = emulator.spawn_counts(state_path)
+        lb_metrics = services.load_balancer_metrics()
+        driver.stop()
+    finally:
+        services.stop()
+    results = {
+        'args': vars(args),
+        'seconds': end - start,
+        'requests': summarize(driver.samples, start, end),
+        'spawns': {name: count - spawns_before.get(name, 0) for name, count in spawns_after.items()},
+        'peak_memory': peak_memory,
+        'load_balancers': lb_metrics,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print()
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
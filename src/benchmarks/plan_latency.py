@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""Measure how long the load balancer takes to plan for a large synthetic cluster.
+
+Builds qhost and qstat output for a cluster with the given number of nodes and queued jobs, then times
+LoadBalancer.plan(), which makes no API requests.  Run from the src directory:
+
+Usage: python3 benchmarks/plan_latency.py --nodes 200 --jobs 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loadbalancer'))
+
+from cluster import Cluster
+import config
+import load_balancer
+
+
+parser = argparse.ArgumentParser(description='Time load balancer planning on a synthetic cluster.')
+parser.add_argument('--nodes', default=200, type=int, help='Number of nodes.')
+parser.add_argument('--jobs', default=20000, type=int, help='Number of jobs, running and queued.')
+parser.add_argument('--iterations', default=20, type=int, help='Number of plans to time.')
+
+
+def synthetic_cluster(node_count, job_count, now):
+    """qhost and qstat summary output for a cluster with node_count nodes, about half busy, and job_count jobs."""
+    hosts = [{'name': 'bench-master', 'load_avg': '0.1', 'queues': {}}]
+    running = []
+    for i in range(1, node_count + 1):
+        queue = config.queues[i % len(config.queues)]
+        slots = queue.slots_per_node()
+        used = slots if i % 2 == 0 else 0
+        hosts.append({'name': 'bench-node%03d' % i, 'load_avg': '0.5',
+                      'queues': {queue.name: {'slots': slots, 'slots_used': used, 'state_string': ''}}})
+        running.extend([queue.name] * used)
+    jobs = []
+    for job_id in range(job_count):
+        queue_name = config.queues[job_id % len(config.queues)].name
+        assigned = running.pop() if running and running[-1] == queue_name else None
+        jobs.append({'job_id': job_id, 'qr_name': queue_name, 'queue_name': assigned, 'owner': 'user%d' % (job_id % 20),
+                     'state': 'r' if assigned else 'qw', 'predecessors': [job_id - 1] if job_id % 10 == 0 else [],
+                     'submission_timestamp': now - random.randint(0, 3600), 'task_count': 1 if job_id % 50 else 100})
+    return hosts, jobs
+
+
+def main():
+    args = parser.parse_args()
+    now = int(time.time())
+    hosts_json, jobs_json = synthetic_cluster(args.nodes, args.jobs, now)
+    lb = load_balancer.LoadBalancer('127.0.0.1', 6361, dry_run=True)
+    timings = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        cluster = Cluster.parseFromJSON(hosts_json)
+        cluster.populateJobsFromJSON(jobs_json)
+        parsed = time.perf_counter()
+        lb.update_host_ages(cluster, store=False)
+        plan = lb.plan(cluster)
+        timings.append(((parsed - start) * 1000, (time.perf_counter() - parsed) * 1000))
+    parse_ms = sorted(t[0] for t in timings)
+    plan_ms = sorted(t[1] for t in timings)
+    print('%d nodes, %d jobs, %d actions' % (args.nodes, args.jobs, len(plan.actions)))
+    print('parse: median %.1f ms, max %.1f ms' % (parse_ms[len(parse_ms) // 2], parse_ms[-1]))
+    print('plan:  median %.1f ms, max %.1f ms' % (plan_ms[len(plan_ms) // 2], plan_ms[-1]))
+
+
+if __name__ == '__main__':
+    main()
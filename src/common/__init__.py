@@ -0,0 +1,4 @@
+"""Modules shared by the API server, dashboard and load balancer.
+
+Each service's entry point adds src/ to sys.path, so these are imported as common.<module>.
+"""
@@ -0,0 +1,73 @@
+"""Atomic checkpoints of service state to a local JSON file, so a restarted service can start warm.
+
+The file is written to a temporary file in the same directory and renamed over the checkpoint, so readers see either
+the old or the new checkpoint, never a partial one.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# Incremented when the format of saved state changes.  Checkpoints of other versions are ignored.
+VERSION = 1
+
+
+def save(path, state):
+    """Atomically replace the checkpoint at path with state, which must be JSON serializable."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': VERSION, 'saved_at': time.time(), 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def load(path, max_age=None):
+    """Load the checkpoint at path.
+
+    Args:
+        path (string) - Path of the checkpoint.
+        max_age (float) - Ignore checkpoints saved more than this many seconds ago.  If None, accept any age.
+
+    Returns:
+        (saved_at, state) - The time the checkpoint was saved and the saved state, or (None, None) if there is no
+                            usable checkpoint.
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError) as e:
+        print('Ignoring unreadable checkpoint %s: %s' % (path, e), flush=True)
+        return None, None
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != VERSION:
+        print('Ignoring checkpoint %s with unknown version' % path, flush=True)
+        return None, None
+    saved_at = checkpoint.get('saved_at', 0)
+    if max_age is not None and time.time() - saved_at > max_age:
+        print('Ignoring checkpoint %s saved %d seconds ago' % (path, time.time() - saved_at), flush=True)
+        return None, None
+    return saved_at, checkpoint.get('state')
+
+
+def save_periodically(path, interval, get_state):
+    """Save get_state() to path every interval seconds on a background thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                save(path, get_state())
+            except Exception as e:
+                print('Saving checkpoint %s failed: %s' % (path, e), flush=True)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
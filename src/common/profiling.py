@@ -0,0 +1,85 @@
+"""Opt-in request profiling and per-phase timing for Flask apps.
+
+Every request gets a Server-Timing header with the time spent in each phase recorded with phase(), the time spent
+rendering templates, and the total.
+If a profile directory is configured, a sample of requests (or any request with ?profile=1) is profiled with cProfile
+and the stats are saved to <profile_dir>/<timestamp>_<route>_<duration>ms.prof, for viewing with pstats or snakeviz.
+"""
+import contextlib
+import cProfile
+import os
+import random
+import re
+import time
+
+from flask import before_render_template
+from flask import g
+from flask import has_request_context
+from flask import request
+from flask import template_rendered
+
+from common import tracing
+
+
+@contextlib.contextmanager
+def phase(name, **attributes):
+    """Add the time spent in the with block to the named phase of the current request, if any, and record it as a
+    trace span with attributes."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(name, **attributes):
+            yield
+    finally:
+        if has_request_context():
+            timings = g.setdefault('phase_timings', {})
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _profile_filename(path, duration_ms):
+    route = re.sub('[^A-Za-z0-9_.-]+', '_', path).strip('_') or 'root'
+    return '%s_%s_%dms.prof' % (time.strftime('%Y%m%d-%H%M%S'), route, duration_ms)
+
+
+def init_app(app, profile_dir=None, sample_rate=0.0):
+    """Install timing and profiling hooks on a Flask app.
+
+    Args:
+        app (Flask) - The app to instrument.
+        profile_dir (string) - Directory to save profiles to.  If None, requests are never profiled.
+        sample_rate (float) - Fraction of requests to profile, from 0 to 1.
+    """
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def _start_render(sender, **extra):
+        g.render_start = time.perf_counter()
+
+    def _finish_render(sender, **extra):
+        if 'render_start' in g:
+            timings = g.setdefault('phase_timings', {})
+            timings['render'] = timings.get('render', 0.0) + time.perf_counter() - g.pop('render_start')
+
+    before_render_template.connect(_start_render, app, weak=False)
+    template_rendered.connect(_finish_render, app, weak=False)
+
+    @app.before_request
+    def _start_request():
+        g.request_start = time.perf_counter()
+        g.phase_timings = {}
+        g.profiler = None
+        if profile_dir is not None and (request.args.get('profile') == '1' or random.random() < sample_rate):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _finish_request(response):
+        if 'request_start' not in g:
+            return response
+        duration = time.perf_counter() - g.request_start
+        if g.profiler is not None:
+            g.profiler.disable()
+            g.profiler.dump_stats(os.path.join(profile_dir, _profile_filename(request.path, duration * 1000)))
+        metrics = ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in g.phase_timings.items()]
+        metrics.append('total;dur=%.1f' % (duration * 1000))
+        response.headers['Server-Timing'] = ', '.join(metrics)
+        return response
@@ -0,0 +1,106 @@
+"""Compact MessagePack encoding of API responses, and its decoding by API clients.
+
+Responses are encoded as a MessagePack map {'strings': [str], 'data': bytes}.  data is the MessagePack encoding of the
+response, in which every string that occurs more than once (owners, queue names, host names, dict keys) is replaced by
+an extension object of type STRING_REF_EXT_TYPE holding its index in strings as a 4-byte big-endian integer.
+
+The API server encodes responses with pack().  Its clients, the dashboard and the load balancer, ask for MessagePack
+with request_headers() and decode responses with decode_response(), which also accepts JSON.
+"""
+import collections
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+JSON_MIMETYPE = 'application/json'
+
+STRING_REF_EXT_TYPE = 1
+
+
+def available():
+    """Is the msgpack module installed."""
+    return msgpack is not None
+
+
+def _count_strings(obj, counts):
+    """Count occurrences of each string in obj, including dict keys."""
+    if isinstance(obj, str):
+        counts[obj] += 1
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            _count_strings(key, counts)
+            _count_strings(value, counts)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _count_strings(value, counts)
+
+
+def _replace_strings(obj, indices):
+    """Returns a copy of obj with strings in indices replaced by string table references."""
+    if isinstance(obj, str):
+        index = indices.get(obj)
+        if index is None:
+            return obj
+        return msgpack.ExtType(STRING_REF_EXT_TYPE, struct.pack('>I', index))
+    elif isinstance(obj, dict):
+        return {_replace_strings(k, indices): _replace_strings(v, indices) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_replace_strings(v, indices) for v in obj]
+    else:
+        return obj
+
+
+def request_headers():
+    """Headers for API server requests.  Prefer MessagePack if we can decode it."""
+    if msgpack is None:
+        return {}
+    return {'Accept': '%s, %s;q=0.9' % (MSGPACK_MIMETYPE, JSON_MIMETYPE)}
+
+
+def pack(obj):
+    """Encode obj as MessagePack with a shared string table.
+
+    Args:
+        obj - A JSON-compatible object.
+
+    Returns:
+        bytes
+    """
+    counts = collections.Counter()
+    _count_strings(obj, counts)
+    strings = [s for s, n in counts.items() if n > 1]
+    indices = {s: i for i, s in enumerate(strings)}
+    data = msgpack.packb(_replace_strings(obj, indices), use_bin_type=True)
+    return msgpack.packb({'strings': strings, 'data': data}, use_bin_type=True)
+
+
+
+def unpack(body):
+    """Decode bytes encoded by pack()."""
+    outer = msgpack.unpackb(body, raw=False)
+    strings = outer['strings']
+
+    def ext_hook(code, data):
+        if code == STRING_REF_EXT_TYPE:
+            return strings[struct.unpack('>I', data)[0]]
+        return msgpack.ExtType(code, data)
+    return msgpack.unpackb(outer['data'], raw=False, strict_map_key=False, ext_hook=ext_hook)
+
+
+def decode_response(response):
+    """Decode an API server response, which may be JSON or MessagePack encoded by pack().
+
+    Args:
+        response (requests.Response) - The response.
+
+    Raises:
+        ValueError if the body can't be decoded.
+    """
+    if msgpack is None or not response.headers.get('Content-Type', '').startswith(MSGPACK_MIMETYPE):
+        return response.json()
+    return unpack(response.content)
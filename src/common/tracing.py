@@ -0,0 +1,151 @@
+"""Lightweight request tracing across the dashboard, load balancer and API server.
+
+A trace is started for each incoming request (or load balancer poll), continuing the trace id and parent span id sent
+in the X-Trace-Id and X-Parent-Span-Id headers if present.  Code records timed spans with span(), and outgoing requests
+to other services include headers() so their spans join the same trace.  Finished spans are kept in a bounded
+in-memory buffer, viewable at /traces/<trace_id>, and are optionally appended to a JSON-lines file.
+"""
+import collections
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+
+TRACE_HEADER = 'X-Trace-Id'
+PARENT_SPAN_HEADER = 'X-Parent-Span-Id'
+
+# Number of finished spans kept in memory.
+MAX_SPANS = 10000
+
+_service_name = 'unknown'
+_trace_file = None
+_file_lock = threading.Lock()
+_spans = collections.deque(maxlen=MAX_SPANS)
+# Holds trace_id and the stack of open span ids for the current thread.
+_context = threading.local()
+
+
+def configure(service_name, trace_file=None):
+    """Set the service name recorded on spans, and the path of a JSON-lines file to append spans to, if any."""
+    global _service_name, _trace_file
+    _service_name = service_name
+    _trace_file = trace_file
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def start(trace_id=None, parent_span_id=None):
+    """Start or continue a trace on the current thread.
+
+    Returns:
+        The trace id.
+    """
+    _context.trace_id = trace_id or uuid.uuid4().hex
+    _context.span_ids = [parent_span_id] if parent_span_id else []
+    return _context.trace_id
+
+
+def finish():
+    """End the trace on the current thread."""
+    _context.trace_id = None
+    _context.span_ids = []
+
+
+def current_trace_id():
+    """The trace id of the current thread, or None."""
+    return getattr(_context, 'trace_id', None)
+
+
+def headers():
+    """Headers to send with outgoing requests to continue the current trace."""
+    trace_id = current_trace_id()
+    if trace_id is None:
+        return {}
+    result = {TRACE_HEADER: trace_id}
+    if _context.span_ids:
+        result[PARENT_SPAN_HEADER] = _context.span_ids[-1]
+    return result
+
+
+def _record(span):
+    _spans.append(span)
+    if _trace_file is not None:
+        line = json.dumps(span) + '\n'
+        with _file_lock:
+            with open(_trace_file, 'a') as f:
+                f.write(line)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record the with block as a span of the current trace.  Does nothing if there is no current trace."""
+    trace_id = current_trace_id()
+    if trace_id is None:
+        yield
+        return
+    span_id = _new_id()
+    parent_id = _context.span_ids[-1] if _context.span_ids else None
+    _context.span_ids.append(span_id)
+    start_time = time.time()
+    start_counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        _context.span_ids.pop()
+        _record({
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'service': _service_name,
+            'name': name,
+            'start': start_time,
+            'duration_ms': (time.perf_counter() - start_counter) * 1000,
+            'attributes': attributes,
+        })
+
+
+def recent_spans(trace_id=None):
+    """Returns finished spans held in memory, oldest first, optionally only those of trace_id."""
+    return [s for s in list(_spans) if trace_id is None or s['trace_id'] == trace_id]
+
+
+def init_app(app):
+    """Trace every request to a Flask app, and add /traces and /traces/<trace_id> viewer endpoints."""
+    from flask import jsonify
+    from flask import request
+
+    @app.before_request
+    def _start_trace():
+        start(request.headers.get(TRACE_HEADER), request.headers.get(PARENT_SPAN_HEADER))
+        _context.request_span = span('%s %s' % (request.method, request.path), kind='server')
+        _context.request_span.__enter__()
+
+    @app.after_request
+    def _add_trace_header(response):
+        if current_trace_id() is not None:
+            response.headers[TRACE_HEADER] = current_trace_id()
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exception):
+        request_span = getattr(_context, 'request_span', None)
+        if request_span is not None:
+            _context.request_span = None
+            request_span.__exit__(None, None, None)
+        finish()
+
+    def list_traces():
+        """List requests served by this service, newest first."""
+        request_spans = [s for s in recent_spans() if s['attributes'].get('kind') == 'server']
+        return jsonify(list(reversed(request_spans)))
+
+    def get_trace(trace_id):
+        """List the spans of one trace recorded by this service, ordered by start time."""
+        return jsonify(sorted(recent_spans(trace_id), key=lambda s: s['start']))
+
+    app.add_url_rule('/traces', 'list_traces', list_traces)
+    app.add_url_rule('/traces/<trace_id>', 'get_trace', get_trace)
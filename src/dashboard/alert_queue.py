@@ -1,22 +1,13 @@
-"""Manages a list of dismissable alerts."""
+"""Manages a list of dismissable alerts.  AlertQueue is safe to use from several request threads."""
+import heapq
+import itertools
+import threading
 import time
 import uuid
 
 
-def _index_matching_predicate(seq, pred):
-    """Return index of first item matching predicate.
-
-    Args:
-        seq - a list.
-        pred - a function with one argument, returning True or False.
-
-    Returns:
-        index or None
-    """
-    for i, v in enumerate(seq):
-        if pred(v):
-            return i
-    return None
+# Default maximum number of alerts held in an AlertQueue.
+DEFAULT_MAX_ALERTS = 100
 
 
 class Alert:
@@ -34,6 +25,12 @@ class Alert:
         self.title = title
         self.message = message
         self.expiration_ts = expiration_ts
+        # Number of times an identical alert has been added.
+        self.count = 1
+
+    def key(self):
+        """Identity used to collapse duplicate alerts."""
+        return (self.type, self.title, self.message)
 
     def expired_at_time(self, t):
         """Is alert expired."""
@@ -44,24 +41,42 @@ class Alert:
 
 
 class AlertQueue:
-    def __init__(self):
-        """Constructor"""
-        self._alerts = []
+    def __init__(self, max_alerts=DEFAULT_MAX_ALERTS):
+        """Constructor
+
+        Args:
+            max_alerts (int) - The maximum number of alerts to keep.  When full, the oldest alert is dropped.
+        """
+        self._max_alerts = max_alerts
+        # Maps alert_id to Alert, in insertion order.
+        self._alerts = {}
+        # Maps Alert.key() to alert_id, used to collapse duplicates.
+        self._alert_ids_by_key = {}
+        # Heap of (expiration_ts, sequence, alert_id).  Entries are removed lazily, so an entry is stale if the alert
+        # has been removed or its expiration_ts has changed since the entry was pushed.
+        self._expiration_heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.RLock()
 
     def remove_expired(self):
-        """Removes the first expired alert, if any."""
+        """Removes all expired alerts."""
         now = time.time()
-        index = _index_matching_predicate(self._alerts, lambda a: a.expired_at_time(now))
-        if not index is None:
-            del self._alerts[index]
+        with self._lock:
+            while self._expiration_heap and self._expiration_heap[0][0] < now:
+                expiration_ts, _, alert_id = heapq.heappop(self._expiration_heap)
+                alert = self._alerts.get(alert_id)
+                if alert is not None and alert.expiration_ts == expiration_ts:
+                    self.remove_alert(alert_id)
 
     def get_alerts(self):
         """Get list of alerts."""
-        self.remove_expired()
-        return self._alerts
+        with self._lock:
+            self.remove_expired()
+            return list(self._alerts.values())
 
     def add_alert(self, type, title, message, expiration_seconds=None):
-        """Add a new alert to the queue.
+        """Add a new alert to the queue.  If an identical alert is already queued, increments its count and extends its
+        expiration instead.
 
         Args:
             type (string) - The alert type.  One of {Alert.SUCCESS, Alert.INFO, Alert.WARNING, Alert.ERROR}
@@ -70,18 +85,53 @@ class AlertQueue:
             expiration_seconds (number) - The number of seconds to keep the alert.  If None, alert does not expire.
 
         Returns:
-            A new immutable Alert object.
+            The Alert object.
         """
-        alert_id = uuid.uuid4().hex
         expiration_ts = None
         if expiration_seconds:
             expiration_ts = time.time() + expiration_seconds
-        new_alert = Alert(alert_id, type, title, message, expiration_ts=expiration_ts)
-        self._alerts.append(new_alert)
-        return new_alert
+        with self._lock:
+            self.remove_expired()
+            existing_id = self._alert_ids_by_key.get((type, title, message))
+            if existing_id is not None:
+                alert = self._alerts[existing_id]
+                alert.count += 1
+                alert.expiration_ts = expiration_ts
+            else:
+                alert = Alert(uuid.uuid4().hex, type, title, message, expiration_ts=expiration_ts)
+                self._alerts[alert.alert_id] = alert
+                self._alert_ids_by_key[alert.key()] = alert.alert_id
+                if len(self._alerts) > self._max_alerts:
+                    oldest_id = next(iter(self._alerts))
+                    self.remove_alert(oldest_id)
+            if expiration_ts is not None:
+                heapq.heappush(self._expiration_heap, (expiration_ts, next(self._sequence), alert.alert_id))
+            return alert
+
+    def update_alert(self, alert_id, message):
+        """Change the message of an alert in place, keeping its id, count and position.
+
+        Args:
+            alert_id (string) - The id of the alert.
+            message (string) - The new message.
+
+        Returns:
+            The Alert object, or None if it is no longer queued.
+        """
+        with self._lock:
+            alert = self._alerts.get(alert_id)
+            if alert is None or alert.message == message:
+                return alert
+            if self._alert_ids_by_key.get(alert.key()) == alert_id:
+                del self._alert_ids_by_key[alert.key()]
+            alert.message = message
+            # If an identical alert is queued already, new duplicates keep collapsing into that one.
+            self._alert_ids_by_key.setdefault(alert.key(), alert_id)
+            return alert
 
     def remove_alert(self, alert_id):
         """Remove alert with the specified id from queue."""
-        index = _index_matching_predicate(self._alerts, lambda a: a.alert_id == alert_id)
-        if not index is None:
-            del self._alerts[index]
+        with self._lock:
+            alert = self._alerts.pop(alert_id, None)
+            if alert is not None and self._alert_ids_by_key.get(alert.key()) == alert_id:
+                del self._alert_ids_by_key[alert.key()]
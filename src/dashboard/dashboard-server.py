@@ -11,9 +11,20 @@ import re
 import requests
 import socket
 import subprocess
+import sys
+import threading
+import time
+
+# Modules shared between services are in src/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common import aws_static
+from common import profiling
+from common import serialization
+from common import tracing
 
 from alert_queue import *
-import aws_static
+from static_assets import StaticAssets
 
 
 parser = argparse.ArgumentParser(description='Run a dashboard web server exposing methods to administer StarCluster.')
@@ -21,23 +32,100 @@ parser.add_argument('--host_ip', default=socket.gethostbyname(socket.gethostname
 parser.add_argument('--port', default=6360, type=int, help='Port to listen on.')
 parser.add_argument('--api_server_host', default='127.0.0.1', type=str, help='IP address of the backend.')
 parser.add_argument('--api_server_port', default=6361, type=int, help='Port to use to connect to API server.')
+parser.add_argument('--cluster_name', type=str, help='Cluster to show, if the API server manages several.  Defaults to its default cluster.')
 parser.add_argument('--instance_types', default='c4.large,p2.xlarge,p3.2xlarge', type=str, help='Instance types user is allowed to launch.')
 parser.add_argument('--zones', type=str, help='Availability zones user is allowed to launch in.')
 parser.add_argument('--subnets', type=str, help='Subnets in VPC, for use with zones.')
+parser.add_argument('--profile_dir', type=str, help='If specified, save cProfile output for sampled requests to this directory.')
+parser.add_argument('--profile_sample_rate', default=0.0, type=float, help='Fraction of requests to profile, if profile_dir is set.')
+parser.add_argument('--trace_file', type=str, help='If specified, append trace spans to this JSON-lines file.')
 args = parser.parse_args()
 
 
 # TODO: make timezone a parameter or infer from region.
 timezone = pytz.timezone('America/Los_Angeles')
 
-app = Flask(__name__)
+# Static files are served by static_file, with fingerprinted URLs.
+app = Flask(__name__, static_folder=None)
+tracing.configure('dashboard', trace_file=args.trace_file)
+tracing.init_app(app)
+profiling.init_app(app, profile_dir=args.profile_dir, sample_rate=args.profile_sample_rate)
+
+def cluster_path(path):
+    """API server path for requests about our cluster."""
+    if args.cluster_name is None:
+        return path
+    return '/clusters/%s%s' % (args.cluster_name, path)
+
+
+class ApiError(Exception):
+    """The API server didn't answer a request with data: it was unreachable, returned an HTTP error such as 503 when
+    shedding load, or returned an error status."""
+    pass
+
+
+def api_get(path):
+    """Make a GET request to the API server, return the decoded response.
+
+    Args:
+        path (string) - The request path and query string, i.e. /qstat
+
+    Returns:
+        The decoded response.
+
+    Raises:
+        ApiError if the server was unreachable, returned an HTTP error, or returned {'status': 'error'}.
+    """
+    try:
+        with profiling.phase('api', kind='client', path=path):
+            headers = serialization.request_headers()
+            headers.update(tracing.headers())
+            response = requests.get('http://%s:%s%s' % (args.api_server_host, args.api_server_port, path),
+                                    headers=headers)
+    except requests.exceptions.RequestException as e:
+        raise ApiError('GET %s failed: %s' % (path, str(e)))
+    if not response:
+        raise ApiError('GET %s failed: HTTP %d' % (path, response.status_code))
+    with profiling.phase('parse'):
+        result = serialization.decode_response(response)
+    if isinstance(result, dict) and result.get('status') == 'error':
+        raise ApiError('GET %s failed: %s' % (path, result.get('error')))
+    return result
+
+
+def _or_unavailable(unavailable, name, default, f, *args):
+    """Return f(*args), or default if the API server didn't answer, adding name to the list unavailable.
+
+    Args:
+        unavailable ([string]) - Names of data the API server didn't provide, shown in a banner.
+        name (string) - Name of the data f gets, i.e. 'jobs'.
+        default - Value to use instead.
+        f (function) - Function which gets the data, and raises ApiError if the API server didn't answer.
+    """
+    try:
+        return f(*args)
+    except ApiError as e:
+        print(str(e), flush=True)
+        unavailable.append(name)
+        return default
+
 
 alert_queue = AlertQueue()
 
 
 url_prefix = '/observatory'
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'), os.path.join(url_prefix, 'static'))
+
+
 def static_url(path):
-    return os.path.join(url_prefix, 'static', path)
+    """URL of a static file, named by its content hash so browsers can cache it indefinitely."""
+    return static_assets.url(path)
+
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    """Serve a static file, compressed if the client accepts it."""
+    return static_assets.response(filename)
 
 
 @app.route('/')
@@ -47,11 +135,8 @@ def homepage():
 
 
 def get_jobs():
-    """Get all queued jobs from backend."""
-    result = requests.get('http://%s:%s/qstat' % (args.api_server_host, args.api_server_port))
-    jobs = []
-    if result:
-        jobs = result.json()
+    """Get all queued jobs from backend.  Raises ApiError if they are unavailable."""
+    jobs = api_get(cluster_path('/qstat'))
     for job in jobs:
         if 'submission_timestamp' in job:
             timestamp = int(job['submission_timestamp'])
@@ -60,46 +145,58 @@ def get_jobs():
     return jobs
 
 
+def task_count(jobs):
+    """Number of tasks in jobs, counting each task of an array job."""
+    return sum(j.get('task_count', 1) for j in jobs)
+
+
 @app.route('/jobs_tab.html')
 def jobs_tab():
     """Render jobs tab with navigation."""
-    jobs = get_jobs()
+    unavailable = []
+    jobs = _or_unavailable(unavailable, 'jobs', [], get_jobs)
     pending_jobs = [j for j in jobs if j['state'] == 'pending']
     running_jobs = [j for j in jobs if j['state'] == 'running']
     return render_template('jobs.html',
                            static_url=static_url,
                            jobs=jobs,
-                           pending_jobs=len(pending_jobs),
-                           running_jobs=len(running_jobs))
+                           pending_jobs=task_count(pending_jobs),
+                           running_jobs=task_count(running_jobs),
+                           unavailable=unavailable)
 
 
 @app.route('/jobs_content.html')
 def jobs_content():
     """Render jobs tab content only, no navigation."""
-    jobs = get_jobs()
+    unavailable = []
+    jobs = _or_unavailable(unavailable, 'jobs', [], get_jobs)
     pending_jobs = [j for j in jobs if j['state'] == 'pending']
     running_jobs = [j for j in jobs if j['state'] == 'running']
     return render_template('jobs_content.html',
                            static_url=static_url,
                            jobs=jobs,
-                           pending_jobs=len(pending_jobs),
-                           running_jobs=len(running_jobs))
+                           pending_jobs=task_count(pending_jobs),
+                           running_jobs=task_count(running_jobs),
+                           unavailable=unavailable)
+
 
+def get_nodes_and_cost(unavailable):
+    """Get list of nodes and total cost from backend.
 
-def get_nodes_and_cost():
-    """Get list of nodes and total cost from backend."""
+    Args:
+        unavailable ([string]) - Names of data the API server didn't provide are added to this list.
+    """
     total_cost = 0.0
     # Get host list from SGE.
-    sge_hosts_results = requests.get('http://%s:%s/qhost' % (args.api_server_host, args.api_server_port))
-    hosts_by_name = {h['name'] : h for h in sge_hosts_results.json() if 'name' in h}
+    hosts = _or_unavailable(unavailable, 'hosts', None, api_get, cluster_path('/qhost'))
+    hosts_by_name = {h['name'] : h for h in hosts or [] if 'name' in h}
 
     # Get instance list from starcluster, because SGE host list doesn't show failed or pending nodes.
-    instances_results = requests.get('http://%s:%s/instances' % (args.api_server_host, args.api_server_port))
-    instances = instances_results.json()
+    instances = _or_unavailable(unavailable, 'instances', [], api_get, cluster_path('/instances'))
 
     # Get job list from SGE, so we can show which jobs are running on each host.
-    jobs = get_jobs()
-    running_jobs = [j for j in jobs if j['state'] == 'running']
+    jobs = _or_unavailable(unavailable, 'jobs', None, get_jobs)
+    running_jobs = [j for j in jobs or [] if j['state'] == 'running']
     jobs_by_host = {}
     for job in running_jobs:
         job_host = job['queue_name'].split('@')[-1]
@@ -109,6 +206,14 @@ def get_nodes_and_cost():
         else:
             jobs_by_host[job_host] = [job_id]
 
+    # Get current prices of all spot instance types with one request.
+    spot_types = sorted(set(i['type'] for i in instances if i['spot_request'] is not None))
+    spot_prices = {}
+    if spot_types:
+        results = _or_unavailable(unavailable, 'spot prices', {'prices': []}, api_get,
+                                  '/spot_history?instance_types=%s' % ','.join(spot_types))
+        spot_prices = {p['instance_type']: float(p['current']) for p in results['prices']}
+
     nodes = []
     for instance in instances:
         name = instance['name']
@@ -116,6 +221,8 @@ def get_nodes_and_cost():
         if name in hosts_by_name:
             sge_host = hosts_by_name[name]
             host_dict = sge_host.copy()
+        elif hosts is None:
+            host_dict = {}  # Without qhost we can't tell whether the instance joined SGE.
         else:
             # If an instance is visible in starcluster listclusters, but not qhost, then it is probably booting up.
             # (or failed to join SGE)
@@ -126,6 +233,8 @@ def get_nodes_and_cost():
             host_dict['disable_terminate'] = True  # Disable termination if node running jobs.
         else:
             host_dict['job_ids'] = ''
+            if jobs is None:
+                host_dict['disable_terminate'] = True  # Without qstat we can't tell whether node is running jobs.
         host_dict['public_ip'] = instance['public_ip']
         host_dict['state'] = state
         host_dict['type'] = instance['type']
@@ -137,67 +246,126 @@ def get_nodes_and_cost():
             except ValueError:
                 host_dict['load_avg'] = '-'
         if not instance['spot_request'] is None:
-            prices_results = requests.get('http://%s:%s/spot_history?instance_types=%s' % (
-                args.api_server_host, args.api_server_port, instance['type']
-            ))
-            results = prices_results.json()
-            cost = float(results['prices'][0]['current'])
-            host_dict['cost'] = '$%.2f' % cost
-            total_cost += cost
-        elif instance['type'] in aws_static.ondemand_instance_cost:
-            cost = aws_static.ondemand_instance_cost[instance['type']]
+            cost = spot_prices.get(instance['type'])  # None if spot prices are unavailable.
+        else:
+            cost = aws_static.ondemand_instance_cost.get(instance['type'])
+        if cost is not None:
             host_dict['cost'] = '$%.2f' % cost
             total_cost += cost
         nodes.append(host_dict)
     return nodes, total_cost
 
 
-def check_errors():
-    """Check API server for list of errors, create alerts for all pending errors."""
-    get_errors_response = requests.get('http://%s:%s/get_errors' % (args.api_server_host, args.api_server_port))
-    get_errors_json = get_errors_response.json()
-    errors = get_errors_json['errors']
-    for error in errors:
-        stderr = error['error']
-        lines = stderr.split('\n')
-        # Find first line containing ERROR, or first line
-        error_text = lines[0]
-        for line in lines:
-            if 'ERROR' in line:
-                error_text = line
-                break
-        # Add it to alert queue as an error
-        alert_queue.add_alert(Alert.ERROR, error_text, '', 300)
+# Time the dashboard started.  Operations which finished earlier are not reported.
+_start_time = time.time()
+# Maps operation_id to the id of the alert showing its progress.
+_operation_alert_ids = {}
+# Ids of finished operations which have already been reported.
+_reported_operation_ids = set()
+# Held while reading or updating _operation_alert_ids and _reported_operation_ids, since requests run concurrently.
+_operations_lock = threading.Lock()
+
+
+def _error_text(lines):
+    """Find first line containing ERROR, or first line"""
+    for line in lines:
+        if 'ERROR' in line:
+            return line
+    return lines[0] if lines else ''
+
+
+def check_operations():
+    """Check API server for add and remove node operations, create alerts showing their progress and results.
+
+    Returns:
+        True if any operation is still queued or running.
+    """
+    try:
+        result = api_get(cluster_path('/operations'))
+    except ApiError as e:
+        # Keep the current alerts until the API server answers.
+        print(str(e), flush=True)
+        with _operations_lock:
+            return len(_operation_alert_ids) > 0
+    operations = result['operations']
+    operation_ids = set(op['operation_id'] for op in operations)
+    active = False
+    with _operations_lock:
+        # Remove progress alerts for operations the API server no longer knows about.
+        for operation_id in list(_operation_alert_ids):
+            if operation_id not in operation_ids:
+                alert_queue.remove_alert(_operation_alert_ids.pop(operation_id))
+        for op in operations:
+            operation_id = op['operation_id']
+            if op['state'] in ('queued', 'running'):
+                active = True
+                message = op['last_line'] or op['state']
+                # Update the progress alert in place, so it keeps its position and isn't re-rendered as new.
+                progress_alert_id = _operation_alert_ids.get(operation_id)
+                alert = None if progress_alert_id is None else alert_queue.update_alert(progress_alert_id, message)
+                if alert is None:
+                    alert = alert_queue.add_alert(Alert.INFO, op['identifier'], message)
+                    _operation_alert_ids[operation_id] = alert.alert_id
+                continue
+            progress_alert_id = _operation_alert_ids.pop(operation_id, None)
+            if progress_alert_id is not None:
+                alert_queue.remove_alert(progress_alert_id)
+            if operation_id not in _reported_operation_ids and op['end_time'] > _start_time:
+                _reported_operation_ids.add(operation_id)
+                if op['state'] == 'succeeded':
+                    alert_queue.add_alert(Alert.SUCCESS, op['identifier'], 'completed', 60)
+                else:
+                    tail = _or_unavailable([], 'operation output', {}, api_get,
+                                           cluster_path('/operations/%s/tail' % operation_id))
+                    lines = [l['text'] for l in tail.get('lines', []) if l['stream'] == 'stderr']
+                    alert_queue.add_alert(Alert.ERROR, _error_text(lines) or op['identifier'], '', 300)
+        _reported_operation_ids.intersection_update(operation_ids)
+    return active
+
+
+def get_month_spend():
+    """Spend on the cluster's instances this UTC month from the API server's cost ledger, formatted.  Raises ApiError
+    if it is unavailable."""
+    result = api_get(cluster_path('/cost?period=month'))
+    return '%.2f' % result['total']
 
 
 @app.route('/nodes_tab.html')
 def nodes_tab():
     """Render nodes tab."""
-    nodes, total_cost = get_nodes_and_cost()
+    unavailable = []
+    nodes, total_cost = get_nodes_and_cost(unavailable)
+    month_spend = _or_unavailable(unavailable, 'month spend', None, get_month_spend)
     return render_template('nodes.html',
                            static_url=static_url,
                            hosts=nodes,
                            host_count=len(nodes),
-                           total_cost='%.2f' % total_cost)
+                           total_cost='%.2f' % total_cost,
+                           month_spend=month_spend,
+                           unavailable=unavailable)
 
 
 @app.route('/nodes_content.html')
 def nodes_content():
     """Render nodes list content only no navigation."""
-    nodes, total_cost = get_nodes_and_cost()
+    unavailable = []
+    nodes, total_cost = get_nodes_and_cost(unavailable)
+    month_spend = _or_unavailable(unavailable, 'month spend', None, get_month_spend)
     return render_template('nodes_content.html',
                            static_url=static_url,
                            hosts=nodes,
                            host_count=len(nodes),
-                           total_cost='%.2f' % total_cost)
+                           total_cost='%.2f' % total_cost,
+                           month_spend=month_spend,
+                           unavailable=unavailable)
 
 
 @app.route('/nodes_alerts')
 def nodes_alerts():
     """Render alerts for nodes page."""
-    check_errors()
+    operations_active = check_operations()
     alerts = alert_queue.get_alerts()
-    return render_template('alerts.html', alerts=alerts)
+    return render_template('alerts.html', alerts=alerts, operations_active=operations_active)
 
 
 @app.route('/add_node')
@@ -207,7 +375,7 @@ def add_node():
     zone = request.args.get('zone')
     subnet = request.args.get('subnet')
     # Add a node
-    request_url = 'http://%s:%s/nodes/add' % (args.api_server_host, args.api_server_port)
+    request_url = '/nodes/add'
     if instance_type:
         request_url = request_url + '?instance_type=%s' % instance_type
         # For now, bid the on-demand instance price.
@@ -226,27 +394,29 @@ def add_node():
                 subnet = subnet_list[index]
     if subnet:
         request_url = request_url + '&subnet=%s' % subnet
-    add_result = requests.get(request_url)
-    alert_queue.add_alert(Alert.INFO, 'Instance Launching', instance_type, 60)
+    try:
+        api_get(cluster_path(request_url))
+    except ApiError as e:
+        alert_queue.add_alert(Alert.ERROR, 'Failed to add node', str(e), 300)
     return redirect(os.path.join(url_prefix, 'nodes_content.html'), code=302)
 
 
 @app.route('/remove_node')
 def remove_node():
     alias = request.args.get('alias')
-    remove_result = requests.get('http://%s:%s/nodes/%s/remove' % (args.api_server_host, args.api_server_port, alias))
-    # Remove specified node
-    alert_queue.add_alert(Alert.INFO, 'Shutting Down', alias, 60)
+    # Remove specified node.  Progress is reported by check_operations.
+    try:
+        api_get(cluster_path('/nodes/%s/remove' % alias))
+    except ApiError as e:
+        alert_queue.add_alert(Alert.ERROR, 'Failed to remove node %s' % alias, str(e), 300)
     return redirect(os.path.join(url_prefix, 'nodes_content.html'), code=302)
 
 
 @app.route('/launch_popover')
 def launch_popover():
     """Returns HTML content to populate the body of launch new instance popover."""
-    prices_results = requests.get('http://%s:%s/spot_history?instance_types=%s' % (
-        args.api_server_host, args.api_server_port, args.instance_types
-    ))
-    results = prices_results.json()
+    results = _or_unavailable([], 'spot prices', {'prices': []}, api_get,
+                              '/spot_history?instance_types=%s' % args.instance_types)
     prices = results['prices']
     first = True
     for price in prices:
@@ -274,7 +444,10 @@ def launch_popover():
 def cancel_job():
     # Cancel the specified job
     jid = request.args.get('jid')
-    cancel_result = requests.get('http://%s:%s/jobs/%s/cancel' % (args.api_server_host, args.api_server_port, jid))
+    try:
+        api_get(cluster_path('/jobs/%s/cancel' % jid))
+    except ApiError as e:
+        alert_queue.add_alert(Alert.ERROR, 'Failed to cancel job %s' % jid, str(e), 300)
     return redirect(os.path.join(url_prefix, 'jobs_content.html'), code=302)
 
 
@@ -53,15 +53,18 @@ $(function() {
             success: function(response) {
                 $('#alerts-container').html(response);
                 add_alert_handlers();
+                // Refresh quickly while nodes are launching or shutting down.
+                var active = $('#alerts-container .operations-active').length > 0;
+                setTimeout(load_alerts, active ? 5000 : 30000);
             },
             error: function(xhr) {
                 console.log('Failed to populate alerts.')
+                setTimeout(load_alerts, 30000);
             }
         });
     }
 
     load_alerts()
-    setTimeout(load_alerts, 30000)
 });
 
 
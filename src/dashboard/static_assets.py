@@ -0,0 +1,103 @@
+"""Fingerprinted, precompressed static files.
+
+At startup every file in the static directory is read, hashed and compressed with gzip, and with brotli if the brotli
+package is installed.  url() names files by content hash, i.e. dashboard.3f2a9c1b04de.css, so they can be cached by
+browsers forever: a changed file gets a new URL.  Files requested by their plain name are served with revalidation.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response
+from flask import request
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Cache-Control of fingerprinted URLs.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Cache-Control of plain URLs.  Browsers revalidate with the ETag on each use.
+REVALIDATE = 'no-cache'
+# Compressed variants are only kept if they save at least this fraction of the size.
+MIN_SAVING = 0.1
+
+
+class Asset:
+    """A static file with its content hash and compressed variants."""
+    def __init__(self, path, content):
+        self.path = path
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        root, ext = os.path.splitext(path)
+        self.fingerprinted_path = '%s.%s%s' % (root, self.digest, ext)
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        # Maps content encoding to body, in order of preference.
+        self.variants = {}
+        if brotli is not None:
+            self._add_variant('br', brotli.compress(content, quality=11), len(content))
+        self._add_variant('gzip', gzip.compress(content, compresslevel=9, mtime=0), len(content))
+        self.variants['identity'] = content
+
+    def _add_variant(self, encoding, body, size):
+        if len(body) <= size * (1 - MIN_SAVING):
+            self.variants[encoding] = body
+
+    def variant(self, accept_encoding):
+        """(encoding, body) of the variant a client prefers, by the q-values of its Accept-Encoding header.  Ties go
+        to our order of preference.  Encodings with q=0 are refused; the identity variant is the fallback.
+        """
+        accepted = parse_accept_header(accept_encoding)
+        best, best_quality = 'identity', 0
+        for encoding in self.variants:
+            quality = accepted.quality(encoding) if encoding != 'identity' else 0
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best, self.variants[best]
+
+
+class StaticAssets:
+    def __init__(self, static_dir, url_prefix):
+        """Constructor
+
+        Args:
+            static_dir (string) - Directory of static files.
+            url_prefix (string) - Prefix of static URLs, i.e. /observatory/static
+        """
+        self.url_prefix = url_prefix
+        # Maps plain and fingerprinted paths to Asset.
+        self._assets = {}
+        for directory, _, filenames in os.walk(static_dir):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                path = os.path.relpath(full_path, static_dir).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    asset = Asset(path, f.read())
+                self._assets[path] = asset
+                self._assets[asset.fingerprinted_path] = asset
+
+    def url(self, path):
+        """URL of a static file.  Fingerprinted if the file exists."""
+        asset = self._assets.get(path)
+        return '%s/%s' % (self.url_prefix, asset.fingerprinted_path if asset is not None else path)
+
+    def response(self, path):
+        """Flask response serving the static file requested as path."""
+        asset = self._assets.get(path)
+        if asset is None:
+            return Response('Not found', status=404, mimetype='text/plain')
+        encoding, body = asset.variant(request.headers.get('Accept-Encoding', ''))
+        etag = '"%s-%s"' % (asset.digest, encoding)
+        headers = {
+            'Cache-Control': IMMUTABLE if path == asset.fingerprinted_path else REVALIDATE,
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype=asset.mimetype, headers=headers)
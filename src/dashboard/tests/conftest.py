@@ -0,0 +1,29 @@
+"""The dashboard's modules are imported by name from src/dashboard, and shared modules from src/common, as
+dashboard-server.py does.
+
+Run with python -m pytest from src/dashboard.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+DASHBOARD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DASHBOARD_DIR)
+sys.path.insert(0, os.path.dirname(DASHBOARD_DIR))
+
+
+@pytest.fixture(scope='session')
+def dashboard():
+    """The dashboard-server.py module, loaded with default arguments."""
+    path = os.path.join(DASHBOARD_DIR, 'dashboard-server.py')
+    spec = importlib.util.spec_from_file_location('dashboard_server', path)
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = [path]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
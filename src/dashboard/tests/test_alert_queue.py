@@ -0,0 +1,111 @@
+import time
+
+import alert_queue
+from alert_queue import Alert
+from alert_queue import AlertQueue
+
+
+def test_update_alert_keeps_id_and_position():
+    queue = AlertQueue()
+    first = queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'queued')
+    queue.add_alert(Alert.INFO, 'add p3.2xlarge', 'queued')
+    updated = queue.update_alert(first.alert_id, 'running')
+    assert updated is first
+    assert [(a.title, a.message) for a in queue.get_alerts()] == [('add c5.4xlarge', 'running'),
+                                                                  ('add p3.2xlarge', 'queued')]
+    # Duplicates collapse into the alert under its new message.
+    assert queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'running') is first
+    assert queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'queued') is not first
+
+
+def test_update_alert_to_the_message_of_another_alert():
+    queue = AlertQueue()
+    first = queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'queued')
+    second = queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'running')
+    queue.update_alert(first.alert_id, 'running')
+    assert queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'running') is second
+    queue.remove_alert(first.alert_id)
+    assert queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'running') is second
+    assert second.count == 3
+
+
+def test_update_removed_alert_returns_none():
+    queue = AlertQueue()
+    alert = queue.add_alert(Alert.INFO, 'add c5.4xlarge', 'queued')
+    queue.remove_alert(alert.alert_id)
+    assert queue.update_alert(alert.alert_id, 'running') is None
+    assert queue.get_alerts() == []
+
+
+def test_identical_alerts_are_counted_once():
+    queue = AlertQueue()
+    first = queue.add_alert(Alert.ERROR, 'Failed to add node', 'timeout')
+    assert queue.add_alert(Alert.ERROR, 'Failed to add node', 'timeout') is first
+    assert queue.add_alert(Alert.ERROR, 'Failed to add node', 'timeout') is first
+    other = queue.add_alert(Alert.WARNING, 'Failed to add node', 'timeout')
+    assert first.count == 3
+    assert other.count == 1
+    assert queue.get_alerts() == [first, other]
+
+
+def test_duplicates_extend_expiration(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    queue = AlertQueue()
+    alert = queue.add_alert(Alert.ERROR, 'Failed to add node', 'timeout', 60)
+    now[0] = 1050.0
+    queue.add_alert(Alert.ERROR, 'Failed to add node', 'timeout', 60)
+    now[0] = 1070.0
+    assert queue.get_alerts() == [alert]
+    now[0] = 1111.0
+    assert queue.get_alerts() == []
+
+
+def test_alerts_expire_in_expiration_order(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    queue = AlertQueue()
+    late = queue.add_alert(Alert.INFO, 'late', '', 300)
+    early = queue.add_alert(Alert.INFO, 'early', '', 60)
+    forever = queue.add_alert(Alert.INFO, 'forever', '')
+    middle = queue.add_alert(Alert.INFO, 'middle', '', 120)
+    now[0] = 1061.0
+    assert queue.get_alerts() == [late, forever, middle]
+    now[0] = 1121.0
+    assert queue.get_alerts() == [late, forever]
+    now[0] = 1301.0
+    assert queue.get_alerts() == [forever]
+
+
+def test_removed_alerts_do_not_expire_their_replacements(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    queue = AlertQueue()
+    alert = queue.add_alert(Alert.INFO, 'node added', '', 60)
+    queue.remove_alert(alert.alert_id)
+    now[0] = 1030.0
+    replacement = queue.add_alert(Alert.INFO, 'node added', '', 60)
+    now[0] = 1061.0
+    assert queue.get_alerts() == [replacement]
+
+
+def test_oldest_alert_is_evicted_at_the_cap():
+    queue = AlertQueue()
+    alerts = [queue.add_alert(Alert.INFO, 'alert %d' % i, '') for i in range(alert_queue.DEFAULT_MAX_ALERTS)]
+    assert queue.get_alerts() == alerts
+    newest = queue.add_alert(Alert.INFO, 'alert %d' % alert_queue.DEFAULT_MAX_ALERTS, '')
+    assert queue.get_alerts() == alerts[1:] + [newest]
+    # The evicted alert no longer collapses duplicates.
+    readded = queue.add_alert(Alert.INFO, 'alert 0', '')
+    assert readded is not alerts[0]
+    assert queue.get_alerts() == alerts[2:] + [newest, readded]
+
+
+def test_duplicates_do_not_count_toward_the_cap():
+    queue = AlertQueue(max_alerts=2)
+    first = queue.add_alert(Alert.INFO, 'first', '')
+    second = queue.add_alert(Alert.INFO, 'second', '')
+    for _ in range(5):
+        queue.add_alert(Alert.INFO, 'first', '')
+    assert queue.get_alerts() == [first, second]
+    assert first.count == 6
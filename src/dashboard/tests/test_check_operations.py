@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from alert_queue import Alert
+from alert_queue import AlertQueue
+
+
+@pytest.fixture
+def operations(dashboard, monkeypatch):
+    """Operations the API server reports, and a fresh alert queue and operation state."""
+    current = []
+    monkeypatch.setattr(dashboard, 'alert_queue', AlertQueue())
+    monkeypatch.setattr(dashboard, '_operation_alert_ids', {})
+    monkeypatch.setattr(dashboard, '_reported_operation_ids', set())
+
+    def api_get(path):
+        if path.endswith('/tail'):
+            return {'lines': [{'stream': 'stderr', 'text': 'ERROR: no capacity'}]}
+        return {'status': 'ok', 'operations': [dict(op) for op in current]}
+    monkeypatch.setattr(dashboard, 'api_get', api_get)
+    return current
+
+
+def _operation(state, last_line='', end_time=None):
+    return {'operation_id': 'op1', 'identifier': 'add c5.4xlarge', 'state': state, 'last_line': last_line,
+            'end_time': end_time}
+
+
+def test_progress_alerts_are_updated_in_place(dashboard, operations):
+    operations.append(_operation('queued'))
+    assert dashboard.check_operations()
+    [queued] = dashboard.alert_queue.get_alerts()
+    assert (queued.type, queued.title, queued.message) == (Alert.INFO, 'add c5.4xlarge', 'queued')
+    operations[0] = _operation('running', 'Launching node002')
+    assert dashboard.check_operations()
+    operations[0] = _operation('running', 'Waiting for SSH')
+    assert dashboard.check_operations()
+    [running] = dashboard.alert_queue.get_alerts()
+    assert running.alert_id == queued.alert_id
+    assert running.message == 'Waiting for SSH'
+    assert running.count == 1
+
+
+def test_finished_operations_replace_their_progress_alert_once(dashboard, operations):
+    operations.append(_operation('running', 'Launching node002'))
+    dashboard.check_operations()
+    operations[0] = _operation('succeeded', end_time=time.time() + 1)
+    assert not dashboard.check_operations()
+    assert not dashboard.check_operations()
+    [alert] = dashboard.alert_queue.get_alerts()
+    assert (alert.type, alert.message, alert.count) == (Alert.SUCCESS, 'completed', 1)
+
+
+def test_failed_operations_report_their_error(dashboard, operations):
+    operations.append(_operation('failed', end_time=time.time() + 1))
+    dashboard.check_operations()
+    [alert] = dashboard.alert_queue.get_alerts()
+    assert (alert.type, alert.title) == (Alert.ERROR, 'ERROR: no capacity')
+
+
+def test_progress_alerts_of_forgotten_operations_are_removed(dashboard, operations):
+    operations.append(_operation('running'))
+    dashboard.check_operations()
+    operations.clear()
+    assert not dashboard.check_operations()
+    assert dashboard.alert_queue.get_alerts() == []
+    assert dashboard._operation_alert_ids == {}
+
+
+def test_dismissed_progress_alerts_are_shown_again(dashboard, operations):
+    operations.append(_operation('running', 'Launching node002'))
+    dashboard.check_operations()
+    [alert] = dashboard.alert_queue.get_alerts()
+    dashboard.alert_queue.remove_alert(alert.alert_id)
+    operations[0] = _operation('running', 'Waiting for SSH')
+    dashboard.check_operations()
+    assert [a.message for a in dashboard.alert_queue.get_alerts()] == ['Waiting for SSH']
@@ -0,0 +1,99 @@
+import gzip
+
+import flask
+import pytest
+
+import static_assets
+
+CSS = b'body { margin: 0; }\n' * 200
+
+
+@pytest.fixture
+def asset():
+    """An asset with br, gzip and identity variants, whether or not brotli is installed."""
+    result = static_assets.Asset('dashboard.css', CSS)
+    result.variants = {'br': b'br body', 'gzip': gzip.compress(CSS), 'identity': CSS}
+    return result
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('', 'identity'),
+    ('gzip', 'gzip'),
+    ('br', 'br'),
+    ('gzip, br', 'br'),
+    ('gzip, deflate, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0.5, gzip;q=0.5', 'br'),
+    ('*', 'br'),
+    ('*;q=0.5, gzip', 'gzip'),
+    ('gzip;q=0.5, *;q=0.8', 'br'),
+])
+def test_preferred_encoding(asset, accept_encoding, expected):
+    assert asset.variant(accept_encoding)[0] == expected
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('br;q=0', 'identity'),
+    ('br;q=0, gzip', 'gzip'),
+    ('gzip;q=0, br;q=0', 'identity'),
+    ('*;q=0', 'identity'),
+    ('*, br;q=0', 'gzip'),
+    ('gzip;q=0, *', 'br'),
+    ('*, br;q=0, gzip;q=0', 'identity'),
+    ('identity;q=0', 'identity'),
+])
+def test_encodings_with_q_0_are_refused(asset, accept_encoding, expected):
+    assert asset.variant(accept_encoding)[0] == expected
+
+
+def test_variants_which_save_too_little_are_dropped():
+    asset = static_assets.Asset('logo.png', bytes(range(256)))
+    assert list(asset.variants) == ['identity']
+    assert asset.variant('br, gzip') == ('identity', bytes(range(256)))
+
+
+def test_br_is_preferred_when_brotli_is_installed():
+    pytest.importorskip('brotli')
+    asset = static_assets.Asset('dashboard.css', CSS)
+    assert list(asset.variants) == ['br', 'gzip', 'identity']
+    assert asset.variant('gzip, br')[0] == 'br'
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'dashboard.css').write_bytes(CSS)
+    return static_assets.StaticAssets(str(tmp_path), '/static')
+
+
+@pytest.fixture
+def client(assets):
+    app = flask.Flask(__name__, static_folder=None)
+    app.add_url_rule('/static/<path:path>', 'static', assets.response)
+    return app.test_client()
+
+
+def test_fingerprinted_urls_are_immutable(assets, client):
+    url = assets.url('dashboard.css')
+    assert url != '/static/dashboard.css'
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Cache-Control'] == static_assets.IMMUTABLE
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == CSS
+
+
+def test_plain_urls_revalidate_by_etag_per_encoding(client):
+    response = client.get('/static/dashboard.css', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert response.headers['Cache-Control'] == static_assets.REVALIDATE
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == CSS
+    etag = response.headers['ETag']
+    assert etag.endswith('-identity"')
+    revalidated = client.get('/static/dashboard.css', headers={'Accept-Encoding': 'gzip;q=0', 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    other_encoding = client.get('/static/dashboard.css', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert other_encoding.status_code == 200
+
+
+def test_unknown_files_are_not_found(client):
+    assert client.get('/static/missing.css').status_code == 404
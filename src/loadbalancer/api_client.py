@@ -0,0 +1,150 @@
+"""HTTP client for the API server, with connection pooling, timeouts, retries and request metrics."""
+import random
+import threading
+import time
+
+import requests
+import requests.adapters
+
+from common import serialization
+from common import tracing
+
+
+# Seconds to wait for a connection, and for the server to start sending a response.
+DEFAULT_CONNECT_TIMEOUT = 3
+DEFAULT_READ_TIMEOUT = 60
+# Number of attempts for requests which are safe to retry.
+DEFAULT_ATTEMPTS = 3
+# Seconds a request may take in all, including retries and backoff.  Each attempt's timeouts are capped by what is left.
+DEFAULT_DEADLINE = 90
+# Backoff before retry n (from 1) is a random time up to BACKOFF_BASE * 2^(n-1) seconds, capped at BACKOFF_MAX.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+
+
+class ApiError(Exception):
+    """A request to the API server failed, after all attempts if it was retried."""
+    pass
+
+
+def _retry_after_seconds(response):
+    """Seconds in the Retry-After header of response, or 0 if it has none or it isn't a number of seconds."""
+    try:
+        return max(0, int(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        return 0
+
+
+class _EndpointStats:
+    """Request counters for one endpoint."""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_ms': self.total_seconds * 1000 / self.requests if self.requests else 0,
+            'max_ms': self.max_seconds * 1000,
+        }
+
+
+class ApiClient:
+    def __init__(self, host, port, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 attempts=DEFAULT_ATTEMPTS, deadline=DEFAULT_DEADLINE, pool_size=4):
+        """Constructor
+
+        Args:
+            host (string) - The IP address of the API server.
+            port (int) - The port to connect to.
+            connect_timeout (float) - Seconds to wait for a connection.
+            read_timeout (float) - Seconds to wait for the server to respond.
+            attempts (int) - Maximum number of attempts of requests which are safe to retry.
+            deadline (float) - Seconds a request may take in all, including retries and backoff.
+            pool_size (int) - Number of connections to keep open to the API server.
+        """
+        self.base_url = 'http://%s:%s' % (host, port)
+        self.timeout = (connect_timeout, read_timeout)
+        self.attempts = attempts
+        self.deadline = deadline
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, endpoint, seconds, error, retries):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, _EndpointStats())
+            stats.requests += 1
+            stats.errors += 1 if error else 0
+            stats.retries += retries
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def get(self, path, retry=True, deadline=None):
+        """Make a GET request to the API server, return the decoded response.
+
+        Args:
+            path (string) - The request path and query string, i.e. /qhost
+            retry (bool) - Retry on connection errors, timeouts and 5xx responses, waiting at least as long as a
+                           Retry-After header asks, up to BACKOFF_MAX.  4xx responses fail at once, since they would
+                           fail again.  Should be False for requests with side effects, like adding a node.
+            deadline (float) - Seconds the request may take in all, or None for the client's deadline.  No retry is
+                               started that would begin after the deadline.
+
+        Raises:
+            ApiError if the request failed.
+        """
+        endpoint = path.split('?')[0]
+        attempts = self.attempts if retry else 1
+        start = time.perf_counter()
+        deadline_at = start + (self.deadline if deadline is None else deadline)
+        error = None
+        # Seconds the server asked us to wait before retrying, from the Retry-After header of a 503 response.
+        retry_after = 0
+        attempts_made = 0
+        with tracing.span('api', kind='client', path=path):
+            for attempt in range(attempts):
+                if attempt > 0:
+                    backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+                    wait = max(backoff, min(retry_after, BACKOFF_MAX))
+                    if time.perf_counter() + wait >= deadline_at:
+                        error = '%s, deadline exceeded' % error
+                        break
+                    time.sleep(wait)
+                remaining = deadline_at - time.perf_counter()
+                if remaining <= 0:
+                    error = 'deadline exceeded' if error is None else '%s, deadline exceeded' % error
+                    break
+                timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+                attempts_made += 1
+                try:
+                    headers = serialization.request_headers()
+                    headers.update(tracing.headers())
+                    response = self._session.get(self.base_url + path, headers=headers, timeout=timeout)
+                    if response.status_code >= 500:
+                        error = 'HTTP %d' % response.status_code
+                        retry_after = _retry_after_seconds(response)
+                        continue
+                    if 400 <= response.status_code < 500:
+                        # The request itself is wrong, i.e. an unknown path.  Its body may not be JSON.
+                        error = 'HTTP %d' % response.status_code
+                        break
+                    result = serialization.decode_response(response)
+                    self._record(endpoint, time.perf_counter() - start, False, attempt)
+                    return result
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    error = str(e)
+            self._record(endpoint, time.perf_counter() - start, True, max(0, attempts_made - 1))
+            raise ApiError('GET %s failed after %d attempts: %s' % (path, attempts_made, error))
+
+    def metrics(self):
+        """Request counters and latency for each endpoint."""
+        with self._stats_lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self._stats.items()}
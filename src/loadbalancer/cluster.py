@@ -1,4 +1,5 @@
 """Cluster defines the cluster state as a list/collection of nodes."""
+import math
 
 from job import Job
 from node import JobQueue
@@ -25,7 +26,7 @@ class Cluster:
             for qname, queue_json in queues.items():
                 slots = int(queue_json['slots'])
                 slots_used = int(queue_json['slots_used'])
-                job_queues[qname] = JobQueue(qname, slots, slots_used)
+                job_queues[qname] = JobQueue(qname, slots, slots_used, queue_json.get('state_string'))
             node = Node(name, job_queues, int(load*100))
             if node.cluster_name():
                 cluster_name = node.cluster_name()
@@ -33,6 +34,7 @@ class Cluster:
         return Cluster(cluster_name, nodes)
 
     def populateJobsFromJSON(self, json):
+        """Populate job list from /qstat?summary=true output"""
         jobs = []
         for job_json in json:
             job_id = int(job_json['job_id'])
@@ -42,7 +44,8 @@ class Cluster:
             state = job_json['state']
             predecessors = job_json['predecessors']
             submit_timestamp = int(job_json['submission_timestamp'])
-            job = Job(job_id, requested_queue, assigned_queue, owner, state, predecessors, submit_timestamp)
+            task_count = int(job_json.get('task_count', 1))
+            job = Job(job_id, requested_queue, assigned_queue, owner, state, predecessors, submit_timestamp, task_count)
             jobs.append(job)
         self.jobs = jobs
 
@@ -64,9 +67,45 @@ class Cluster:
         """Get all pending jobs which are ready to be scheduled"""
         return [j for j in self.pending_jobs(queue) if not j.has_predecessors()]
 
-    def available_slots(self, queue=None):
-        """Get total number of available slots on specified queue."""
-        return sum(n.available_slots(queue) for n in self.nodes)
+    def runnable_slots(self, queue=None):
+        """Get the number of slots needed to run all runnable jobs.  Each task of an array job needs a slot."""
+        return sum(j.task_count for j in self.runnable_jobs(queue))
+
+    def runnable_wait_percentile(self, queue, percentile, now):
+        """Get the percentile of how long runnable jobs on specified queue have been waiting, in seconds.
+
+        Args:
+            queue (str) - The queue name, or None for all queues.
+            percentile (float) - The percentile, from 0 to 100.
+            now (float) - The current unix timestamp.
+
+        Returns:
+            The wait time in seconds (nearest-rank over tasks), or 0 if there are no runnable jobs.
+        """
+        waits = sorted((now - j.submit_timestamp, j.task_count) for j in self.runnable_jobs(queue))
+        total = sum(count for _, count in waits)
+        if total == 0:
+            return 0
+        # Tasks of an array job share its wait time, so each job counts once per task.
+        rank = max(1, int(math.ceil(percentile / 100.0 * total)))
+        for wait, count in waits:
+            rank -= count
+            if rank <= 0:
+                return wait
+        return waits[-1][0]
+
+    def available_slots(self, queue=None, include_disabled=False):
+        """Get total number of available slots on specified queue, excluding disabled queue instances unless
+        include_disabled is true."""
+        return sum(n.available_slots(queue, include_disabled) for n in self.nodes)
+
+    def total_slots(self, queue=None):
+        """Get total number of slots on specified queue."""
+        return sum(n.total_slots(queue) for n in self.nodes)
+
+    def slot_demand(self, queue=None):
+        """Slots in use plus slots needed by runnable jobs on specified queue."""
+        return self.total_slots(queue) - self.available_slots(queue, include_disabled=True) + self.runnable_slots(queue)
 
     def __str__(self):
         lines = [
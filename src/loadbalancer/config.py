@@ -2,11 +2,33 @@
 from sge_queue import SGEQueue
 
 
+# Warm pools are off by default.  To keep idle slots ready on a queue, set its min_idle_slots, and cap their cost with
+# warm_pool_budget_per_hour.
 queues = [
-    SGEQueue('cpu.q', 'c5.4xlarge', {'c4.xlarge': 1, 'c5.2xlarge': 2, 'c5.4xlarge': 4, 'c5.9xlarge': 9}, max_nodes=8),
-    SGEQueue('gpu.q', 'p3.2xlarge', {'p3.2xlarge': 1, 'p3.8xlarge': 4, 'p2.xlarge': 1, 'p2.8xlarge': 4}, max_nodes=4),
+    SGEQueue('cpu.q', 'c5.4xlarge', {'c4.xlarge': 1, 'c5.2xlarge': 2, 'c5.4xlarge': 4, 'c5.9xlarge': 9}, max_nodes=8,
+             wait_slo_seconds=30 * 60),
+    SGEQueue('gpu.q', 'p3.2xlarge', {'p3.2xlarge': 1, 'p3.8xlarge': 4, 'p2.xlarge': 1, 'p2.8xlarge': 4}, max_nodes=4,
+             wait_slo_seconds=15 * 60, node_cost_per_hour=3.06),
     SGEQueue('mem.q', 'c5.18xlarge', {'m4.16xlarge': 1, 'c5.18xlarge': 1, 'c5.24xlarge': 1}, max_nodes=3),
 ]
 
+# Percentile of runnable job wait time compared to each queue's wait_slo_seconds.
+wait_percentile = 95
+
 # Don't terminate a node if it is younger than this number of minutes
 min_age_minutes = 30
+
+# If a launched node hasn't joined the cluster after this number of minutes, assume the launch failed.
+launch_timeout_minutes = 20
+
+# If a node requested for removal is still in the cluster after this number of minutes, try removing it again.
+remove_timeout_minutes = 15
+
+# When forecasting is enabled, launch nodes this number of minutes ahead of forecast demand, i.e. node boot time.
+prewarm_lead_minutes = 10
+
+# Days of utilization history to learn demand patterns from when the load balancer starts.
+forecast_history_days = 28
+
+# Typical time for a new node to boot and join SGE, used to estimate the wait saved by warm pools.
+node_boot_minutes = 8
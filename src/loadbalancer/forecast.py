@@ -0,0 +1,136 @@
+"""Forecasts slot demand per queue from its weekly pattern, so capacity can be launched before expected bursts.
+
+Time is divided into bins of bin_minutes within a week.  For each queue and bin, DemandForecaster keeps the count, sum
+and sum of squares of observed slot demand (slots used plus slots needed by runnable jobs), and forecasts the mean plus
+stddevs standard deviations.  Observations are decayed by decay per week, so the pattern follows changes in usage.
+
+All computation is on numpy arrays, so forecasts for a recorded trace can be evaluated offline with evaluate().
+"""
+import numpy as np
+
+
+SECONDS_PER_WEEK = 7 * 24 * 3600
+# The unix epoch was a Thursday.  Offset so bin 0 starts on Monday at 00:00 UTC.
+WEEK_OFFSET_SECONDS = 3 * 24 * 3600
+
+
+class DemandForecaster:
+    def __init__(self, bin_minutes=15, stddevs=1.0, min_weeks=2, decay=0.8):
+        """Constructor
+
+        Args:
+            bin_minutes (int) - Width of time of week bins.
+            stddevs (float) - Forecast this many standard deviations above mean demand.
+            min_weeks (float) - Don't forecast for bins observed for less than this many weeks.
+            decay (float) - Weight of an observation after one week, relative to a new one.
+        """
+        self.bin_seconds = bin_minutes * 60
+        self.bin_count = SECONDS_PER_WEEK // self.bin_seconds
+        self.stddevs = stddevs
+        self.min_weeks = min_weeks
+        self.decay = decay
+        # Maps queue name to array of shape (3, bin_count) holding weight, sum and sum of squares per bin.  A bin observed
+        # for its whole width has a weight of 1 (before decay).
+        self._stats = {}
+        # Time the weights in _stats are relative to.
+        self._decayed_to = None
+
+    def bins(self, timestamps):
+        """Time of week bin of each unix timestamp."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        return ((timestamps - WEEK_OFFSET_SECONDS) // self.bin_seconds).astype(np.int64) % self.bin_count
+
+    def _weights(self, timestamps, now):
+        """Decayed weight of observations at timestamps, as of now."""
+        age_weeks = (now - np.asarray(timestamps, dtype=np.float64)) / SECONDS_PER_WEEK
+        return self.decay ** np.clip(age_weeks, 0, None)
+
+    def _decay_to(self, now):
+        """Decay stored observations to be relative to now."""
+        if self._decayed_to is not None and now > self._decayed_to:
+            factor = self.decay ** ((now - self._decayed_to) / SECONDS_PER_WEEK)
+            for stats in self._stats.values():
+                stats *= factor
+        if self._decayed_to is None or now > self._decayed_to:
+            self._decayed_to = now
+
+    def fit(self, queue_name, timestamps, demand, sample_seconds, now=None):
+        """Add a trace of observations of a queue.
+
+        Args:
+            queue_name (string) - The queue.
+            timestamps (array) - Unix timestamps of observations.
+            demand (array) - Slot demand at each timestamp.  NaN values are skipped.
+            sample_seconds (float) - Time between observations.
+            now (float) - Time to decay observations to.  Defaults to the last timestamp.  Observations are never decayed
+                          back to an earlier time than previous fit() calls.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        demand = np.asarray(demand, dtype=np.float64)
+        valid = ~np.isnan(demand)
+        timestamps, demand = timestamps[valid], demand[valid]
+        if len(timestamps) == 0:
+            return
+        if now is None:
+            now = timestamps.max()
+        self._decay_to(now)
+        bins = self.bins(timestamps)
+        weights = self._weights(timestamps, self._decayed_to) * min(1.0, sample_seconds / self.bin_seconds)
+        stats = self._stats.setdefault(queue_name, np.zeros((3, self.bin_count)))
+        stats[0] += np.bincount(bins, weights=weights, minlength=self.bin_count)
+        stats[1] += np.bincount(bins, weights=weights * demand, minlength=self.bin_count)
+        stats[2] += np.bincount(bins, weights=weights * demand * demand, minlength=self.bin_count)
+
+    def observe(self, timestamp, demand_by_queue, sample_seconds):
+        """Add one observation of each queue's slot demand, i.e. on each load balancer poll."""
+        for queue_name, demand in demand_by_queue.items():
+            self.fit(queue_name, [timestamp], [demand], sample_seconds)
+
+    def forecast(self, queue_name, timestamps):
+        """Forecast slot demand of queue at each timestamp.
+
+        Returns:
+            Array of forecast demand, NaN where there are too few observations.
+        """
+        bins = self.bins(timestamps)
+        stats = self._stats.get(queue_name)
+        if stats is None:
+            return np.full(len(bins), np.nan)
+        weight, total, squares = stats[0][bins], stats[1][bins], stats[2][bins]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / weight
+            variance = np.clip(squares / weight - mean * mean, 0, None)
+            result = mean + self.stddevs * np.sqrt(variance)
+        result[weight < self.min_weeks * self.decay ** self.min_weeks] = np.nan
+        return result
+
+    def evaluate(self, queue_name, timestamps, demand, slots_per_node):
+        """Compare forecasts with recorded demand, as if nodes were launched ahead of time to match them.
+
+        Args:
+            queue_name (string) - The queue.
+            timestamps (array) - Unix timestamps of the recorded trace, evenly spaced.  Should not overlap the
+                                 observations the forecaster was fit to.
+            demand (array) - Recorded slot demand.
+            slots_per_node (int) - Slots per launched node.
+
+        Returns:
+            {} - Dict with forecast_slot_hours (capacity launched for forecasts, rounded up to nodes),
+                 unmet_slot_hours (demand above the forecast capacity), idle_slot_hours (forecast capacity above
+                 demand) and coverage (fraction of the trace with a forecast).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        demand = np.asarray(demand, dtype=np.float64)
+        if len(timestamps) < 2:
+            return {'forecast_slot_hours': 0.0, 'unmet_slot_hours': 0.0, 'idle_slot_hours': 0.0, 'coverage': 0.0}
+        step_hours = np.median(np.diff(timestamps)) / 3600.0
+        forecast = self.forecast(queue_name, timestamps)
+        valid = ~np.isnan(forecast) & ~np.isnan(demand)
+        capacity = np.ceil(forecast[valid] / slots_per_node) * slots_per_node
+        actual = demand[valid]
+        return {
+            'forecast_slot_hours': float(capacity.sum() * step_hours),
+            'unmet_slot_hours': float(np.clip(actual - capacity, 0, None).sum() * step_hours),
+            'idle_slot_hours': float(np.clip(capacity - actual, 0, None).sum() * step_hours),
+            'coverage': float(valid.mean()),
+        }
@@ -0,0 +1,177 @@
+"""Tracks nodes the load balancer has asked to launch or remove, until the change shows up in qhost."""
+
+# States of API server operations, from subprocess_queue.Operation
+OPERATION_SUCCEEDED = 'succeeded'
+OPERATION_FAILED = 'failed'
+# Instance states which mean an instance is booting or up.
+LIVE_INSTANCE_STATES = frozenset(['pending', 'running'])
+
+
+class Launch:
+    """A node launch requested by the load balancer."""
+    def __init__(self, operation_id, queue_name, node_type, slots, request_time):
+        self.operation_id = operation_id
+        self.queue_name = queue_name
+        self.node_type = node_type
+        self.slots = slots
+        self.request_time = request_time
+        self.alias = None  # Set when matched to a booting instance.
+
+    def to_dict(self, now):
+        return {
+            'operation_id': self.operation_id,
+            'queue': self.queue_name,
+            'node_type': self.node_type,
+            'slots': self.slots,
+            'alias': self.alias,
+            'age_seconds': now - self.request_time,
+        }
+
+
+class Removal:
+    """A node removal requested by the load balancer."""
+    def __init__(self, operation_id, alias, request_time):
+        self.operation_id = operation_id
+        self.alias = alias
+        self.request_time = request_time
+
+    def to_dict(self, now):
+        return {
+            'operation_id': self.operation_id,
+            'alias': self.alias,
+            'age_seconds': now - self.request_time,
+        }
+
+
+class InFlightTracker:
+    def __init__(self, launch_timeout, removal_timeout):
+        """Constructor
+
+        Args:
+            launch_timeout (float) - Seconds after which a launch which hasn't joined the cluster is assumed failed, if
+                                     its operation hasn't already said so.
+            removal_timeout (float) - Seconds after which a removal of a node still in the cluster is assumed failed.
+        """
+        self.launch_timeout = launch_timeout
+        self.removal_timeout = removal_timeout
+        self.launches = []
+        self.removals = {}  # Maps alias to Removal
+
+    def active(self):
+        """Are any launches or removals in flight."""
+        return len(self.launches) > 0 or len(self.removals) > 0
+
+    def add_launch(self, operation_id, queue_name, node_type, slots, now):
+        self.launches.append(Launch(operation_id, queue_name, node_type, slots, now))
+
+    def add_removal(self, operation_id, aliases, now):
+        for alias in aliases:
+            self.removals[alias] = Removal(operation_id, alias, now)
+
+    def removing(self, alias):
+        """Has removal of node alias been requested."""
+        return alias in self.removals
+
+    def update(self, host_names, instances, operations, now):
+        """Match in-flight requests against the current cluster state, and drop the ones which finished or failed.
+
+        A launch is dropped as soon as its addnode operation fails, or succeeds without leaving an instance which is
+        still booting, i.e. the node joined or isn't coming.  The launch timeout is only a backstop for when the
+        operation's state is unknown.
+
+        Args:
+            host_names (set) - Names of hosts in qhost.
+            instances ([{}]) - Output of /instances, or None if unavailable.
+            operations ({string: string}) - Map of operation id to state, from /operations, or None if unavailable.
+            now (float) - The current unix timestamp.
+
+        Returns:
+            [string] - Messages describing launches and removals which failed or timed out.
+        """
+        operations = operations or {}
+        if instances is not None:
+            live_aliases = set(i['alias'] for i in instances if 'alias' in i and i.get('state') in LIVE_INSTANCE_STATES)
+        else:
+            live_aliases = None
+        messages = []
+        launches = []
+        for launch in self.launches:
+            if launch.alias is not None and launch.alias in host_names:
+                continue  # Joined the cluster
+            operation_state = operations.get(launch.operation_id)
+            if operation_state == OPERATION_FAILED:
+                messages.append('Launch of %s for %s failed' % (launch.node_type, launch.queue_name))
+            elif operation_state == OPERATION_SUCCEEDED and (
+                    launch.alias is None or (live_aliases is not None and launch.alias not in live_aliases)):
+                # addnode finished.  Its node is in qhost already, unmatched because it was never seen booting, or
+                # didn't come up; either way it is no longer launching.
+                if launch.alias is not None:
+                    messages.append('Launch of %s for %s finished without a node' % (launch.node_type,
+                                                                                    launch.queue_name))
+            elif now - launch.request_time > self.launch_timeout:
+                messages.append('Launch of %s for %s timed out' % (launch.node_type, launch.queue_name))
+            else:
+                launches.append(launch)
+        self.launches = launches
+
+        if instances is not None:
+            # Booting instances are those not in qhost yet.  Assign them to launches of the same type, oldest first.
+            claimed = set(l.alias for l in self.launches if l.alias is not None)
+            for launch in self.launches:
+                if launch.alias is not None and launch.alias not in live_aliases:
+                    launch.alias = None  # Instance was terminated before joining.
+            booting = sorted((i for i in instances if i.get('alias') in live_aliases and i['alias'] not in host_names
+                              and i['alias'] not in claimed), key=lambda i: i['alias'])
+            for launch in self.launches:
+                if launch.alias is not None:
+                    continue
+                for instance in booting:
+                    if instance['type'] == launch.node_type:
+                        launch.alias = instance['alias']
+                        booting.remove(instance)
+                        break
+
+        removals = {}
+        for alias, removal in self.removals.items():
+            gone = alias not in host_names and (live_aliases is None or alias not in live_aliases)
+            if gone:
+                continue
+            if operations.get(removal.operation_id) == OPERATION_FAILED:
+                messages.append('Removal of %s failed' % alias)
+            elif now - removal.request_time > self.removal_timeout:
+                messages.append('Removal of %s timed out' % alias)
+            else:
+                removals[alias] = removal
+        self.removals = removals
+        return messages
+
+    def launch_count(self, queue_name):
+        """Number of nodes launching for queue."""
+        return len([l for l in self.launches if l.queue_name == queue_name])
+
+    def booting_slots(self, queue_name):
+        """Number of slots on queue which are launching."""
+        return sum(l.slots for l in self.launches if l.queue_name == queue_name)
+
+    def to_dict(self, now):
+        return {
+            'launches': [l.to_dict(now) for l in self.launches],
+            'removals': [r.to_dict(now) for r in self.removals.values()],
+        }
+
+    def state(self):
+        """Launches and removals in flight, for saving."""
+        return {
+            'launches': [[l.operation_id, l.queue_name, l.node_type, l.slots, l.request_time, l.alias]
+                         for l in self.launches],
+            'removals': [[r.operation_id, r.alias, r.request_time] for r in self.removals.values()],
+        }
+
+    def restore(self, state):
+        """Add launches and removals saved by state().  They time out as if the load balancer hadn't restarted."""
+        for operation_id, queue_name, node_type, slots, request_time, alias in state.get('launches', []):
+            launch = Launch(operation_id, queue_name, node_type, slots, request_time)
+            launch.alias = alias
+            self.launches.append(launch)
+        for operation_id, alias, request_time in state.get('removals', []):
+            self.removals[alias] = Removal(operation_id, alias, request_time)
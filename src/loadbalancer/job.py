@@ -3,7 +3,8 @@
 from datetime import datetime
 
 class Job:
-    def __init__(self, job_id, requested_queue, assigned_queue, owner, state, predecessors, submit_timestamp):
+    def __init__(self, job_id, requested_queue, assigned_queue, owner, state, predecessors, submit_timestamp,
+                 task_count=1):
         """Constructor
 
         Args:
@@ -14,6 +15,7 @@ class Job:
             state (str) - The state of the running job.
             predecessors ([int]) - List of job ids this job depends on.
             submit_timestamp (int) - The unix timestamp at which this job was submitted.
+            task_count (int) - The number of tasks, if this is an array job.  Each task needs a slot.
 
         """
         self.job_id = job_id
@@ -23,6 +25,7 @@ class Job:
         self.state = state
         self.predecessors = predecessors
         self.submit_timestamp = submit_timestamp
+        self.task_count = task_count
 
     def running(self):
         """Is this job running or not."""
@@ -34,5 +37,5 @@ class Job:
 
     def __str__(self):
         submit_date = datetime.utcfromtimestamp(self.submit_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        return 'Job %d: %s on %s submitted by %s at %s' % (
-            self.job_id, self.state, self.requested_queue, self.owner, submit_date)
+        return 'Job %d: %s on %s submitted by %s at %s, %d tasks' % (
+            self.job_id, self.state, self.requested_queue, self.owner, submit_date, self.task_count)
@@ -1,6 +1,15 @@
 #!/usr/bin/python3
 import argparse
+import http.server
+import json
+import os
+import sys
+import threading
 
+# Modules shared between services are in src/common.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common import tracing
 
 import load_balancer
 
@@ -8,20 +17,75 @@ import load_balancer
 parser = argparse.ArgumentParser(description='Run a load-balancer service on the starcluster API.')
 parser.add_argument('--api_server_host', default='127.0.0.1', type=str, help='IP address of the backend.')
 parser.add_argument('--api_server_port', default=6361, type=int, help='Port to use to connect to API server.')
-parser.add_argument('--polling_interval', default=5, type=int, help='Polling interval for load balancer (minutes).')
+parser.add_argument('--polling_interval', default=5, type=float, help='Polling interval for load balancer (minutes).  May be a fraction, i.e. 0.25 to poll every 15 seconds.')
+parser.add_argument('--cluster_name', type=str, help='Cluster to balance, if the API server manages several.  Defaults to its default cluster.')
+parser.add_argument('--status_port', type=int, help='If specified, serve load balancer metrics as JSON at /metrics, and the actions it would take now at /plan, on this port.')
+parser.add_argument('--checkpoint_file', type=str, help='If specified, save host ages and launches in flight to this file, and reload them on startup.')
+parser.add_argument('--checkpoint_max_age', default=60, type=int, help='Ignore launches and removals in flight in checkpoints older than this number of minutes.')
+parser.add_argument('--forecast', action='store_true', help='Learn daily and weekly demand patterns, and launch nodes ahead of forecast demand.  Requires numpy.')
+parser.add_argument('--dry_run', '--dry-run', dest='dry_run', action='store_true', help='Print the actions the load balancer would take on each poll, without launching or removing nodes.')
+parser.add_argument('--trace_file', type=str, help='If specified, append trace spans to this JSON-lines file.')
 
 args = parser.parse_args()
 
 
+tracing.configure('load-balancer', trace_file=args.trace_file)
+
+forecaster = None
+if args.forecast:
+    import forecast
+    forecaster = forecast.DemandForecaster()
+
+
 lb = load_balancer.LoadBalancer(args.api_server_host,
                                 args.api_server_port,
-                                polling_interval=args.polling_interval * 60)
+                                polling_interval=args.polling_interval * 60,
+                                cluster_name=args.cluster_name,
+                                checkpoint_file=args.checkpoint_file,
+                                checkpoint_max_age=args.checkpoint_max_age * 60,
+                                forecaster=forecaster,
+                                dry_run=args.dry_run)
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """Serves load balancer metrics, and the plan for the current cluster state, for monitoring."""
+    def do_GET(self):
+        if self.path == '/metrics':
+            result = lb.metrics()
+        elif self.path == '/plan':
+            plan = lb.current_plan()
+            if plan is None:
+                self.send_error(502, 'Failed to get cluster state from API server')
+                return
+            result = plan.to_dict()
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_status(port):
+    """Serve StatusHandler on a background thread."""
+    server = http.server.ThreadingHTTPServer(('', port), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
 
 
 if __name__ == '__main__':
+    if args.status_port is not None:
+        serve_status(args.status_port)
     if args.polling_interval == 0:
         print('Load balancer polling once:')
         lb.poll()
     else:
         print('Load balancer starting polling', flush=True)
         lb.start_polling()
+        # Wait on the main thread, since thread pools refuse new work once the main thread exits.
+        lb.polling_thread.join()
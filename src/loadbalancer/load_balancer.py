@@ -1,32 +1,121 @@
-import requests
+import concurrent.futures
+import json
+import math
 import schedule
+import threading
 import time
 from threading import Thread
 
+from common import checkpoint
+from common import tracing
+
+from api_client import ApiClient
+from api_client import ApiError
 from cluster import Cluster
 import config
+from inflight import InFlightTracker
+from plan import Action
+from plan import Plan
+
+
+def _in_current_trace(f):
+    """Wrap f to run in the current thread's trace when called on another thread."""
+    context = tracing.headers()
+    if not context:
+        return f
+
+    def traced():
+        tracing.start(context[tracing.TRACE_HEADER], context.get(tracing.PARENT_SPAN_HEADER))
+        try:
+            return f()
+        finally:
+            tracing.finish()
+    return traced
+
 
 class LoadBalancer:
     """LoadBalancer polls sge on a background thread, and starts and terminates nodes to try to match load."""
     def __init__(self,
                  api_server_host,
                  api_server_port,
-                 polling_interval=5 * 60):
+                 polling_interval=5 * 60,
+                 cluster_name=None,
+                 checkpoint_file=None,
+                 checkpoint_max_age=60 * 60,
+                 forecaster=None,
+                 dry_run=False):
         """Constructor.
 
         Args:
             api_server_host (string) - The IP address of the API server.
             api_server_port (int) - The port to connect to.
-            polling_interval - Poll queue state every polling_interval seconds.
+            polling_interval - Poll queue state every polling_interval seconds.  Launches are tracked until the new nodes
+                               join the cluster, so this can be as short as a few seconds.
+            cluster_name (string) - The cluster to balance, if the API server manages several.  If None, balance the
+                                    API server's default cluster.
+            checkpoint_file (string) - If specified, save host ages and launches in flight to this file after each
+                                       poll, and reload them on startup.
+            checkpoint_max_age (int) - Ignore launches and removals in checkpoints older than this many seconds.
+            forecaster (forecast.DemandForecaster) - If specified, learn each queue's demand pattern, and launch nodes
+                                                     ahead of forecast demand.
+            dry_run (bool) - Print the plan for each poll instead of acting on it.
         """
         self.api_server_host = api_server_host
         self.api_server_port = api_server_port
+        self._client = ApiClient(api_server_host, api_server_port)
+        self._fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.cluster_name = cluster_name
         self.polling_interval = polling_interval
         schedule.every(self.polling_interval).seconds.do(self._poll)
         self.polling = False
         self.polling_thread = None
         # Maps host name to first timestamp (seconds) host was detected.
-        self._host_launch_times = {}  # This is the only piece of information that persists between run loop evaluations.
+        self._host_launch_times = {}
+        # Idle hosts whose queues we disabled on a previous poll, to remove if they are still idle.
+        self._draining_hosts = set()
+        # Launches and removals we requested which haven't shown up in qhost yet.
+        self._inflight = InFlightTracker(config.launch_timeout_minutes * 60, config.remove_timeout_minutes * 60)
+        self.checkpoint_file = checkpoint_file
+        self.forecaster = forecaster
+        self._forecaster_trained = False
+        # Maps queue name to warm pool statistics, and the state of the previous poll needed to count warm starts.
+        self._warm_pools = {}
+        self.dry_run = dry_run
+        self._last_plan = None
+        self._last_plan_ms = None
+        # Held while updating state from a poll and planning, and while recording the results of executed actions.  Not
+        # held while actions' API requests are made, so current_plan needn't wait for them.
+        self._lock = threading.RLock()
+        if checkpoint_file is not None:
+            self.restore_checkpoint(checkpoint_max_age)
+
+    def checkpoint_state(self):
+        """State which persists between polls, for saving."""
+        return {
+            'cluster_name': self.cluster_name,
+            'host_launch_times': self._host_launch_times,
+            'draining_hosts': sorted(self._draining_hosts),
+            'in_flight': self._inflight.state(),
+        }
+
+    def restore_checkpoint(self, max_age):
+        """Reload state saved by a previous run, unless it is for another cluster.
+
+        Launch times and drained hosts describe hosts which outlive the load balancer, so they are always restored;
+        hosts which have since left the cluster are dropped on the first poll.  Launches and removals in flight are only
+        restored if the checkpoint is younger than max_age seconds, since they have likely finished since.
+        """
+        saved_at, state = checkpoint.load(self.checkpoint_file)
+        if state is None or state.get('cluster_name') != self.cluster_name:
+            return
+        age = time.time() - saved_at
+        self._host_launch_times = state['host_launch_times']
+        self._draining_hosts = set(state['draining_hosts'])
+        if age <= max_age:
+            self._inflight.restore(state['in_flight'])
+        print('LoadBalancer: Restored %d host ages%s saved %d seconds ago' % (
+            len(self._host_launch_times), '' if age <= max_age else ', but not operations in flight,', age),
+            flush=True)
 
     def start_polling(self):
         """Start polling queues and load balancing the cluster."""
@@ -43,42 +132,140 @@ class LoadBalancer:
         """Run loop for the background task scheduler thread."""
         while self.polling:
             schedule.run_pending()
-            time.sleep(30)
+            time.sleep(min(30, self.polling_interval))
+
+    def _api_get(self, path, retry=True):
+        """Make a GET request to the API server, return the decoded response.
+
+        Args:
+            path (string) - The request path and query string, i.e. /qhost
+            retry (bool) - Retry failed requests.  Must be False for requests which change the cluster.
+
+        Returns:
+            The decoded response, or {'status': 'error'} if the request failed.
+        """
+        try:
+            return self._client.get(path, retry=retry)
+        except ApiError as e:
+            return {'status': 'error', 'error': str(e)}
+
+    def metrics(self):
+        """API server request counters, in-flight launches and removals, warm pool statistics and the last plan, for
+        monitoring."""
+        return {
+            'last_plan': self._last_plan.to_dict() if self._last_plan is not None else None,
+            'last_plan_ms': self._last_plan_ms,
+            'api_requests': self._client.metrics(),
+            'in_flight': self._inflight.to_dict(time.time()),
+            'warm_pools': {name: {k: v for k, v in pool.items() if not k.startswith('_')}
+                           for name, pool in self._warm_pools.items()},
+        }
 
-    def _add_host(self, type):
-        """Add new node of specified type to cluster."""
-        add_node_results = requests.get('http://%s:%s/nodes/add?instance_type=%s' % (
-            self.api_server_host, self.api_server_port, type))
-        results_json = add_node_results.json()
+    def _cluster_path(self, path):
+        """API server path for requests about our cluster."""
+        if self.cluster_name is None:
+            return path
+        return '/clusters/%s%s' % (self.cluster_name, path)
+
+    def _add_host(self, queue):
+        """Add new node of queue's default type to cluster, and track it until it joins."""
+        type = queue.default_node_type
+        results_json = self._api_get(self._cluster_path('/nodes/add?instance_type=%s' % type), retry=False)
         if results_json['status'] == 'error':
             print('Error adding new instance: %s', str(results_json), flush=True)
+            return
+        with self._lock:
+            self._inflight.add_launch(results_json.get('operation_id'), queue.name, type, queue.slots_per_node(),
+                                      time.time())
 
     def _remove_host(self, alias):
         """Removes host with specified alias."""
-        add_node_results = requests.get('http://%s:%s/nodes/%s/remove' % (
-            self.api_server_host, self.api_server_port, alias))
-        results_json = add_node_results.json()
+        results_json = self._api_get(self._cluster_path('/nodes/%s/remove' % alias), retry=False)
         if results_json['status'] == 'error':
             print('Error adding removing instance: %s', str(results_json), flush=True)
 
+    def _remove_hosts(self, aliases):
+        """Removes several hosts with one request, and tracks them until they leave.  Returns True if the removal was
+        started."""
+        results_json = self._api_get(self._cluster_path('/nodes/remove?aliases=%s' % ','.join(aliases)), retry=False)
+        if results_json['status'] == 'error':
+            print('Error removing instances: %s', str(results_json), flush=True)
+            return False
+        with self._lock:
+            self._inflight.add_removal(results_json.get('operation_id'), aliases, time.time())
+        return True
+
+    def _disable_host(self, alias):
+        """Disables queues on host with specified alias, so no new jobs are scheduled on it."""
+        results_json = self._api_get(self._cluster_path('/nodes/%s/disable' % alias))
+        if results_json['status'] == 'error':
+            print('Error disabling instance: %s', str(results_json), flush=True)
+            return False
+        return True
+
+    def _enable_host(self, alias):
+        """Re-enables queues on host with specified alias."""
+        results_json = self._api_get(self._cluster_path('/nodes/%s/enable' % alias))
+        if results_json['status'] == 'error':
+            print('Error enabling instance: %s', str(results_json), flush=True)
+            return False
+        return True
+
     def _qhost(self):
         """Calls qhost to get host list"""
-        sge_hosts_results = requests.get('http://%s:%s/qhost' % (self.api_server_host, self.api_server_port))
-        hosts_json = sge_hosts_results.json()
+        hosts_json = self._api_get(self._cluster_path('/qhost'))
         if 'status' in hosts_json and hosts_json['status'] == 'error':
             print('Error calling qhost: %s', str(hosts_json), flush=True)
             return None
         return hosts_json
 
     def _qstat(self):
-        """Calls qstat to get job list"""
-        sge_jobs_results = requests.get('http://%s:%s/qstat' % (self.api_server_host, self.api_server_port))
-        jobs_json = sge_jobs_results.json()
+        """Calls qstat to get job summary list"""
+        jobs_json = self._api_get(self._cluster_path('/qstat?summary=true'))
         if 'status' in jobs_json and jobs_json['status'] == 'error':
             print('Error calling qstat: %s', str(jobs_json))
             return None
         return jobs_json
 
+    def _instances(self):
+        """Gets the cluster's instances, or None on error."""
+        instances_json = self._api_get(self._cluster_path('/instances'))
+        if 'status' in instances_json and instances_json['status'] == 'error':
+            print('Error listing instances: %s', str(instances_json), flush=True)
+            return None
+        return instances_json
+
+    def _operation_states(self):
+        """Gets a map of operation id to state for recent API server operations, or None on error."""
+        operations_json = self._api_get(self._cluster_path('/operations'))
+        if operations_json['status'] == 'error':
+            print('Error listing operations: %s', str(operations_json), flush=True)
+            return None
+        return {op['operation_id']: op['state'] for op in operations_json['operations']}
+
+    def train_forecaster(self):
+        """Fit the forecaster to each queue's slot usage recorded by the API server."""
+        end = int(time.time() * 1000)
+        start = end - config.forecast_history_days * 24 * 3600 * 1000
+        resolution = self.forecaster.bin_seconds * 1000
+        series = ','.join('slots_used/%s' % queue.name for queue in config.queues)
+        history_json = self._api_get(self._cluster_path('/history?start=%d&end=%d&resolution=%d&series=%s' % (
+            start, end, resolution, series)))
+        if history_json['status'] == 'error':
+            print('Error getting utilization history: %s', str(history_json), flush=True)
+            return False
+        timestamps = [t / 1000.0 for t in history_json['timestamps']]
+        sample_seconds = history_json['resolution_ms'] / 1000.0
+        if sample_seconds == 0 and len(timestamps) > 1:
+            sample_seconds = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)  # Raw samples
+        for queue in config.queues:
+            values = history_json['series'].get('slots_used/%s' % queue.name)
+            if values:
+                demand = [float('nan') if v is None else v for v in values]
+                self.forecaster.fit(queue.name, timestamps, demand, sample_seconds, now=end / 1000.0)
+        print('LoadBalancer: Trained forecaster on %d history points' % len(timestamps), flush=True)
+        return True
+
     def _poll(self):
         """Internal method called periodically on background thread to poll the cluster state."""
         try:
@@ -89,51 +276,335 @@ class LoadBalancer:
 
     def poll(self):
         """Poll the cluster state"""
-        # Get list of hosts results from server.
-        hosts_json = self._qhost()
-        if hosts_json is None:
-            return
-        jobs_json = self._qstat()
-        if jobs_json is None:
+        tracing.start()
+        try:
+            with tracing.span('poll'):
+                self._poll_cluster()
+                if self.checkpoint_file is not None and not self.dry_run:
+                    with tracing.span('checkpoint'):
+                        checkpoint.save(self.checkpoint_file, self.checkpoint_state())
+        finally:
+            tracing.finish()
+
+    def _fetch_cluster(self):
+        """Get hosts and jobs from the server concurrently, returns a Cluster or None."""
+        hosts_future = self._fetch_executor.submit(_in_current_trace(self._qhost))
+        jobs_future = self._fetch_executor.submit(_in_current_trace(self._qstat))
+        hosts_json = hosts_future.result()
+        jobs_json = jobs_future.result()
+        if hosts_json is None or jobs_json is None:
+            return None
+        with tracing.span('parse'):
+            cluster = Cluster.parseFromJSON(hosts_json)
+            cluster.populateJobsFromJSON(jobs_json)
+        return cluster
+
+    def _poll_cluster(self):
+        """Fetch the cluster state, and launch or remove nodes as needed."""
+        # Only list instances while we have launches or removals to match them against.
+        inflight_active = self._inflight.active()
+        if inflight_active:
+            instances_future = self._fetch_executor.submit(_in_current_trace(self._instances))
+            operations_future = self._fetch_executor.submit(_in_current_trace(self._operation_states))
+        cluster = self._fetch_cluster()
+        if cluster is None:
             return
-        cluster = Cluster.parseFromJSON(hosts_json)
-        cluster.populateJobsFromJSON(jobs_json)
-        self.update_host_ages(cluster)
-        #print('Polled cluster:')
-        #print(str(cluster))
-        for queue in config.queues:
-            self.check_increase_capacity(cluster, queue)
-        self.check_remove_idle(cluster)
+        with self._lock:
+            if inflight_active:
+                self.update_inflight(cluster, instances_future.result(), operations_future.result())
+            self.update_host_ages(cluster)
+            self._draining_hosts &= set(node.name for node in cluster.nodes)
+            #print('Polled cluster:')
+            #print(str(cluster))
+            if self.forecaster is not None:
+                self.update_forecaster(cluster)
+            self.update_warm_pool_stats(cluster)
+            start = time.perf_counter()
+            plan = self.plan(cluster)
+            self._last_plan = plan
+            self._last_plan_ms = (time.perf_counter() - start) * 1000
+        if self.dry_run:
+            print(json.dumps(plan.to_dict(), indent=2), flush=True)
+        else:
+            self.execute(plan)
 
-    def update_host_ages(self, cluster):
-        """Update inferred age of hosts"""
+    def plan(self, cluster):
+        """Decide which nodes to launch, re-enable, drain and remove, without side effects.
+
+        Args:
+            cluster (Cluster) - Snapshot of the cluster, with node ages set.
+
+        Returns:
+            A Plan of actions with reasons.
+        """
+        with tracing.span('plan'):
+            plan = Plan(cluster.name, time.time())
+            self.check_drained_hosts(cluster, plan)
+            for queue in config.queues:
+                self.check_increase_capacity(cluster, queue, plan)
+                self.check_warm_pool(cluster, queue, plan)
+                self.check_prewarm(cluster, queue, plan)
+            self.check_remove_idle(cluster, plan)
+        return plan
+
+    def current_plan(self):
+        """Plan for the current cluster state, without acting on it or updating any state.  Returns None on error."""
+        cluster = self._fetch_cluster()
+        if cluster is None:
+            return None
+        with self._lock:
+            self.update_host_ages(cluster, store=False)
+            return self.plan(cluster)
+
+    def execute(self, plan):
+        """Make the API requests for the actions of plan, and track their results."""
+        with tracing.span('execute'):
+            for action in plan.actions:
+                print('LoadBalancer: %s' % action.reason, flush=True)
+                if action.kind == Action.LAUNCH:
+                    for _ in range(action.count):
+                        self._add_host(action.queue)
+                elif action.kind == Action.ENABLE:
+                    if self._enable_host(action.hosts[0]):
+                        with self._lock:
+                            self._draining_hosts.discard(action.hosts[0])
+                elif action.kind == Action.DRAIN:
+                    if self._disable_host(action.hosts[0]):
+                        with self._lock:
+                            self._draining_hosts.add(action.hosts[0])
+                elif action.kind == Action.REMOVE:
+                    if self._remove_hosts(action.hosts):
+                        with self._lock:
+                            self._draining_hosts.difference_update(action.hosts)
+
+    def update_inflight(self, cluster, instances, operations):
+        """Match launches and removals in flight against the cluster state."""
+        host_names = set(node.name for node in cluster.nodes)
+        for message in self._inflight.update(host_names, instances, operations, time.time()):
+            print('LoadBalancer: %s in cluster %s' % (message, cluster.name), flush=True)
+
+    def update_forecaster(self, cluster):
+        """Add the current demand of each queue to the forecaster, training it from history first if needed."""
+        with tracing.span('forecast'):
+            if not self._forecaster_trained:
+                self._forecaster_trained = self.train_forecaster()
+            demand = {queue.name: cluster.slot_demand(queue.name) for queue in config.queues}
+            self.forecaster.observe(time.time(), demand, self.polling_interval)
+
+    def _forecast_demand(self, queue):
+        """Forecast slot demand of queue prewarm_lead_minutes from now, or None."""
+        if self.forecaster is None:
+            return None
+        expected = self.forecaster.forecast(queue.name, [time.time() + config.prewarm_lead_minutes * 60])[0]
+        return None if math.isnan(expected) else expected
+
+    def update_host_ages(self, cluster, store=True):
+        """Update inferred age of hosts.  If store is False, set ages on cluster but don't remember new hosts."""
         host_names = [node.name for node in cluster.nodes]
         new_launch_times = {
             name: self._host_launch_times[name] if name in self._host_launch_times else time.time() for name in host_names
         }
-        self._host_launch_times = new_launch_times
+        if store:
+            self._host_launch_times = new_launch_times
         for node in cluster.nodes:
             node.age = time.time() - new_launch_times[node.name]
 
-    def check_increase_capacity(self, cluster, queue):
-        """Check if we need to increase capacity for the specified queue."""
+    def _launching_nodes(self, queue, plan):
+        """Number of nodes for queue which are launching, or which plan launches."""
+        return self._inflight.launch_count(queue.name) + plan.launch_count(queue.name)
+
+    def _launching_slots(self, queue, plan):
+        """Number of slots on queue which are launching, or which plan launches."""
+        return self._inflight.booting_slots(queue.name) + plan.launch_slots(queue.name)
+
+    def _in_service(self, node, plan=None):
+        """Does node take new jobs: it isn't drained or being removed, or plan re-enables it."""
+        if plan is not None and node.name in plan.enabled_hosts():
+            return True
+        return not node.is_disabled() and not self._inflight.removing(node.name)
+
+    def _node_count(self, cluster, queue, plan):
+        """Number of nodes for queue which are in service, launching, or which plan launches."""
+        in_service = [n for n in cluster.nodes_for_queue(queue.name) if self._in_service(n, plan)]
+        return len(in_service) + self._launching_nodes(queue, plan)
+
+    def _available_slots(self, cluster, queue, plan=None):
+        """Free slots on queue, including slots of drained nodes plan re-enables, and of nodes which are launching."""
+        if plan is None:
+            return cluster.available_slots(queue.name) + self._inflight.booting_slots(queue.name)
+        enabled = plan.enabled_hosts()
+        enabled_slots = sum(n.available_slots(queue.name, include_disabled=True)
+                            for n in cluster.nodes if n.name in enabled)
+        return cluster.available_slots(queue.name) + enabled_slots + self._launching_slots(queue, plan)
+
+    def _capacity(self, cluster, queue, plan):
+        """Total slots on queue of nodes which are in service, launching, or which plan launches."""
+        in_service = [n for n in cluster.nodes_for_queue(queue.name) if self._in_service(n, plan)]
+        return sum(n.total_slots(queue.name) for n in in_service) + self._launching_slots(queue, plan)
+
+    def check_increase_capacity(self, cluster, queue, plan):
+        """Check if we need to increase capacity for the specified queue.  Nodes which are still launching count as
+        capacity, so we don't launch again for the same jobs.  Drained nodes don't, unless plan re-enables them."""
+        node_count = self._node_count(cluster, queue, plan)
         # If we already have the maximum number of nodes allocated for this queue, return.
-        if len(cluster.nodes_for_queue(queue.name)) >= queue.max_nodes:
+        if node_count >= queue.max_nodes:
             return
         runnable_jobs = cluster.runnable_jobs(queue.name)
-        if len(runnable_jobs) > 0 and cluster.available_slots(queue.name) == 0:
-            print('LoadBalancer: Launching new %s in cluster %s' % (queue.default_node_type, cluster.name), flush=True)
-            self._add_host(queue.default_node_type)
+        if len(runnable_jobs) == 0:
+            return
+        available_slots = self._available_slots(cluster, queue, plan)
+        wait = cluster.runnable_wait_percentile(queue.name, config.wait_percentile, time.time())
+        if queue.wait_slo_seconds is not None and wait > queue.wait_slo_seconds:
+            # Jobs have waited too long, launch enough nodes for all runnable jobs.
+            missing_slots = cluster.runnable_slots(queue.name) - available_slots
+            if missing_slots <= 0:
+                return
+            launch_count = max(1, int(math.ceil(missing_slots / float(queue.slots_per_node()))))
+            launch_count = min(launch_count,
+                               queue.max_launch_per_poll,
+                               queue.max_nodes - node_count)
+            plan.launch(queue, launch_count,
+                        'p%d wait on %s is %d seconds (target %d), launching %d new %s in cluster %s' % (
+                            config.wait_percentile, queue.name, wait, queue.wait_slo_seconds, launch_count,
+                            queue.default_node_type, cluster.name))
+        elif available_slots == 0:
+            plan.launch(queue, 1, 'Launching new %s in cluster %s' % (queue.default_node_type, cluster.name))
+
+    def _warm_pool_idle_slots(self, cluster, queue, plan=None):
+        """Slots on queue which are free after all runnable jobs are scheduled, including slots which are booting."""
+        return self._available_slots(cluster, queue, plan) - cluster.runnable_slots(queue.name)
 
-    def check_remove_idle(self, cluster):
-        """Check for idle nodes, remove them if needed."""
+    def update_warm_pool_stats(self, cluster):
+        """Count jobs which started on warm pool slots since the last poll, and the boot time this saved them."""
+        for queue in config.queues:
+            target = queue.warm_pool_slots()
+            if target == 0:
+                continue
+            pool = self._warm_pools.setdefault(queue.name, {
+                'target_slots': target, 'idle_slots': 0, 'warm_starts': 0, 'seconds_saved': 0,
+                '_runnable_job_ids': set(), '_ready_slots': 0,
+            })
+            running_ids = set(j.job_id for j in cluster.jobs_on_queue(queue.name) if j.running())
+            started = len(pool['_runnable_job_ids'] & running_ids)
+            # Without the pool, jobs which started on its slots would have waited for a new node to boot.
+            warm_starts = min(started, pool['_ready_slots'])
+            pool['warm_starts'] += warm_starts
+            pool['seconds_saved'] += warm_starts * config.node_boot_minutes * 60
+            pool['target_slots'] = target
+            pool['idle_slots'] = max(0, cluster.available_slots(queue.name) - cluster.runnable_slots(queue.name))
+            pool['_runnable_job_ids'] = set(j.job_id for j in cluster.runnable_jobs(queue.name))
+            pool['_ready_slots'] = min(target, cluster.available_slots(queue.name))
+
+    def check_warm_pool(self, cluster, queue, plan):
+        """Launch nodes to top up queue's warm pool of idle slots, up to max_nodes."""
+        target = queue.warm_pool_slots()
+        if target == 0:
+            return
+        node_count = self._node_count(cluster, queue, plan)
+        idle_slots = self._warm_pool_idle_slots(cluster, queue, plan)
+        if idle_slots >= target or node_count >= queue.max_nodes:
+            return
+        launch_count = int(math.ceil((target - idle_slots) / float(queue.slots_per_node())))
+        launch_count = min(launch_count, queue.max_launch_per_poll, queue.max_nodes - node_count)
+        plan.launch(queue, launch_count,
+                    'Warm pool of %s has %d idle slots (target %d), launching %d new %s in cluster %s' % (
+                        queue.name, idle_slots, target, launch_count, queue.default_node_type, cluster.name))
+
+    def _warm_pool_nodes(self, cluster, idle_nodes):
+        """Names of idle nodes to keep so each queue keeps its warm pool of idle slots."""
+        keep = set()
+        for queue in config.queues:
+            target = queue.warm_pool_slots()
+            if target == 0:
+                continue
+            # Idle slots on nodes we aren't considering removing count toward the pool first.
+            idle_slots = self._warm_pool_idle_slots(cluster, queue) - sum(n.available_slots(queue.name) for n in idle_nodes)
+            for node in sorted(idle_nodes, key=lambda n: n.node_index() or 0):
+                if idle_slots >= target:
+                    break
+                if node.total_slots(queue.name) > 0:
+                    # A kept node which is drained is re-enabled by check_drained_hosts.
+                    keep.add(node.name)
+                    idle_slots += node.available_slots(queue.name, include_disabled=True)
+        return keep
+
+    def check_prewarm(self, cluster, queue, plan):
+        """Launch nodes for queue ahead of forecast demand, up to max_nodes."""
+        expected = self._forecast_demand(queue)
+        if expected is None:
+            return
+        node_count = self._node_count(cluster, queue, plan)
+        capacity = self._capacity(cluster, queue, plan)
+        if expected <= capacity or node_count >= queue.max_nodes:
+            return
+        launch_count = int(math.ceil((expected - capacity) / float(queue.slots_per_node())))
+        launch_count = min(launch_count, queue.max_launch_per_poll, queue.max_nodes - node_count)
+        plan.launch(queue, launch_count,
+                    'Forecast demand on %s is %d slots (have %d), pre-warming %d new %s in cluster %s' % (
+                        queue.name, expected, capacity, launch_count, queue.default_node_type, cluster.name))
+
+    def _forecast_nodes(self, cluster, idle_nodes, keep):
+        """Names of idle nodes, besides those in keep, to keep so no queue has less capacity than forecast demand.
+
+        Nodes are considered in the order they would be removed, and each one removed lowers the capacity left for the
+        next, so together the removals never take a queue below its forecast.
+        """
+        expected = {queue.name: self._forecast_demand(queue) for queue in config.queues}
+        expected = {name: e for name, e in expected.items() if e is not None}
+        if len(expected) == 0:
+            return set()
+        # Capacity of nodes which aren't being removed.  Drained nodes count, since they are re-enabled if kept.
+        capacity = {name: sum(n.total_slots(name) for n in cluster.nodes_for_queue(name)
+                              if not self._inflight.removing(n.name)) for name in expected}
+        forecast_keep = set()
+        for node in sorted(idle_nodes, key=lambda n: n.node_index() or 0, reverse=True):
+            if node.name in keep:
+                continue
+            if any(capacity[name] - node.total_slots(name) < e for name, e in expected.items()
+                   if node.total_slots(name) > 0):
+                forecast_keep.add(node.name)
+                continue
+            for name in capacity:
+                capacity[name] -= node.total_slots(name)
+        return forecast_keep
+
+    def _idle_nodes(self, cluster):
+        """Nodes with no jobs, older than min_age_minutes, on which no runnable jobs could be scheduled."""
         # Get set of queues with unscheduled jobs on them.
         queues_with_jobs = frozenset([j.requested_queue for j in cluster.runnable_jobs()])
         # Ensure node is idle and older than min_age_minutes.
         idle_nodes = [n for n in cluster.nodes if not n.is_master() and n.total_jobs() == 0 and n.age > (config.min_age_minutes * 60)]
         # Ensure that there are no more runnable jobs on queues that might get scheduled on this node.
-        really_idle_nodes = [n for n in idle_nodes if len(queues_with_jobs.intersection(n.available_queues())) == 0]
-        if len(really_idle_nodes) > 0:
-            last_node = sorted(really_idle_nodes, key=lambda n: n.node_index())[-1]
-            print('LoadBalancer: Removing idle node %s from cluster %s' % (last_node.name, last_node.cluster_name()), flush=True)
-            self._remove_host(last_node.name)
+        return [n for n in idle_nodes if len(queues_with_jobs.intersection(n.available_queues())) == 0]
+
+    def _removable_nodes(self, cluster):
+        """Idle nodes which aren't being removed already, and aren't needed for warm pools or forecast demand."""
+        idle_nodes = [n for n in self._idle_nodes(cluster) if not self._inflight.removing(n.name)]
+        keep = self._warm_pool_nodes(cluster, idle_nodes)
+        keep |= self._forecast_nodes(cluster, idle_nodes, keep)
+        return [n for n in idle_nodes if n.name not in keep]
+
+    def check_drained_hosts(self, cluster, plan):
+        """Re-enable drained hosts which are needed again.
+
+        Called before check_increase_capacity, so demand is met by drained hosts before launching new ones.
+        """
+        removable_names = set(n.name for n in self._removable_nodes(cluster))
+        for name in sorted(self._draining_hosts - removable_names):
+            plan.enable(name, 'Re-enabling drained node %s in cluster %s' % (name, cluster.name))
+
+    def check_remove_idle(self, cluster, plan):
+        """Check for idle nodes, drain them, and remove nodes which stayed idle since they were drained.  Nodes holding a
+        queue's warm pool, or needed for forecast demand, are kept.
+
+        Idle nodes are first disabled with qmod -d, so SGE can't schedule a job on a node while it is being terminated.
+        If a drained node is still idle on the next poll, it is removed.  All such nodes are removed together.
+        """
+        idle_nodes = self._removable_nodes(cluster)
+        drained_nodes = [n.name for n in idle_nodes if n.name in self._draining_hosts]
+        if len(drained_nodes) > 0:
+            plan.remove(drained_nodes, 'Removing idle nodes %s from cluster %s' % (', '.join(drained_nodes), cluster.name))
+        for node in sorted(idle_nodes, key=lambda n: n.node_index() or 0):
+            if node.name in self._draining_hosts:
+                continue
+            plan.drain(node.name, 'Draining idle node %s in cluster %s' % (node.name, node.cluster_name()))
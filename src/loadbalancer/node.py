@@ -2,10 +2,15 @@
 
 
 class JobQueue:
-    def __init__(self, name, slots, slots_used):
+    def __init__(self, name, slots, slots_used, state=''):
         self.name = name
         self.slots = slots
         self.slots_used = slots_used
+        self.state = state or ''  # SGE queue state letters, i.e. 'd' if disabled.
+
+    def disabled(self):
+        """Has this queue instance been disabled, i.e. by qmod -d"""
+        return 'd' in self.state
 
     def __str__(self):
         return '%s:  %d slots, %d slots used' % (self.name, self.slots, self.slots_used)
@@ -51,11 +56,15 @@ class Node:
         """The CPU utilization % of the node."""
         return self.cpu_load_pct
 
-    def available_slots(self, queue=None):
-        """Return the number of available slots on specified queue.  If queue not specified, returns all slots."""
+    def available_slots(self, queue=None, include_disabled=False):
+        """Return the number of available slots on specified queue.  If queue not specified, returns all slots.
+
+        Disabled queue instances have no available slots, since SGE schedules no new jobs on them, unless
+        include_disabled is true, i.e. to count the slots a drained node would have if re-enabled.
+        """
         queue_names = self.job_queues.keys() if queue is None else [queue]
         queues = [self.job_queues[qname] for qname in queue_names if qname in self.job_queues]
-        return sum(q.slots - q.slots_used for q in queues)
+        return sum(q.slots - q.slots_used for q in queues if include_disabled or not q.disabled())
 
     def available_queues(self):
         """Return set of queues that have open slots."""
@@ -67,6 +76,10 @@ class Node:
         queues = [self.job_queues[qname] for qname in queue_names if qname in self.job_queues]
         return sum(q.slots for q in queues)
 
+    def is_disabled(self):
+        """Return true if all queues on this node are disabled, so no new jobs will be scheduled on it."""
+        return len(self.job_queues) > 0 and all(jq.disabled() for jq in self.job_queues.values())
+
     def total_jobs(self):
         """Returns total number of jobs this node is running on all queues."""
         return sum([jq.slots_used for jq in self.job_queues.values()])
@@ -0,0 +1,82 @@
+"""A plan is the list of actions the load balancer decided to take for one snapshot of the cluster, with reasons."""
+
+
+class Action:
+    # Action kinds
+    LAUNCH = 'launch'
+    ENABLE = 'enable'
+    DRAIN = 'drain'
+    REMOVE = 'remove'
+
+    def __init__(self, kind, reason, queue=None, count=0, hosts=None):
+        """Constructor
+
+        Args:
+            kind (string) - One of the action kind constants.
+            reason (string) - Why the load balancer decided on this action.
+            queue (SGEQueue) - For launches, the queue to launch nodes of its default type for.
+            count (int) - For launches, the number of nodes to launch.
+            hosts ([string]) - For enable, drain and remove, the names of the hosts to act on.
+        """
+        self.kind = kind
+        self.reason = reason
+        self.queue = queue
+        self.count = count
+        self.hosts = hosts or []
+
+    def to_dict(self):
+        result = {'action': self.kind, 'reason': self.reason}
+        if self.kind == Action.LAUNCH:
+            result.update({'queue': self.queue.name, 'node_type': self.queue.default_node_type, 'count': self.count})
+        else:
+            result['hosts'] = self.hosts
+        return result
+
+
+class Plan:
+    def __init__(self, cluster_name, timestamp):
+        """Constructor
+
+        Args:
+            cluster_name (string) - The cluster planned for.
+            timestamp (float) - Unix timestamp of the cluster snapshot.
+        """
+        self.cluster_name = cluster_name
+        self.timestamp = timestamp
+        self.actions = []
+
+    def launch(self, queue, count, reason):
+        """Launch count nodes of queue's default type."""
+        self.actions.append(Action(Action.LAUNCH, reason, queue=queue, count=count))
+
+    def enable(self, host, reason):
+        """Re-enable queues on a drained host."""
+        self.actions.append(Action(Action.ENABLE, reason, hosts=[host]))
+
+    def drain(self, host, reason):
+        """Disable queues on an idle host, to remove it on a later poll."""
+        self.actions.append(Action(Action.DRAIN, reason, hosts=[host]))
+
+    def remove(self, hosts, reason):
+        """Remove drained hosts with one request."""
+        self.actions.append(Action(Action.REMOVE, reason, hosts=hosts))
+
+    def launch_count(self, queue_name):
+        """Number of nodes this plan launches for queue."""
+        return sum(a.count for a in self.actions if a.kind == Action.LAUNCH and a.queue.name == queue_name)
+
+    def enabled_hosts(self):
+        """Names of the drained hosts this plan re-enables."""
+        return set(host for a in self.actions if a.kind == Action.ENABLE for host in a.hosts)
+
+    def launch_slots(self, queue_name):
+        """Number of slots on queue this plan launches."""
+        return sum(a.count * a.queue.slots_per_node() for a in self.actions
+                   if a.kind == Action.LAUNCH and a.queue.name == queue_name)
+
+    def to_dict(self):
+        return {
+            'cluster_name': self.cluster_name,
+            'timestamp': self.timestamp,
+            'actions': [a.to_dict() for a in self.actions],
+        }
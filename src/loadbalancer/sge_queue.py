@@ -2,9 +2,42 @@
 
 
 class SGEQueue:
-    def __init__(self, name, default_node_type, node_types, max_nodes=3):
-        """Constructor.  Provide node_list or hosts_json to initialize."""
+    def __init__(self, name, default_node_type, node_types, max_nodes=3, wait_slo_seconds=None, max_launch_per_poll=4,
+                 min_idle_slots=0, node_cost_per_hour=None, warm_pool_budget_per_hour=None):
+        """Constructor.  Provide node_list or hosts_json to initialize.
+
+        Args:
+            name (str) - The name of the SGE queue.
+            default_node_type (str) - The instance type to launch for this queue.
+            node_types ({str: int}) - Map of instance types which serve this queue to the number of slots they have.
+            max_nodes (int) - The maximum number of nodes to run for this queue.
+            wait_slo_seconds (int) - Target for how long runnable jobs wait, measured at config.wait_percentile.  When
+                                     exceeded, launch enough nodes for all runnable jobs instead of one at a time.
+                                     If None, only scale when there are no available slots.
+            max_launch_per_poll (int) - The maximum number of nodes to launch at once when wait_slo_seconds is exceeded.
+            min_idle_slots (int) - Size of the warm pool: keep at least this many idle slots ready for new jobs.
+            node_cost_per_hour (float) - Cost per hour of a node of default_node_type.
+            warm_pool_budget_per_hour (float) - Maximum cost per hour of nodes kept for the warm pool.  Requires
+                                                node_cost_per_hour.  If None, the warm pool is only limited by max_nodes.
+        """
         self.name = name
         self.default_node_type = default_node_type
         self.node_types = node_types
         self.max_nodes = max_nodes
+        self.wait_slo_seconds = wait_slo_seconds
+        self.max_launch_per_poll = max_launch_per_poll
+        self.min_idle_slots = min_idle_slots
+        self.node_cost_per_hour = node_cost_per_hour
+        self.warm_pool_budget_per_hour = warm_pool_budget_per_hour
+
+    def slots_per_node(self):
+        """The number of slots on a node of default_node_type."""
+        return self.node_types.get(self.default_node_type, 1)
+
+    def warm_pool_slots(self):
+        """The number of idle slots to keep ready, limited to what warm_pool_budget_per_hour pays for."""
+        slots = self.min_idle_slots
+        if slots > 0 and self.warm_pool_budget_per_hour is not None and self.node_cost_per_hour:
+            affordable_nodes = int(self.warm_pool_budget_per_hour // self.node_cost_per_hour)
+            slots = min(slots, affordable_nodes * self.slots_per_node())
+        return slots
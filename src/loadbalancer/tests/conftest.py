@@ -0,0 +1,25 @@
+"""The load balancer's modules are imported by name from src/loadbalancer, and shared modules from src/common, as
+lb-service.py does.
+
+Run with python -m pytest from src/loadbalancer.
+"""
+import os
+import sys
+
+import pytest
+import schedule
+
+LOADBALANCER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOADBALANCER_DIR)
+sys.path.insert(0, os.path.dirname(LOADBALANCER_DIR))
+
+import load_balancer
+
+
+@pytest.fixture
+def balancer():
+    """A LoadBalancer which isn't polling.  Requests to the API server fail unless a test replaces _api_get."""
+    lb = load_balancer.LoadBalancer('127.0.0.1', 1, dry_run=True)
+    yield lb
+    schedule.clear()
+
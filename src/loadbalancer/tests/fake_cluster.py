@@ -0,0 +1,26 @@
+"""Cluster snapshots for load balancer tests, built from API server JSON."""
+from cluster import Cluster
+
+
+def host(name, queue, slots, slots_used=0, state=''):
+    """qhost JSON of a host with one queue."""
+    return {'name': name, 'load_avg': '0.0',
+            'queues': {queue: {'slots': str(slots), 'slots_used': str(slots_used), 'state_string': state}}}
+
+
+def job(job_id, queue, running=False, submitted=0, task_count=1):
+    """/qstat?summary=true JSON of a job, running on queue or waiting for it."""
+    result = {'job_id': job_id, 'qr_name': queue, 'owner': 'alice', 'state': 'r' if running else 'qw',
+              'predecessors': [], 'submission_timestamp': str(submitted), 'task_count': task_count}
+    if running:
+        result['queue_name'] = '%s@node' % queue
+    return result
+
+
+def cluster(hosts, jobs=(), age=3600):
+    """A Cluster of hosts running or waiting for jobs, with every node age seconds old."""
+    result = Cluster.parseFromJSON(hosts)
+    result.populateJobsFromJSON(list(jobs))
+    for node in result.nodes:
+        node.age = age
+    return result
@@ -0,0 +1,76 @@
+import pytest
+import requests
+
+import api_client
+from api_client import ApiClient
+from api_client import ApiError
+
+
+def _response(status_code, body, content_type='application/json', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """Responses for the client to receive, in order.  Backoff doesn't sleep."""
+    queued = []
+    monkeypatch.setattr(api_client.time, 'sleep', lambda seconds: None)
+    return queued
+
+
+@pytest.fixture
+def client(responses, monkeypatch):
+    client = ApiClient('127.0.0.1', 1)
+    requested = []
+
+    def get(url, headers=None, timeout=None):
+        requested.append(url)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(client._session, 'get', get)
+    client.requested = requested
+    return client
+
+
+@pytest.mark.parametrize('status_code, body, content_type', [
+    (404, b'<html>Not Found</html>', 'text/html'),
+    (400, b'{"status": "error"}', 'application/json'),
+    (405, b'', 'text/plain'),
+])
+def test_4xx_responses_fail_without_retrying(client, responses, status_code, body, content_type):
+    responses.append(_response(status_code, body, content_type))
+    with pytest.raises(ApiError) as e:
+        client.get('/qhost')
+    assert 'HTTP %d' % status_code in str(e.value)
+    assert len(client.requested) == 1
+    assert client.metrics()['/qhost'] == dict(client.metrics()['/qhost'], requests=1, errors=1, retries=0)
+
+
+def test_5xx_responses_and_connection_errors_are_retried(client, responses):
+    responses.extend([_response(503, b'', headers={'Retry-After': '1'}),
+                      requests.exceptions.ConnectionError('refused'),
+                      _response(200, b'[{"name": "node001"}]')])
+    assert client.get('/qhost?x=1') == [{'name': 'node001'}]
+    assert len(client.requested) == 3
+    assert client.metrics()['/qhost'] == dict(client.metrics()['/qhost'], requests=1, errors=0, retries=2)
+
+
+def test_requests_with_side_effects_are_not_retried(client, responses):
+    responses.append(_response(503, b''))
+    with pytest.raises(ApiError):
+        client.get('/nodes/add', retry=False)
+    assert len(client.requested) == 1
+
+
+def test_retries_stop_after_the_last_attempt(client, responses):
+    responses.extend([_response(500, b'')] * 3)
+    with pytest.raises(ApiError) as e:
+        client.get('/qhost')
+    assert 'after 3 attempts' in str(e.value)
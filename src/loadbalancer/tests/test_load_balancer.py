@@ -0,0 +1,175 @@
+import time
+
+import pytest
+
+import config
+import inflight
+from plan import Action
+from sge_queue import SGEQueue
+
+from fake_cluster import cluster
+from fake_cluster import host
+from fake_cluster import job
+
+
+@pytest.fixture(autouse=True)
+def queues(monkeypatch):
+    monkeypatch.setattr(config, 'queues', [SGEQueue('cpu.q', 'c5.4xlarge', {'c5.4xlarge': 4}, max_nodes=4)])
+
+
+@pytest.fixture
+def api_requests(balancer, monkeypatch):
+    """Paths requested from the API server, which answers every request with an ok status."""
+    paths = []
+
+    def api_get(path, retry=True):
+        paths.append(path)
+        return {'status': 'ok', 'operation_id': 'op%d' % len(paths)}
+    monkeypatch.setattr(balancer, '_api_get', api_get)
+    return paths
+
+
+def _actions(plan):
+    return [(a.kind, a.count if a.kind == Action.LAUNCH else a.hosts) for a in plan.actions]
+
+
+def test_idle_nodes_are_drained_before_they_are_removed(balancer):
+    idle = cluster([host('dev-node001', 'cpu.q', 4), host('dev-node002', 'cpu.q', 4)])
+    assert _actions(balancer.plan(idle)) == [(Action.DRAIN, ['dev-node001']), (Action.DRAIN, ['dev-node002'])]
+
+
+def test_young_and_master_nodes_are_not_drained(balancer):
+    young = cluster([host('dev-master', 'cpu.q', 4), host('dev-node001', 'cpu.q', 4)], age=60)
+    assert _actions(balancer.plan(young)) == []
+    master = cluster([host('dev-master', 'cpu.q', 4)])
+    assert _actions(balancer.plan(master)) == []
+
+
+def test_drained_nodes_are_removed_together_once_empty(balancer):
+    balancer._draining_hosts = {'dev-node001', 'dev-node002'}
+    drained = cluster([host('dev-node001', 'cpu.q', 4, state='d'), host('dev-node002', 'cpu.q', 4, state='d')])
+    assert _actions(balancer.plan(drained)) == [(Action.REMOVE, ['dev-node001', 'dev-node002'])]
+
+
+def test_drained_nodes_running_jobs_are_not_removed(balancer):
+    balancer._draining_hosts = {'dev-node001'}
+    busy = cluster([host('dev-node001', 'cpu.q', 4, slots_used=1, state='d')], [job(1, 'cpu.q', running=True)])
+    actions = _actions(balancer.plan(busy))
+    assert Action.REMOVE not in [kind for kind, _ in actions]
+    assert actions == [(Action.ENABLE, ['dev-node001'])]
+    empty = cluster([host('dev-node001', 'cpu.q', 4, state='d')])
+    assert _actions(balancer.plan(empty)) == [(Action.REMOVE, ['dev-node001'])]
+
+
+def test_drained_nodes_are_reenabled_for_waiting_jobs(balancer):
+    balancer._draining_hosts = {'dev-node001'}
+    waiting = cluster([host('dev-node001', 'cpu.q', 4, state='d')], [job(1, 'cpu.q')])
+    # The re-enabled node has room for the job, so nothing is launched.
+    assert _actions(balancer.plan(waiting)) == [(Action.ENABLE, ['dev-node001'])]
+
+
+def test_execute_tracks_drained_and_removed_nodes(balancer, api_requests):
+    balancer._draining_hosts = {'dev-node001'}
+    state = cluster([host('dev-node001', 'cpu.q', 4, state='d'), host('dev-node002', 'cpu.q', 4)])
+    balancer.execute(balancer.plan(state))
+    assert api_requests == ['/nodes/remove?aliases=dev-node001', '/nodes/dev-node002/disable']
+    assert balancer._draining_hosts == {'dev-node002'}
+    assert balancer._inflight.removing('dev-node001')
+    # Not drained or removed again while its removal is in flight.
+    assert _actions(balancer.plan(state)) == [(Action.REMOVE, ['dev-node002'])]
+
+
+def _waiting_for_slots():
+    """A full node, and a job waiting for a slot."""
+    return cluster([host('dev-node001', 'cpu.q', 4, slots_used=4)],
+                   [job(1, 'cpu.q', running=True, task_count=4), job(2, 'cpu.q')])
+
+
+def test_launches_in_flight_suppress_duplicate_launches(balancer, api_requests):
+    state = _waiting_for_slots()
+    plan = balancer.plan(state)
+    assert _actions(plan) == [(Action.LAUNCH, 1)]
+    balancer.execute(plan)
+    assert api_requests == ['/nodes/add?instance_type=c5.4xlarge']
+    assert balancer._inflight.launch_count('cpu.q') == 1
+    assert _actions(balancer.plan(state)) == []
+
+
+def test_launches_in_flight_count_toward_max_nodes(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [SGEQueue('cpu.q', 'c5.4xlarge', {'c5.4xlarge': 4}, max_nodes=3,
+                                                     wait_slo_seconds=60)])
+    state = cluster([host('dev-node001', 'cpu.q', 4, slots_used=4)],
+                    [job(1, 'cpu.q', running=True, task_count=4), job(2, 'cpu.q', task_count=20)])
+    assert _actions(balancer.plan(state)) == [(Action.LAUNCH, 2)]
+    balancer._inflight.add_launch('op1', 'cpu.q', 'c5.4xlarge', 4, time.time())
+    assert _actions(balancer.plan(state)) == [(Action.LAUNCH, 1)]
+    balancer._inflight.add_launch('op2', 'cpu.q', 'c5.4xlarge', 4, time.time())
+    assert _actions(balancer.plan(state)) == []
+
+
+def test_failed_launches_are_retried(balancer):
+    state = _waiting_for_slots()
+    balancer._inflight.add_launch('op1', 'cpu.q', 'c5.4xlarge', 4, time.time())
+    balancer.update_inflight(state, [], {'op1': 'running'})
+    assert _actions(balancer.plan(state)) == []
+    balancer.update_inflight(state, [], {'op1': inflight.OPERATION_FAILED})
+    assert _actions(balancer.plan(state)) == [(Action.LAUNCH, 1)]
+
+
+def test_launches_which_never_join_time_out(balancer):
+    state = _waiting_for_slots()
+    balancer._inflight.add_launch('op1', 'cpu.q', 'c5.4xlarge', 4, time.time() - config.launch_timeout_minutes * 60 - 1)
+    balancer.update_inflight(state, None, None)
+    assert _actions(balancer.plan(state)) == [(Action.LAUNCH, 1)]
+
+
+def test_launches_are_tracked_until_their_node_joins(balancer):
+    balancer._inflight.add_launch('op1', 'cpu.q', 'c5.4xlarge', 4, time.time())
+    booting = [{'alias': 'dev-node002', 'type': 'c5.4xlarge', 'state': 'pending'}]
+    state = _waiting_for_slots()
+    balancer.update_inflight(state, booting, {'op1': 'running'})
+    assert balancer._inflight.launches[0].alias == 'dev-node002'
+    joined = cluster([host('dev-node001', 'cpu.q', 4, slots_used=4), host('dev-node002', 'cpu.q', 4, slots_used=1)],
+                     [job(1, 'cpu.q', running=True, task_count=4), job(2, 'cpu.q', running=True)], age=60)
+    balancer.update_inflight(joined, booting, {'op1': inflight.OPERATION_SUCCEEDED})
+    assert not balancer._inflight.active()
+
+
+def test_dry_run_polls_plan_without_acting(balancer, api_requests, monkeypatch):
+    monkeypatch.setattr(balancer, '_fetch_cluster', _waiting_for_slots)
+    balancer.poll()
+    assert api_requests == []
+    assert not balancer._inflight.active()
+    assert balancer.metrics()['last_plan']['actions'] == [
+        {'action': Action.LAUNCH, 'reason': 'Launching new c5.4xlarge in cluster dev', 'queue': 'cpu.q',
+         'node_type': 'c5.4xlarge', 'count': 1}]
+
+
+def test_polls_act_on_their_plan(balancer, api_requests, monkeypatch):
+    monkeypatch.setattr(balancer, '_fetch_cluster', _waiting_for_slots)
+    balancer.dry_run = False
+    balancer.poll()
+    assert api_requests == ['/nodes/add?instance_type=c5.4xlarge']
+    assert _actions(balancer._last_plan) == [(Action.LAUNCH, 1)]
+
+
+def test_current_plan_changes_no_state(balancer, api_requests, monkeypatch):
+    balancer._draining_hosts = {'dev-node001'}
+    balancer._host_launch_times = {'dev-node001': time.time() - 3600}
+    monkeypatch.setattr(balancer, '_fetch_cluster', lambda: cluster(
+        [host('dev-node001', 'cpu.q', 4, state='d'), host('dev-node002', 'cpu.q', 4)]))
+    plan = balancer.current_plan()
+    assert _actions(plan) == [(Action.REMOVE, ['dev-node001'])]
+    assert api_requests == []
+    assert balancer._draining_hosts == {'dev-node001'}
+    assert list(balancer._host_launch_times) == ['dev-node001']
+    # Only polls record their plan.
+    assert balancer.metrics()['last_plan'] is None
+    assert balancer.metrics()['last_plan_ms'] is None
+
+
+def test_current_plan_is_none_if_the_cluster_is_unavailable(balancer, monkeypatch):
+    monkeypatch.setattr(balancer, '_fetch_cluster', lambda: None)
+    assert balancer.current_plan() is None
+    balancer.poll()
+    assert balancer.metrics()['last_plan'] is None
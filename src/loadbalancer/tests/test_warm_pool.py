@@ -0,0 +1,67 @@
+import pytest
+
+import config
+from plan import Action
+from sge_queue import SGEQueue
+
+from fake_cluster import cluster
+from fake_cluster import host
+from fake_cluster import job
+
+
+def _gpu_queue(**kwargs):
+    return SGEQueue('gpu.q', 'p3.2xlarge', {'p3.2xlarge': 1, 'p3.8xlarge': 4}, max_nodes=4, **kwargs)
+
+
+def _actions(plan):
+    return [(a.kind, a.count if a.kind == Action.LAUNCH else a.hosts) for a in plan.actions]
+
+
+def test_default_queues_have_no_warm_pool():
+    assert [queue.warm_pool_slots() for queue in config.queues] == [0] * len(config.queues)
+
+
+@pytest.mark.parametrize('min_idle_slots, node_cost, budget, expected', [
+    (0, 3.06, 10.0, 0),
+    (3, None, None, 3),
+    (3, 3.06, None, 3),
+    (3, 3.06, 3.06, 1),
+    (3, 3.06, 6.5, 2),
+    (3, 3.06, 1.0, 0),
+])
+def test_warm_pool_slots_are_capped_by_budget(min_idle_slots, node_cost, budget, expected):
+    queue = _gpu_queue(min_idle_slots=min_idle_slots, node_cost_per_hour=node_cost, warm_pool_budget_per_hour=budget)
+    assert queue.warm_pool_slots() == expected
+
+
+def test_remove_idle_keeps_the_warm_pool(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [_gpu_queue(min_idle_slots=1)])
+    idle = cluster([host('dev-node001', 'gpu.q', 1), host('dev-node002', 'gpu.q', 1)])
+    assert _actions(balancer.plan(idle)) == [(Action.DRAIN, ['dev-node002'])]
+
+
+def test_remove_idle_removes_nodes_without_a_warm_pool(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [_gpu_queue()])
+    idle = cluster([host('dev-node001', 'gpu.q', 1), host('dev-node002', 'gpu.q', 1)])
+    assert _actions(balancer.plan(idle)) == [(Action.DRAIN, ['dev-node001']), (Action.DRAIN, ['dev-node002'])]
+
+
+def test_launches_for_waiting_jobs_are_topped_up_to_the_warm_pool(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [_gpu_queue(min_idle_slots=2)])
+    busy = cluster([host('dev-node001', 'gpu.q', 1, slots_used=1)],
+                   [job(1, 'gpu.q', running=True), job(2, 'gpu.q')])
+    # One node for the waiting job, then two for the pool.
+    assert _actions(balancer.plan(busy)) == [(Action.LAUNCH, 1), (Action.LAUNCH, 2)]
+
+
+def test_warm_pool_launches_stop_at_max_nodes(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [_gpu_queue(min_idle_slots=8)])
+    busy = cluster([host('dev-node001', 'gpu.q', 1, slots_used=1)], [job(1, 'gpu.q', running=True)])
+    assert _actions(balancer.plan(busy)) == [(Action.LAUNCH, 3)]
+
+
+def test_warm_pool_launches_are_capped_by_budget(balancer, monkeypatch):
+    monkeypatch.setattr(config, 'queues', [
+        _gpu_queue(min_idle_slots=3, node_cost_per_hour=3.06, warm_pool_budget_per_hour=3.06)])
+    busy = cluster([host('dev-node001', 'gpu.q', 1, slots_used=1)], [job(1, 'gpu.q', running=True)])
+    assert _actions(balancer.plan(busy)) == [(Action.LAUNCH, 1)]